@@ -380,7 +380,7 @@ def llm_sql(question:str, schema:str, prev_error: str | None = None, prev_sql: s
     "Add LIMIT 200 if no limit. The database is read-only."
     "The dataset consists of Level 3 order data."
     "When orders don't agree on price, all pending orders are kept in the order book until they are matched."
-    "Whenever orders are matched, we get an execution event that shows the volume BUT USUALLY has NULL as price. The price has to be inferred from the referenced order."
+    "Whenever orders are matched, we get an execution event that shows the volume, the price and the side of the executed order. The price is only NULL if the order was placed before the loaded data, then it has to be inferred from the referenced order."
     "Upated orders are inserted as new events that reference the original order id."
     "The timestamps are nanoseconds since midnight of the day the trades were recorded. It's a historic dataset and we don't have the actual date. This means you can't filter by date, only by time of day."
   )
@@ -0,0 +1,184 @@
+"""Batch driver for backfills: parses many daily ITCH 5.0 dumps concurrently, each into its own output directory.
+
+The dumps come from a directory or from a manifest with one dump per line, optionally followed by its expected sha256
+like in prepare.sh. Every day is parsed by its own parser.py process, at most --jobs at a time, into
+<outputDir>/<day>/. Once a day is complete, the sha256 of its dump, the parser arguments and the sizes of its outputs
+are recorded in <outputDir>/<day>/done.json. Later runs skip the days whose dump, arguments and outputs still match
+it, so an interrupted backfill is simply started again. A report of all days is written to <outputDir>/report.json.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+PARSER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser.py")
+DONE_FILE = "done.json"
+LOG_FILE = "parser.log"
+REPORT_FILE = "report.json"
+# Files in a day directory that aren't parser outputs
+BOOKKEEPING_FILES = {DONE_FILE, LOG_FILE, "checkpoint.pickle", "checkpoint.pickle.tmp"}
+
+
+def fileHash(path):
+    """sha256 of a file, like sha256sum in prepare.sh"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(16 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dayName(path):
+    name = os.path.basename(path)
+    return name[:-3] if name.endswith(".gz") else name
+
+
+def findDumps(source, pattern):
+    """(path, expected sha256 or None) of every dump in a directory or manifest. If a day is there both gzipped and
+    unzipped, the unzipped dump is taken, the parser can seek in it."""
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source)
+                       if fnmatch.fnmatch(name, pattern) and not name.endswith(".idx"))
+        dumps = [(os.path.join(source, name), None) for name in names]
+    else:
+        dumps = []
+        baseDir = os.path.dirname(os.path.abspath(source))
+        with open(source) as file:
+            for line in file:
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                dumps.append((os.path.join(baseDir, fields[0]), fields[1] if len(fields) > 1 else None))
+    days = {}
+    for path, expectedHash in dumps:
+        day = dayName(path)
+        if day not in days or not path.endswith(".gz"):
+            days[day] = (path, expectedHash)
+    return [days[day] for day in sorted(days)]
+
+
+def outputSizes(dayDir, statsName=None):
+    return {name: os.path.getsize(os.path.join(dayDir, name)) for name in sorted(os.listdir(dayDir))
+            if name not in BOOKKEEPING_FILES and name != statsName}
+
+
+def hasFlag(parserArgs, *flags):
+    """Whether one of the flags is among the arguments, as '--flag value' or '--flag=value'"""
+    return any(arg == flag or arg.startswith(flag + "=") for arg in parserArgs for flag in flags)
+
+
+def isDone(dayDir, inputHash, parserArgs, statsName):
+    """Whether the day was completed from the same dump with the same arguments and its outputs are untouched"""
+    try:
+        with open(os.path.join(dayDir, DONE_FILE)) as file:
+            done = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return (done.get("sha256") == inputHash and done.get("arguments") == parserArgs
+            and done.get("outputs") == outputSizes(dayDir, statsName))
+
+
+def processDay(dump, expectedHash, outputDir, parserArgs, force, statsName):
+    """Parse one day unless it is done already, returns its entry of the run report"""
+    day = dayName(dump)
+    dayDir = os.path.join(outputDir, day)
+    # The statistics don't change the outputs, so they aren't part of the recorded arguments
+    runArgs = parserArgs if statsName is None else [*parserArgs, "--stats", os.path.join(dayDir, statsName)]
+    report = {"day": day, "dump": dump}
+    start = time.perf_counter()
+    try:
+        inputHash = fileHash(dump)
+        report["sha256"] = inputHash
+        if expectedHash is not None and inputHash != expectedHash:
+            raise ValueError(f"sha256 {inputHash} doesn't match the manifest ({expectedHash})")
+        if not force and isDone(dayDir, inputHash, parserArgs, statsName):
+            report["status"] = "skipped"
+            report["outputBytes"] = sum(outputSizes(dayDir, statsName).values())
+            return report
+
+        os.makedirs(dayDir, exist_ok=True)
+        # A previous, incomplete or outdated result is not done anymore, even if this run fails
+        if os.path.exists(os.path.join(dayDir, DONE_FILE)):
+            os.remove(os.path.join(dayDir, DONE_FILE))
+        with open(os.path.join(dayDir, LOG_FILE), "wb") as log:
+            exitCode = subprocess.run([sys.executable, PARSER, dump, dayDir, *runArgs],
+                                      stdout=log, stderr=subprocess.STDOUT).returncode
+        if exitCode != 0:
+            raise RuntimeError(f"parser.py failed with exit code {exitCode}, see {os.path.join(dayDir, LOG_FILE)}")
+
+        outputs = outputSizes(dayDir, statsName)
+        with open(os.path.join(dayDir, DONE_FILE), "w") as file:
+            json.dump({"dump": dump, "sha256": inputHash, "arguments": parserArgs, "outputs": outputs}, file,
+                      indent=2)
+        report["status"] = "parsed"
+        report["outputBytes"] = sum(outputs.values())
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = str(e)
+    finally:
+        report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Parse many ITCH dumps concurrently. Arguments not listed here are passed on to parser.py, "
+                    "e.g. --engine numpy or --window-start 09:30.")
+    parser.add_argument("source", type=str,
+                        help="Directory with the dumps, or a manifest file with one dump path (relative to the "
+                             "manifest) and optionally its expected sha256 per line")
+    parser.add_argument("outputDir", type=str, help="Every day is written to its own subdirectory")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of days parsed at the same time")
+    parser.add_argument("--pattern", type=str, default="*ITCH50*",
+                        help="File name pattern of the dumps in a source directory (default: *ITCH50*)")
+    parser.add_argument("--force", action="store_true", help="Parse all days again, even those that are done")
+    parser.add_argument("--stats", type=str, metavar="NAME",
+                        help="Pass --stats to parser.py, writing the statistics of every day to <outputDir>/<day>/NAME")
+    (args, parserArgs) = parser.parse_known_args()
+    if hasFlag(parserArgs, "--db", "--workers"):
+        parser.error("every day is parsed into its own directory by a single process, --db and --workers aren't "
+                     "supported")
+
+    dumps = findDumps(args.source, args.pattern)
+    if not dumps:
+        parser.error(f"no dumps found in {args.source}")
+    os.makedirs(args.outputDir, exist_ok=True)
+    print(f"Processing {len(dumps)} days with {args.jobs} jobs ...")
+
+    start = time.perf_counter()
+    reports = []
+    # Every day runs in its own parser.py process, the threads only wait for them
+    with ThreadPoolExecutor(args.jobs) as pool:
+        futures = [pool.submit(processDay, dump, expectedHash, args.outputDir, parserArgs, args.force, args.stats)
+                   for dump, expectedHash in dumps]
+        for future in futures:
+            report = future.result()
+            reports.append(report)
+            print(f"{report['day']}: {report['status']} in {report['seconds']:.1f}s"
+                  + (f" ({report['error']})" if "error" in report else ""))
+
+    statuses = [report["status"] for report in reports]
+    summary = {
+        "seconds": time.perf_counter() - start,
+        "jobs": args.jobs,
+        "arguments": parserArgs,
+        **{status: statuses.count(status) for status in ("parsed", "skipped", "failed")},
+        "outputBytes": sum(report.get("outputBytes", 0) for report in reports),
+        "days": reports,
+    }
+    with open(os.path.join(args.outputDir, REPORT_FILE), "w") as file:
+        json.dump(summary, file, indent=2)
+    print(f"{summary['parsed']} parsed, {summary['skipped']} skipped, {summary['failed']} failed in "
+          f"{summary['seconds']:.1f}s, report in {os.path.join(args.outputDir, REPORT_FILE)}")
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
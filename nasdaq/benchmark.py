@@ -0,0 +1,193 @@
+"""Throughput benchmark of parser.py, runs offline on a synthetic dump from generate.py or on any given dump.
+
+Every parsing mode runs parser.py in a separate process over the whole dump (the replay window is extended to the
+end of the day) and is reported with messages/s, MB/s of uncompressed input and the peak RSS of its largest process.
+The decode cost per message type is taken from a second run of every mode with --stats (except for the workers mode,
+which doesn't support it). The handlers of the Python engine are also timed in-process on a prefix of the dump, once
+encoding CSV lines and once creating records.
+"""
+from tempfile import TemporaryDirectory
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import generate
+import parser as itch
+
+PARSER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser.py")
+
+# parser.py arguments of each mode, DUMP and GZIP_DUMP are replaced with the dump paths
+MODES = {
+    "python": ["DUMP"],
+    "numpy": ["DUMP", "--engine", "numpy"],
+    "gzip": ["GZIP_DUMP"],
+    "workers": ["DUMP", "--workers", "WORKERS"],
+    "parquet": ["DUMP", "--format", "parquet"],
+    "arrow": ["DUMP", "--format", "arrow"],
+    "book": ["DUMP", "--book"],
+    "candles": ["DUMP", "--candles", "1s,10s,1m"],
+}
+
+
+def countMessages(fileContent):
+    """Number of messages per type byte"""
+    counts = {}
+    offset = 0
+    while offset < len(fileContent):
+        msgType = fileContent[offset + 2]
+        counts[msgType] = counts.get(msgType, 0) + 1
+        offset += (fileContent[offset] << 8 | fileContent[offset + 1]) + 2
+    return counts
+
+
+# Modes that can't be run with --stats
+UNTIMED_MODES = {"workers"}
+
+
+def runMode(name, dump, gzipDump, workers, tmpDir, statsFile=None):
+    """Run parser.py in one mode, returns the elapsed seconds and the peak RSS in bytes"""
+    outputDir = os.path.join(tmpDir, name)
+    args = [{"DUMP": dump, "GZIP_DUMP": gzipDump, "WORKERS": str(workers)}.get(arg, arg) for arg in MODES[name]]
+    command = [sys.executable, PARSER, args[0], outputDir, *args[1:], "--window-end", "24:00"]
+    if statsFile is not None:
+        command += ["--stats", statsFile]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    # The rusage of wait4 covers the whole process tree, ru_maxrss is the peak of its largest process in KiB
+    (_, status, usage) = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(outputDir, ignore_errors=True)
+    exitCode = os.waitstatus_to_exitcode(status)
+    if exitCode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed with exit code {exitCode}")
+    return elapsed, usage.ru_maxrss * 1024
+
+
+def modeDecodeCost(name, dump, gzipDump, tmpDir):
+    """Run parser.py in one mode with --stats, returns the average decode nanoseconds per message type"""
+    statsFile = os.path.join(tmpDir, f"{name}.stats.json")
+    runMode(name, dump, gzipDump, 1, tmpDir, statsFile)
+    with open(statsFile) as file:
+        types = json.load(file)["types"]
+    return {msgType: counters["decodeSeconds"] * 1e9 / counters["messages"] for msgType, counters in types.items()
+            if counters["decodeSeconds"] > 0}
+
+
+def decodeCost(fileContent, sampleSize, encoded):
+    """Count and average nanoseconds per message type for decoding (and encoding to CSV if `encoded`) the first
+    messages"""
+    decoders = itch.decoderTable(itch.WINDOWED_OUTPUTS if encoded else ())
+    orders = itch.OrderIndex()
+    clock = time.perf_counter_ns
+    # Overhead of taking the time twice, subtracted from every measurement
+    overhead = min(-clock() + clock() for _ in range(10000))
+    totals = {}
+    offset = 0
+    for _ in range(sampleSize):
+        if offset >= len(fileContent):
+            break
+        msgType = fileContent[offset + 2]
+        decoder = decoders[msgType]
+        if decoder is not None:
+            (handler, kind) = decoder
+            if kind in itch.WINDOWED_OUTPUTS:
+                start = clock()
+                handler(fileContent, offset + 2, orders)
+                elapsed = clock() - start
+            else:
+                start = clock()
+                handler(fileContent, offset + 2)
+                elapsed = clock() - start
+            (count, total) = totals.get(msgType, (0, 0))
+            totals[msgType] = (count + 1, total + max(elapsed - overhead, 0))
+        offset += (fileContent[offset] << 8 | fileContent[offset + 1]) + 2
+    return {chr(msgType): (count, total / count) for msgType, (count, total) in sorted(totals.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing modes of parser.py.")
+    parser.add_argument("dumpFile", type=str, nargs="?",
+                        help="Dump to parse, gzipped dumps (*.gz) are decompressed first. By default, a synthetic dump "
+                             "is generated with generate.py")
+    parser.add_argument("--messages", type=int, default=2000000, help="Size of the generated dump")
+    parser.add_argument("--stocks", type=int, default=500, help="Number of stocks in the generated dump")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated dump")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=["python", "numpy", "gzip", "workers"],
+                        metavar=",".join(MODES), help="Parsing modes to run (default: python,numpy,gzip,workers)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes of the workers mode")
+    parser.add_argument("--sample", type=int, default=1000000,
+                        help="Number of messages the per-type decode cost is measured on")
+    parser.add_argument("--json", type=str, help="Also write the results to this file")
+    args = parser.parse_args()
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode}, choose from {', '.join(MODES)}")
+
+    with TemporaryDirectory() as tmpDir:
+        dump = os.path.join(tmpDir, "dump.itch")
+        if args.dumpFile is None:
+            print(f"Generating {args.messages} messages of {args.stocks} stocks ...")
+            with open(dump, "wb", buffering=1 << 20) as file:
+                generate.Generator(file, args.stocks, args.seed).run(
+                    args.messages, generate.parseMix(generate.DEFAULT_MIX), itch.parseTime("04:00"),
+                    itch.parseTime("16:00"))
+        elif args.dumpFile.endswith(".gz"):
+            with gzip.open(args.dumpFile, "rb") as source, open(dump, "wb") as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+        else:
+            dump = args.dumpFile
+        gzipDump = args.dumpFile if args.dumpFile and args.dumpFile.endswith(".gz") else None
+        if "gzip" in args.modes and gzipDump is None:
+            gzipDump = os.path.join(tmpDir, "dump.itch.gz")
+            with open(dump, "rb") as source, gzip.open(gzipDump, "wb", compresslevel=6) as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+
+        fileContent = itch.mapDump(dump)
+        counts = countMessages(fileContent)
+        messages = sum(counts.values())
+        size = len(fileContent)
+        results = {"messages": messages, "bytes": size, "types": {chr(t): n for t, n in sorted(counts.items())},
+                   "modes": {}}
+
+        print(f"{messages} messages, {size / 1e6:.1f} MB")
+        print(f"{'mode':<10}{'seconds':>10}{'msgs/s':>14}{'MB/s':>10}{'peak RSS MB':>14}")
+        for mode in args.modes:
+            (elapsed, peakRss) = runMode(mode, dump, gzipDump, args.workers, tmpDir)
+            results["modes"][mode] = {"seconds": elapsed, "messagesPerSecond": messages / elapsed,
+                                      "megabytesPerSecond": size / elapsed / 1e6, "peakRssBytes": peakRss}
+            print(f"{mode:<10}{elapsed:>10.2f}{messages / elapsed:>14,.0f}{size / elapsed / 1e6:>10.1f}"
+                  f"{peakRss / 1e6:>14.1f}")
+
+        timedModes = [mode for mode in args.modes if mode not in UNTIMED_MODES]
+        modeCosts = {mode: modeDecodeCost(mode, dump, gzipDump, tmpDir) for mode in timedModes}
+        results["modeDecodeNanoseconds"] = modeCosts
+        print("\nDecode cost per message with --stats (ns)")
+        print(f"{'type':<6}" + "".join(f"{mode:>10}" for mode in timedModes))
+        for msgType in sorted(set().union(*modeCosts.values())):
+            print(f"{msgType:<6}" + "".join(f"{modeCosts[mode][msgType]:>10.0f}" if msgType in modeCosts[mode]
+                                            else f"{'-':>10}" for mode in timedModes))
+        if any(mode in UNTIMED_MODES for mode in args.modes):
+            print("The workers mode doesn't support --stats, its workers decode like the python mode")
+
+        csvCost = decodeCost(fileContent, args.sample, encoded=True)
+        recordCost = decodeCost(fileContent, args.sample, encoded=False)
+        results["decodeNanoseconds"] = {msgType: {"count": count, "csv": cost, "records": recordCost[msgType][1]}
+                                        for msgType, (count, cost) in csvCost.items()}
+        print(f"\nDecode cost per message of the Python engine handlers on the first {args.sample} messages (ns)")
+        print(f"{'type':<6}{'count':>12}{'CSV':>10}{'records':>10}")
+        for msgType, (count, cost) in csvCost.items():
+            print(f"{msgType:<6}{count:>12}{cost:>10.0f}{recordCost[msgType][1]:>10.0f}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""OHLCV candles aggregated from the executions while parsing, used by `parser.py --candles`.
+
+Executions arrive in timestamp order, so only the candles of the current bucket are kept. They are written, ordered
+by stock, as soon as the first execution of a later bucket arrives. Buckets without executions are not written.
+"""
+
+
+class CandleAggregator:
+    """Open, high, low, close price and traded volume (shares) per stock and bucket of `size` nanoseconds"""
+
+    def __init__(self, writer, size):
+        self.writer = writer
+        self.size = size
+        self.bucket = None
+        self.candles = {}  # stockId -> [open, high, low, close, volume] of the current bucket
+
+    def add(self, timestamp, stockId, quantity, price):
+        bucket = timestamp - timestamp % self.size
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+        candle = self.candles.get(stockId)
+        if candle is None:
+            self.candles[stockId] = [price, price, price, price, quantity]
+            return
+        if price > candle[1]:
+            candle[1] = price
+        elif price < candle[2]:
+            candle[2] = price
+        candle[3] = price
+        candle[4] += quantity
+
+    def flush(self):
+        for stockId in sorted(self.candles):
+            self.writer.writerow((stockId, self.bucket, *self.candles[stockId]))
+        self.candles.clear()
+
+
+class CandleTee:
+    """Executions writer that also adds every execution with a known price to the candle aggregators"""
+
+    def __init__(self, writer, aggregators):
+        self.writer = writer
+        self.aggregators = aggregators
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        (timestamp, _, stockId, quantity, price, _) = row
+        if price is not None:
+            for aggregator in self.aggregators:
+                aggregator.add(timestamp, stockId, quantity, price)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writecolumns(self, columns):
+        self.writer.writecolumns(columns)
+        (timestamps, _, stockIds, quantities, prices, _) = columns
+        # Unresolved prices are masked, they are None in the list
+        for timestamp, stockId, quantity, price in zip(timestamps.tolist(), stockIds.tolist(), quantities.tolist(),
+                                                       prices.tolist()):
+            if price is not None:
+                for aggregator in self.aggregators:
+                    aggregator.add(timestamp, stockId, quantity, price)
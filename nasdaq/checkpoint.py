@@ -0,0 +1,106 @@
+"""Checkpoints of a CSV parsing run, used by `parser.py --checkpoint-every` and `--resume`.
+
+A checkpoint is taken between two messages: every CSV writer is flushed, its background thread drained and its file
+synced, and the file sizes are stored with the input offset and the state that carries over to the rest of the dump:
+the seen and selected stocks, the order index and, if enabled, the order book and the candles of the current bucket.
+Resuming truncates every output to its size at the checkpoint and continues parsing at the checkpointed offset, so
+everything written after the checkpoint is written again, exactly once.
+"""
+import os
+import pickle
+
+CHECKPOINT_FILE = "checkpoint.pickle"
+# Arguments that don't change the output, a run may be resumed with different values. The dump is identified by its
+# size and modification time instead of its path.
+RESUMABLE_ARGUMENTS = {"dumpFile", "outputDir", "engine", "stats", "resume", "checkpoint_every"}
+BOOK_FIELDS = ("orders", "levels", "prices", "changed", "tops", "nextSnapshot")
+CANDLE_FIELDS = ("bucket", "candles")
+
+
+class Checkpoints:
+    """Writes a checkpoint to <outputDir>/checkpoint.pickle every `interval` messages. `writers` (the CSV writers by
+    output name) and `aggregators` (the candle aggregators) have to be set before parsing starts."""
+
+    def __init__(self, outputDir, interval, sourceFile, arguments):
+        self.path = os.path.join(outputDir, CHECKPOINT_FILE)
+        self.outputDir = outputDir
+        self.interval = interval
+        stat = os.stat(sourceFile)
+        self.arguments = {key: value for key, value in arguments.items() if key not in RESUMABLE_ARGUMENTS}
+        self.arguments["dumpIdentity"] = (stat.st_size, stat.st_mtime_ns)
+        self.writers = {}
+        self.aggregators = []
+        self.resumed = None  # the loaded checkpoint
+        self.lastCount = 0
+
+    def load(self):
+        """Load the last checkpoint of the output directory, returns the output sizes to truncate to or None if there
+        is no checkpoint"""
+        try:
+            with open(self.path, "rb") as file:
+                checkpoint = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        if checkpoint["arguments"] != self.arguments:
+            changed = sorted(key for key in self.arguments.keys() | checkpoint["arguments"].keys()
+                             if self.arguments.get(key) != checkpoint["arguments"].get(key))
+            raise ValueError(f"{self.path} was taken with different arguments or dump: {', '.join(changed)}")
+        for name, size in checkpoint["sizes"].items():
+            path = os.path.join(self.outputDir, name + ".csv")
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                raise ValueError(f"{path} is shorter than at the checkpoint")
+        self.resumed = checkpoint
+        self.lastCount = checkpoint["msgCount"]
+        return checkpoint["sizes"]
+
+    def restore(self, state):
+        """Restore the loaded checkpoint into the parser state, returns the input offset to continue at or None"""
+        checkpoint = self.resumed
+        if checkpoint is None:
+            return None
+        state.msgCount = checkpoint["msgCount"]
+        state.seenStocks = checkpoint["seenStocks"]
+        state.selectedStocks = checkpoint["selectedStocks"]
+        state.orders.orders = checkpoint["orders"]
+        if state.book is not None:
+            for field, value in zip(BOOK_FIELDS, checkpoint["book"]):
+                setattr(state.book, field, value)
+        for aggregator, fields in zip(self.aggregators, checkpoint["candles"]):
+            for field, value in zip(CANDLE_FIELDS, fields):
+                setattr(aggregator, field, value)
+        print(f"Resuming at offset {checkpoint['offset']} after {checkpoint['msgCount']} messages")
+        return checkpoint["offset"]
+
+    def due(self, msgCount):
+        return msgCount >= self.nextCount()
+
+    def nextCount(self):
+        """Message count at which the next checkpoint is due"""
+        return self.lastCount + self.interval
+
+    def save(self, state, offset):
+        """Take a checkpoint before the message at the given input offset"""
+        checkpoint = {
+            "arguments": self.arguments,
+            "offset": offset,
+            "msgCount": state.msgCount,
+            # Sync every output first, the checkpoint must not reference data that isn't on disk
+            "sizes": {name: writer.sync() for name, writer in self.writers.items()},
+            "seenStocks": state.seenStocks,
+            "selectedStocks": state.selectedStocks,
+            "orders": state.orders.orders,
+            "book": None if state.book is None else [getattr(state.book, field) for field in BOOK_FIELDS],
+            "candles": [[getattr(aggregator, field) for field in CANDLE_FIELDS] for aggregator in self.aggregators],
+        }
+        # Replace the previous checkpoint atomically, a crash while saving leaves the previous one intact
+        with open(self.path + ".tmp", "wb") as file:
+            pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.lastCount = state.msgCount
+
+    def remove(self):
+        """Drop the checkpoint once the run is complete"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -188,8 +188,8 @@ void NasdaqClient::sendOrderbookReduce(uint64_t orderId, unsigned quantity) cons
 
 void NasdaqClient::sendExecution(const Execution& execution) const
 {
-    const char* paramValues[5];
-    int paramLengths[5];
+    const char* paramValues[6];
+    int paramLengths[6];
 
 
     auto tsStr = std::to_string(execution.timestamp);
@@ -202,16 +202,18 @@ void NasdaqClient::sendExecution(const Execution& execution) const
     paramValues[2] = stockStr.c_str();
     paramValues[3] = quantStr.c_str();
     paramValues[4] = execution.price.empty() ? nullptr : execution.price.c_str();
+    paramValues[5] = execution.side.empty() ? nullptr : execution.side.c_str();
 
     paramLengths[0] = strlen(paramValues[0]);
     paramLengths[1] = strlen(paramValues[1]);
     paramLengths[2] = strlen(paramValues[2]);
     paramLengths[3] = strlen(paramValues[3]);
     paramLengths[4] = execution.price.empty() ? 0 : strlen(paramValues[4]);
+    paramLengths[5] = execution.side.empty() ? 0 : strlen(paramValues[5]);
 
 
 
-    if (PQsendQueryPrepared(conn, "newExecution", 5, paramValues, paramLengths, nullptr, 0) != 1)
+    if (PQsendQueryPrepared(conn, "newExecution", 6, paramValues, paramLengths, nullptr, 0) != 1)
         throw std::runtime_error("could not add new execution");
 }
 
@@ -256,16 +258,16 @@ void NasdaqClient::runExchange(const std::string& ordersPath, const std::string&
     auto startTime = time_point_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now()).time_since_epoch().count();
 
     io::CSVReader<8, io::trim_chars<' '>, io::no_quote_escape<';'>> orderReader(ordersPath);
-    io::CSVReader<5, io::trim_chars<' '>, io::no_quote_escape<';'>> executionsReader(executionsPath);
+    io::CSVReader<6, io::trim_chars<' '>, io::no_quote_escape<';'>> executionsReader(executionsPath);
     io::CSVReader<4, io::trim_chars<' '>, io::no_quote_escape<';'>> cancellationsReader(cancellationsPath);
 
     orderReader.read_header(io::ignore_extra_column, "stockId", "timestamp", "orderId", "side", "quantity", "price", "attribution", "prevOrder");
-    executionsReader.read_header(io::ignore_extra_column, "timestamp", "orderId", "stockId", "quantity", "price");
+    executionsReader.read_header(io::ignore_extra_column, "timestamp", "orderId", "stockId", "quantity", "price", "side");
     cancellationsReader.read_header(io::ignore_extra_column, "timestamp", "orderId", "stockId", "quantity");
 
 
     prepare(conn, "newOrder", "INSERT INTO orders VALUES($1, $2, $3, $4, $5, $6, $7, $8);");
-    prepare(conn, "newExecution", "INSERT INTO executions VALUES($1, $2, $3, $4, $5);");
+    prepare(conn, "newExecution", "INSERT INTO executions VALUES($1, $2, $3, $4, $5, $6);");
     prepare(conn, "newCancellation", "INSERT INTO cancellations VALUES($1, $2, $3, $4);");
     prepare(conn, "addToOrderbook", "INSERT INTO orderbook VALUES($1, $2, $3, $4, $5);");
     prepare(conn, "deleteFromOrderbook", "DELETE FROM orderbook WHERE orderId = $1;");
@@ -281,7 +283,7 @@ void NasdaqClient::runExchange(const std::string& ordersPath, const std::string&
     Cancellation cancellation;
     // Populate the first values
     orderReader.read_row(order.stockId, order.timestamp, order.orderId, order.side, order.quantity, order.price, order.attribution, order.prevOrder);
-    executionsReader.read_row(execution.timestamp, execution.orderId, execution.stockId, execution.quantity, execution.price);
+    executionsReader.read_row(execution.timestamp, execution.orderId, execution.stockId, execution.quantity, execution.price, execution.side);
     cancellationsReader.read_row(cancellation.timestamp, cancellation.orderId, cancellation.stockId, cancellation.quantity);
     uint64_t base = order.timestamp; // We treat the first order after all preloaded orders as t0.
 
@@ -330,7 +332,7 @@ void NasdaqClient::runExchange(const std::string& ordersPath, const std::string&
                 ++counter;
             }
 
-            executionsReader.read_row(execution.timestamp, execution.orderId, execution.stockId, execution.quantity, execution.price);
+            executionsReader.read_row(execution.timestamp, execution.orderId, execution.stockId, execution.quantity, execution.price, execution.side);
             assert(execution.timestamp >= prevTimestamp);
             prevTimestamp = execution.timestamp;
         }
@@ -47,6 +47,7 @@ private:
         unsigned stockId;
         unsigned quantity;
         std::string price;
+        std::string side;
     };
 
     struct Cancellation
@@ -1,3 +1,7 @@
+drop table if exists orderbookdepth;
+drop table if exists candles_1s;
+drop table if exists candles_10s;
+drop table if exists candles_1m;
 drop table if exists orderbook;
 drop table if exists executions;
 drop table if exists cancellations;
@@ -52,7 +56,8 @@ create table executions
     orderId     bigint,
     stockId     int not null,
     quantity    int not null,
-    price       numeric(10,4)
+    price       numeric(10,4),
+    side        text
 );
 
 create table cancellations
@@ -72,9 +77,56 @@ create table orderbook
     quantity    int,
     primary key(orderid, price)
 );
+
+create table orderbookdepth
+(
+    timestamp   bigint not null,
+    stockId     int not null,
+    side        text not null,
+    level       int not null,
+    price       numeric(10,4) not null,
+    quantity    bigint not null
+);
+
+create table candles_1s
+(
+    stockId     int not null,
+    timestamp   bigint not null,
+    open        numeric(10,4) not null,
+    high        numeric(10,4) not null,
+    low         numeric(10,4) not null,
+    close       numeric(10,4) not null,
+    volume      bigint not null,
+    primary key(stockId, timestamp)
+);
+
+create table candles_10s
+(
+    stockId     int not null,
+    timestamp   bigint not null,
+    open        numeric(10,4) not null,
+    high        numeric(10,4) not null,
+    low         numeric(10,4) not null,
+    close       numeric(10,4) not null,
+    volume      bigint not null,
+    primary key(stockId, timestamp)
+);
+
+create table candles_1m
+(
+    stockId     int not null,
+    timestamp   bigint not null,
+    open        numeric(10,4) not null,
+    high        numeric(10,4) not null,
+    low         numeric(10,4) not null,
+    close       numeric(10,4) not null,
+    volume      bigint not null,
+    primary key(stockId, timestamp)
+);
 commit;
 
 create index on orderbook(orderId);
 create index on cancellations(timestamp);
 create index on executions(timestamp);
 create index on orders(timestamp);
+create index on orderbookdepth(stockId, timestamp);
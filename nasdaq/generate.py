@@ -0,0 +1,203 @@
+"""Deterministic synthetic ITCH 5.0 dumps, to test and benchmark parser.py without the NASDAQ download.
+
+The dump starts with a system event and the stock directory and market maker entries of every stock, followed by a
+random sequence of order messages in timestamp order. Every message only references live orders, executed and
+cancelled shares never exceed the open quantity of an order, and orders are gone once fully executed, cancelled,
+deleted or replaced, just like in the real feed. The same arguments always produce the same file.
+"""
+import argparse
+import gzip
+import random
+import struct
+
+from parser import parseTime
+
+# Complete message layouts starting at the message type byte: type, stock locate, tracking number, timestamp, ...
+SYSTEM_EVENT = struct.Struct("!cHHHIc")
+STOCK_DIRECTORY = struct.Struct("!cHHHI8sccIcc2scccccIc")
+MARKET_MAKER = struct.Struct("!cHHHI4s8sccc")
+ORDER_ADD = struct.Struct("!cHHHIQcI8sI")
+ORDER_ADD_WITH_MPID = struct.Struct("!cHHHIQcI8sI4s")
+ORDER_EXECUTE = struct.Struct("!cHHHIQIQ")
+ORDER_EXECUTE_WITH_PRICE = struct.Struct("!cHHHIQIQcI")
+ORDER_CANCEL = struct.Struct("!cHHHIQI")
+ORDER_DELETE = struct.Struct("!cHHHIQ")
+ORDER_REPLACE = struct.Struct("!cHHHIQQII")
+TRADE = struct.Struct("!cHHHIQcI8sIQ")
+LENGTH = struct.Struct("!H")
+
+# Share of each message type, roughly like a real trading day
+DEFAULT_MIX = "A=38,F=1,E=4,C=0.2,X=2,D=36,U=9,P=0.8,R=0.001,L=0.01"
+MIX_TYPES = "RLAFEXCDUP"
+ATTRIBUTIONS = [b"GSCO", b"MSCO", b"JPMS", b"CDRG", b"VIRT"]
+MARKET_MAKERS = [b"GSCO", b"MSCO", b"JPMS", b"CDRG", b"VIRT", b"UBSS"]
+
+
+def parseMix(value):
+    """Parse TYPE=WEIGHT,... into a dict, e.g. A=40,D=40,E=20"""
+    mix = {}
+    for part in value.split(","):
+        msgType, _, weight = part.partition("=")
+        if msgType not in MIX_TYPES or not weight:
+            raise argparse.ArgumentTypeError(f"invalid mix entry '{part}', expected TYPE=WEIGHT with TYPE in {MIX_TYPES}")
+        mix[msgType] = float(weight)
+    return mix
+
+
+class Generator:
+    def __init__(self, file, stocks, seed):
+        self.file = file
+        self.random = random.Random(seed)
+        self.symbols = [f"S{i:04d}".ljust(8).encode() for i in range(1, stocks + 1)]
+        # Reference price per stock in ten-thousandths of a dollar, moves in a random walk
+        self.prices = [self.random.randint(10000, 5000000) for _ in self.symbols]
+        self.nextOrderId = 1
+        self.nextMatch = 1
+        # Live orders: ids in a list for uniform random picks, and orderId -> [position, stockId, side, quantity, price]
+        self.live = []
+        self.orders = {}
+
+    def write(self, layout, *fields):
+        message = layout.pack(*fields)
+        self.file.write(LENGTH.pack(len(message)) + message)
+
+    def header(self, msgType, stockId, timestamp):
+        return msgType, stockId, 0, timestamp >> 32, timestamp & 0xFFFFFFFF
+
+    def stockDirectory(self, stockId, timestamp):
+        self.write(STOCK_DIRECTORY, *self.header(b'R', stockId, timestamp), self.symbols[stockId - 1], b'Q', b'N',
+                   100, b'N', b'C', b'Z ', b'P', b'N', b'N', b'1', b'N', 0, b'N')
+
+    def marketMaker(self, stockId, timestamp):
+        self.write(MARKET_MAKER, *self.header(b'L', stockId, timestamp), self.random.choice(MARKET_MAKERS),
+                   self.symbols[stockId - 1], self.random.choice((b'Y', b'N')), b'N', b'A')
+
+    def addLive(self, orderId, stockId, side, quantity, price):
+        self.orders[orderId] = [len(self.live), stockId, side, quantity, price]
+        self.live.append(orderId)
+
+    def removeLive(self, orderId):
+        position = self.orders.pop(orderId)[0]
+        last = self.live.pop()
+        if last != orderId:
+            self.live[position] = last
+            self.orders[last][0] = position
+
+    def limitPrice(self, stockId, side):
+        price = self.prices[stockId - 1] = max(self.prices[stockId - 1] + self.random.randint(-50, 50), 100)
+        offset = self.random.randint(0, 200)
+        # Prices are unsigned, bids close to the floor are kept at the smallest price
+        return max(price - offset, 1) if side == b'B' else price + offset
+
+    def add(self, msgType, timestamp):
+        stockId = self.random.randint(1, len(self.symbols))
+        side = self.random.choice((b'B', b'S'))
+        quantity = self.random.choice((100, 100, 100, 200, 300, 500, self.random.randint(1, 1000)))
+        price = self.limitPrice(stockId, side)
+        orderId = self.nextOrderId
+        self.nextOrderId += 1
+        fields = (*self.header(msgType, stockId, timestamp), orderId, side, quantity, self.symbols[stockId - 1], price)
+        if msgType == b'A':
+            self.write(ORDER_ADD, *fields)
+        else:
+            self.write(ORDER_ADD_WITH_MPID, *fields, self.random.choice(ATTRIBUTIONS))
+        self.addLive(orderId, stockId, side, quantity, price)
+
+    def reduce(self, orderId, quantity):
+        order = self.orders[orderId]
+        order[3] -= quantity
+        if order[3] == 0:
+            self.removeLive(orderId)
+
+    def update(self, msgType, timestamp):
+        orderId = self.random.choice(self.live)
+        (_, stockId, side, quantity, price) = self.orders[orderId]
+        header = self.header(msgType, stockId, timestamp)
+        if msgType in b"EC":
+            executed = self.random.randint(1, quantity)
+            match = self.nextMatch
+            self.nextMatch += 1
+            if msgType == b'E':
+                self.write(ORDER_EXECUTE, *header, orderId, executed, match)
+            else:
+                self.write(ORDER_EXECUTE_WITH_PRICE, *header, orderId, executed, match, b'Y',
+                           price + self.random.randint(-5, 5))
+            self.reduce(orderId, executed)
+        elif msgType == b'X':
+            cancelled = self.random.randint(1, quantity)
+            self.write(ORDER_CANCEL, *header, orderId, cancelled)
+            self.reduce(orderId, cancelled)
+        elif msgType == b'D':
+            self.write(ORDER_DELETE, *header, orderId)
+            self.removeLive(orderId)
+        else:
+            newOrderId = self.nextOrderId
+            self.nextOrderId += 1
+            newQuantity = self.random.randint(1, 1000)
+            newPrice = self.limitPrice(stockId, side)
+            self.write(ORDER_REPLACE, *header, orderId, newOrderId, newQuantity, newPrice)
+            self.removeLive(orderId)
+            self.addLive(newOrderId, stockId, side, newQuantity, newPrice)
+
+    def trade(self, timestamp):
+        stockId = self.random.randint(1, len(self.symbols))
+        side = self.random.choice((b'B', b'S'))
+        match = self.nextMatch
+        self.nextMatch += 1
+        self.write(TRADE, *self.header(b'P', stockId, timestamp), 0, side, self.random.randint(1, 500),
+                   self.symbols[stockId - 1], self.prices[stockId - 1], match)
+
+    def run(self, messages, mix, start, end):
+        self.write(SYSTEM_EVENT, *self.header(b'S', 0, start), b'O')
+        for stockId in range(1, len(self.symbols) + 1):
+            self.stockDirectory(stockId, start)
+            self.marketMaker(stockId, start)
+
+        msgTypes = [msgType.encode() for msgType in mix]
+        weights = list(mix.values())
+        # Draw the types in chunks, random.choices is much faster than one call per message
+        for first in range(0, messages, 1 << 16):
+            chunk = self.random.choices(msgTypes, weights, k=min(1 << 16, messages - first))
+            for i, msgType in enumerate(chunk, first):
+                timestamp = start + (end - start) * i // messages
+                if msgType in b"AF" or (msgType in b"ECXDU" and not self.live):
+                    self.add(msgType if msgType in b"AF" else b'A', timestamp)
+                elif msgType in b"ECXDU":
+                    self.update(msgType, timestamp)
+                elif msgType == b'P':
+                    self.trade(timestamp)
+                elif msgType == b'R':
+                    # Directory updates of a known stock, the parser only keeps the first entry
+                    self.stockDirectory(self.random.randint(1, len(self.symbols)), timestamp)
+                else:
+                    self.marketMaker(self.random.randint(1, len(self.symbols)), timestamp)
+        self.write(SYSTEM_EVENT, *self.header(b'S', 0, end), b'C')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic ITCH 5.0 dump.")
+    parser.add_argument("dumpFile", type=str, help="Path of the generated dump, gzipped if it ends with .gz")
+    parser.add_argument("--messages", type=int, default=1000000, help="Number of messages after the stock directory")
+    parser.add_argument("--stocks", type=int, default=100, help="Number of stocks")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random generator")
+    parser.add_argument("--mix", type=parseMix, default=DEFAULT_MIX, metavar="TYPE=WEIGHT,...",
+                        help=f"Relative frequency of the message types (default: {DEFAULT_MIX})")
+    parser.add_argument("--start", type=parseTime, default="04:00", metavar="HH:MM[:SS]",
+                        help="Timestamp of the first message (default: 04:00)")
+    parser.add_argument("--end", type=parseTime, default="16:00", metavar="HH:MM[:SS]",
+                        help="Timestamp of the last message (default: 16:00)")
+    args = parser.parse_args()
+    if not 1 <= args.stocks < 1 << 16:
+        parser.error("--stocks has to be between 1 and 65535")
+
+    if args.dumpFile.endswith(".gz"):
+        # A fixed mtime keeps the gzip header, and with it the file, reproducible
+        with open(args.dumpFile, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as file:
+            Generator(file, args.stocks, args.seed).run(args.messages, args.mix, args.start, args.end)
+    else:
+        with open(args.dumpFile, "wb", buffering=1 << 20) as file:
+            Generator(file, args.stocks, args.seed).run(args.messages, args.mix, args.start, args.end)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Lazy iteration over the decoded messages of an ITCH 5.0 dump, to use the decoder as a library without writing CSV
+files first:
+
+    from messages import iterMessages
+
+    for execution in iterMessages("data/01302020.NASDAQ_ITCH50.gz", types="ECP", symbols={"AAPL"}):
+        print(execution.timestamp, execution.quantity, execution.price)
+
+The records are the named tuples of parser.py (Order, Execution, Cancellation, StockDirectoryEntry and MarketMaker),
+prices are integer ten-thousandths of a dollar. Only the requested message types are decoded. Executions and replaced
+orders get the price and side of the order they reference, so the messages that add, reduce and remove orders are
+tracked in the order index even if they are not requested, without decoding them into records.
+"""
+from itertools import islice
+
+from parser import (DECODERS, MESSAGE_HEADER, ORDER_ADD_LAYOUT, ORDER_CANCEL_LAYOUT, ORDER_DELETE_LAYOUT,
+                    ORDER_EXECUTE_LAYOUT, ORDER_REPLACE_LAYOUT, STOCK, STOCK_DIRECTORY_ID, WINDOWED_OUTPUTS,
+                    ParseState, Window, gzipBlocks, loadOrBuildIndex, mapDump)
+
+# Whole trading day, the default window
+FULL_DAY = Window(0, 24 * 3600 * 1000000000, 0)
+
+# Types whose records depend on the order index
+RESOLVED_TYPES = {b'E', b'C', b'U'}
+
+
+# Order index updates of the order messages that are tracked but not requested, without creating a record.
+# 'F' starts like 'A' and 'C' like 'E', so they share the layouts.
+def trackAdd(buffer, offset, orders):
+    (stockId, _, _, orderId, side, quantity, price) = ORDER_ADD_LAYOUT.unpack_from(buffer, offset)
+    orders.add(orderId, stockId, side, price, quantity)
+
+
+def trackExecute(buffer, offset, orders):
+    (_, _, _, orderId, quantity) = ORDER_EXECUTE_LAYOUT.unpack_from(buffer, offset)
+    orders.reduce(orderId, quantity)
+
+
+def trackCancel(buffer, offset, orders):
+    (_, _, _, orderId, quantity) = ORDER_CANCEL_LAYOUT.unpack_from(buffer, offset)
+    orders.reduce(orderId, quantity)
+
+
+def trackDelete(buffer, offset, orders):
+    (_, _, _, orderId) = ORDER_DELETE_LAYOUT.unpack_from(buffer, offset)
+    orders.remove(orderId)
+
+
+def trackReplace(buffer, offset, orders):
+    (_, _, _, orderId, newOrderId, quantity, price) = ORDER_REPLACE_LAYOUT.unpack_from(buffer, offset)
+    orders.replace(orderId, newOrderId, price, quantity)
+
+
+TRACKERS = {
+    b'A': trackAdd,
+    b'F': trackAdd,
+    b'E': trackExecute,
+    b'C': trackExecute,
+    b'X': trackCancel,
+    b'D': trackDelete,
+    b'U': trackReplace,
+}
+
+# Kind of the tracked-only messages in the lookup table
+TRACKED = -1
+
+
+class NullOrderIndex:
+    """Order index that keeps nothing, used when no requested record depends on the orders"""
+
+    def add(self, orderId, stockId, side, price, quantity):
+        pass
+
+    def replace(self, orderId, newOrderId, price, quantity):
+        return None
+
+    def reduce(self, orderId, quantity):
+        return None
+
+    def remove(self, orderId):
+        return None
+
+
+def messageTable(msgTypes):
+    """Lookup table from the message type byte to (handler, kind) for the requested types and the tracked ones"""
+    table = [None] * 256
+    if msgTypes & RESOLVED_TYPES:
+        for msgType, tracker in TRACKERS.items():
+            table[msgType[0]] = (tracker, TRACKED)
+    for msgType in msgTypes:
+        table[msgType[0]] = DECODERS[msgType]
+    return table
+
+
+def decodeRange(buffer, state, table, yieldStocks, start=0, end=None):
+    """Yield the records of the complete messages in [start, end) and return the offset after the last one.
+    state.windowEnded is set at the first event past the end of the window."""
+    end = len(buffer) if end is None else end
+    windowStart = state.window.start
+    windowEnd = state.window.end
+    selected = state.selectedStocks
+    orders = state.orders
+    offset = start
+    while offset + MESSAGE_HEADER.size <= end:
+        (msgLen, msgType) = MESSAGE_HEADER.unpack_from(buffer, offset)
+        if offset + msgLen + 2 > end:
+            break
+        body = offset + 2
+        offset += msgLen + 2
+        entry = table[msgType]
+        if entry is None:
+            continue
+        (handler, kind) = entry
+
+        # The stock directory is always decoded, the symbol filter is resolved with it
+        if kind == STOCK:
+            record = handler(buffer, body)
+            if state.selectStock(record) and yieldStocks:
+                yield record
+        elif selected is not None and not selected[buffer[body + 1] << 8 | buffer[body + 2]]:
+            continue
+        elif kind == TRACKED:
+            handler(buffer, body, orders)
+        elif kind in WINDOWED_OUTPUTS:
+            record = handler(buffer, body, orders)
+            if record.timestamp > windowEnd:
+                state.windowEnded = True
+                return offset - msgLen - 2
+            if record.timestamp >= windowStart:
+                yield record
+        else:
+            yield handler(buffer, body)
+    return offset
+
+
+def newState(msgTypes, window, inputSize, symbols):
+    state = ParseState(window, inputSize, symbols)
+    if not msgTypes & RESOLVED_TYPES:
+        # Nothing is looked up, so the added orders don't have to be kept
+        state.orders = NullOrderIndex()
+    return state
+
+
+def decodeDump(path, msgTypes, symbols, window):
+    table = messageTable(msgTypes)
+    yieldStocks = STOCK_DIRECTORY_ID in msgTypes
+    table[STOCK_DIRECTORY_ID[0]] = DECODERS[STOCK_DIRECTORY_ID]
+    if path.endswith(".gz"):
+        state = newState(msgTypes, window, None, symbols)
+        pending = b""
+        for block in gzipBlocks(path):
+            data = pending + block if pending else block
+            consumed = yield from decodeRange(data, state, table, yieldStocks)
+            if state.windowEnded:
+                return
+            pending = data[consumed:]
+        if pending:
+            raise ValueError(f"{path} ends with an incomplete message")
+    else:
+        fileContent = mapDump(path)
+        state = newState(msgTypes, window, len(fileContent), symbols)
+        offset = 0
+        if window.skipBefore > 0:
+            index = loadOrBuildIndex(path, fileContent)
+            offset = yield from decodeRange(fileContent, state, table, yieldStocks, 0, index.directoryEnd)
+            offset = max(offset, index.seek(window.skipBefore))
+        if not state.windowEnded:
+            offset = yield from decodeRange(fileContent, state, table, yieldStocks, offset)
+        if not state.windowEnded and offset < len(fileContent):
+            raise ValueError(f"{path} ends with an incomplete message at offset {offset}")
+
+
+def batched(records, batchSize):
+    while batch := list(islice(records, batchSize)):
+        yield batch
+
+
+def iterMessages(path, types=None, symbols=None, window=None, batchSize=None):
+    """Lazily decode the dump at path (gzipped if it ends with .gz) and yield its records in file order.
+
+    types: message type characters to decode, e.g. "AFU" or ["E", "C"] (default: all types parser.py decodes).
+    symbols: only yield the messages of these stock symbols.
+    window: a parser.Window, events before window.start are not yielded and iteration stops at the first event after
+        window.end. For unzipped dumps, the messages before window.skipBefore are skipped with the sparse timestamp
+        index, executions of orders placed before it have no price and side. Default: the whole day.
+    batchSize: yield lists of up to batchSize records instead of single records."""
+    msgTypes = set(DECODERS) if types is None else {msgType.encode() for msgType in types}
+    unknown = msgTypes - DECODERS.keys()
+    if unknown:
+        raise ValueError(f"unsupported message types {sorted(unknown)}, choose from {sorted(DECODERS)}")
+    records = decodeDump(path, msgTypes, symbols, FULL_DAY if window is None else window)
+    return records if batchSize is None else batched(records, batchSize)
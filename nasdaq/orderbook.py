@@ -0,0 +1,172 @@
+"""Limit order book reconstruction, used by `parser.py --book`.
+
+The book is maintained from the order messages while parsing: 'A'/'F' add an order, 'E'/'C' executions and 'X'
+cancels reduce it, 'D' deletes it and 'U' replaces it with a new order on the same side. Per stock and side, the
+resting quantity is aggregated by integer price, so depth snapshots don't need to look at individual orders.
+
+The depth snapshots are deltas of the top `depth` price levels of every side: a snapshot writes a row for every price
+that entered the top or whose quantity changed since it was last written, with its current level, and a row with
+level REMOVED_LEVEL and quantity 0 for every price that left the top. The latest row of every (stockId, side, price)
+with a quantity is the current top of the book. A snapshot writes at most 4 * depth rows per stock, and only for
+the sides whose top changed in its interval.
+"""
+import bisect
+
+import parser as itch
+
+SIDE_NAMES = {b'B': "BUY", b'S': "SELL"}
+
+# Level of the rows of prices that left the top of the book
+REMOVED_LEVEL = -1
+
+
+class OrderBook:
+    """Live limit order book of every stock. Within the replay window, the changes of the top `depth` price levels
+    of every side are written to the `orderbookDepth` output every `interval` nanoseconds. `writeRestingOrders`
+    writes the orders still resting in the book to the `orderbook` output."""
+
+    def __init__(self, writers, window, interval, depth):
+        self.depthWriter = writers["orderbookDepth"]
+        # Depth rows are encoded straight into CSV lines, like the order messages, if the output takes lines. When
+        # parser.py runs as a script, its CsvWriter isn't itch.CsvWriter, so check for the method instead of the class.
+        self.encodeDepth = hasattr(self.depthWriter, "write")
+        self.restingWriter = writers["orderbook"]
+        self.window = window
+        self.interval = interval
+        self.depth = depth
+        self.orders = {}  # orderId -> [stockId, side, price, quantity]
+        self.levels = {}  # (stockId, side) -> {price: quantity}
+        self.prices = {}  # (stockId, side) -> sorted prices of the levels
+        self.changed = {}  # (stockId, side) -> prices changed since the last snapshot
+        self.tops = {}  # (stockId, side) -> {price: quantity} of the top levels as last written
+        self.nextSnapshot = window.start
+        self.updates = {
+            itch.ORDER_ADD_ID[0]: self.add,
+            itch.ORDER_ADD_WITH_MPID_ID[0]: self.add,
+            itch.ORDER_EXECUTE_ID[0]: self.execute,
+            itch.ORDER_EXECUTE_WITH_PRICE_ID[0]: self.executeWithPrice,
+            itch.ORDER_CANCEL_ID[0]: self.cancel,
+            itch.ORDER_DELETE_ID[0]: self.delete,
+            itch.ORDER_REPLACE_ID[0]: self.replace,
+        }
+
+    def update(self, buffer, offset, timestamp):
+        """Apply the order message at offset (its type byte) with the given timestamp to the book"""
+        if timestamp >= self.nextSnapshot and self.nextSnapshot <= self.window.end:
+            self.snapshot(self.nextSnapshot)
+            # The book didn't change in between, so skip the snapshots of all intervals without events
+            self.nextSnapshot += (timestamp - self.nextSnapshot) // self.interval * self.interval + self.interval
+        update = self.updates.get(buffer[offset])
+        if update is not None:
+            update(buffer, offset)
+
+    def addOrder(self, orderId, stockId, side, price, quantity):
+        self.orders[orderId] = [stockId, side, price, quantity]
+        key = (stockId, side)
+        levels = self.levels.get(key)
+        if levels is None:
+            levels = self.levels[key] = {}
+            self.prices[key] = []
+        if price in levels:
+            levels[price] += quantity
+        else:
+            levels[price] = quantity
+            bisect.insort(self.prices[key], price)
+        changed = self.changed.get(key)
+        if changed is None:
+            self.changed[key] = {price}
+        else:
+            changed.add(price)
+
+    def reduceOrder(self, orderId, quantity):
+        order = self.orders.get(orderId)
+        if order is None:
+            # Added before the parsed part of the dump
+            return None
+        (stockId, side, price, remaining) = order
+        quantity = min(quantity, remaining)
+        key = (stockId, side)
+        levels = self.levels[key]
+        levels[price] -= quantity
+        if levels[price] == 0:
+            del levels[price]
+            prices = self.prices[key]
+            del prices[bisect.bisect_left(prices, price)]
+        changed = self.changed.get(key)
+        if changed is None:
+            self.changed[key] = {price}
+        else:
+            changed.add(price)
+        if quantity == remaining:
+            del self.orders[orderId]
+        else:
+            order[3] = remaining - quantity
+        return order
+
+    def add(self, buffer, offset):
+        (stockId, _, _, orderId, side, quantity, price) = itch.ORDER_ADD_LAYOUT.unpack_from(buffer, offset)
+        self.addOrder(orderId, stockId, side, price, quantity)
+
+    def execute(self, buffer, offset):
+        (_, _, _, orderId, quantity) = itch.ORDER_EXECUTE_LAYOUT.unpack_from(buffer, offset)
+        self.reduceOrder(orderId, quantity)
+
+    def executeWithPrice(self, buffer, offset):
+        # The execution price may differ from the limit price, but the shares leave the book at the limit price
+        (_, _, _, orderId, quantity, _) = itch.ORDER_EXECUTE_WITH_PRICE_LAYOUT.unpack_from(buffer, offset)
+        self.reduceOrder(orderId, quantity)
+
+    def cancel(self, buffer, offset):
+        (_, _, _, orderId, quantity) = itch.ORDER_CANCEL_LAYOUT.unpack_from(buffer, offset)
+        self.reduceOrder(orderId, quantity)
+
+    def delete(self, buffer, offset):
+        (_, _, _, orderId) = itch.ORDER_DELETE_LAYOUT.unpack_from(buffer, offset)
+        self.reduceOrder(orderId, 1 << 32)
+
+    def replace(self, buffer, offset):
+        (stockId, _, _, orderId, newOrderId, quantity, price) = itch.ORDER_REPLACE_LAYOUT.unpack_from(buffer, offset)
+        order = self.reduceOrder(orderId, 1 << 32)
+        if order is not None:
+            self.addOrder(newOrderId, stockId, order[1], price, quantity)
+
+    def top(self, key):
+        """The prices of the top `depth` levels of a side, best first"""
+        prices = self.prices[key]
+        if key[1] == b'B':
+            return prices[:-self.depth - 1:-1]
+        return prices[:self.depth]
+
+    def snapshot(self, timestamp):
+        """Write the changes of the top levels of every side since they were last written"""
+        rows = []
+        for key in sorted(self.changed):
+            (stockId, side) = key
+            previous = self.tops.get(key, {})
+            if len(previous) == self.depth:
+                # Changes below the worst level of a full top (the last one in the dict) don't affect it
+                worst = next(reversed(previous))
+                if (max(self.changed[key]) < worst) if side == b'B' else (min(self.changed[key]) > worst):
+                    continue
+            levels = self.levels[key]
+            best = self.top(key)
+            top = {price: levels[price] for price in best}
+            # Best first, like the levels
+            descending = side == b'B'
+            for (price, quantity) in sorted(top.items() - previous.items(), reverse=descending):
+                rows.append((stockId, side, best.index(price), price, quantity))
+            for price in sorted(previous.keys() - top.keys(), reverse=descending):
+                rows.append((stockId, side, REMOVED_LEVEL, price, 0))
+            self.tops[key] = top
+        self.changed.clear()
+        if self.encodeDepth:
+            self.depthWriter.write(b"".join([b"%d;%d;%s;%d;%d.%04d;%d\r\n" % (
+                timestamp, stockId, itch.SIDE_NAMES[side], level, price // 10000, price % 10000, quantity)
+                for (stockId, side, level, price, quantity) in rows]))
+        else:
+            for (stockId, side, level, price, quantity) in rows:
+                self.depthWriter.writerow((timestamp, stockId, SIDE_NAMES[side], level, price, quantity))
+
+    def writeRestingOrders(self):
+        for orderId, (stockId, side, price, quantity) in self.orders.items():
+            self.restingWriter.writerow((orderId, stockId, SIDE_NAMES[side], price, quantity))
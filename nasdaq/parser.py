@@ -1,8 +1,21 @@
-import csv
+from contextlib import ExitStack
 from dataclasses import dataclass
+from decimal import Decimal
+from typing import NamedTuple
+
+from array import array
 
 import argparse
+import bisect
+import gzip
+import itertools
+import mmap
+import multiprocessing
+import queue
+import shutil
 import struct
+import sys
+import threading
 import os
 
 ORDER_ADD_ID = b'A'
@@ -35,7 +48,8 @@ executionSchema = [
     "orderId",
     "stockId",
     "quantity",
-    "price"
+    "price",
+    "side"
 ]
 
 cancellationSchema = [
@@ -72,9 +86,35 @@ marketMakerSchema = [
     "state"
 ]
 
+orderbookSchema = [
+    "orderId",
+    "stockId",
+    "side",
+    "price",
+    "quantity"
+]
+
+candleSchema = [
+    "stockId",
+    "timestamp",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume"
+]
 
-@dataclass
-class Order:
+orderbookDepthSchema = [
+    "timestamp",
+    "stockId",
+    "side",
+    "level",
+    "price",
+    "quantity"
+]
+
+
+class Order(NamedTuple):
     stockId: int
     timestamp: int
     orderId: int
@@ -85,25 +125,23 @@ class Order:
     prevOrder: int
 
 
-@dataclass
-class Execution:
+class Execution(NamedTuple):
     timestamp: int
     orderId: int
     stockId: int
     quantity: int
     price: int
+    side: str
 
 
-@dataclass
-class Cancellation:
+class Cancellation(NamedTuple):
     timestamp: int
     orderId: int
     stockId: int
     quantity: int
 
 
-@dataclass
-class StockDirectoryEntry:
+class StockDirectoryEntry(NamedTuple):
     stockId: int
     name: str
     marketCategory: str
@@ -121,8 +159,7 @@ class StockDirectoryEntry:
     InverseIndicator: bool
 
 
-@dataclass
-class MarketMaker:
+class MarketMaker(NamedTuple):
     timestamp: int
     stockId: int
     name: str
@@ -131,47 +168,135 @@ class MarketMaker:
     state: str
 
 
+@dataclass
+class Window:
+    """Time window of a run in nanoseconds since midnight. Events before `start` go to the premarket outputs, events
+    before `skipBefore` are dropped, and parsing stops at the first event after `end`."""
+    start: int = MARKET_OPEN_TS + START_POINT
+    end: int = MARKET_OPEN_TS + END_POINT
+    skipBefore: int = 0
+
+
+def parseTime(value):
+    """Parse HH:MM[:SS[.fraction]] into nanoseconds since midnight, the unit of ITCH timestamps"""
+    parts = value.split(":")
+    if not 2 <= len(parts) <= 3:
+        raise argparse.ArgumentTypeError(f"invalid time '{value}', expected HH:MM[:SS[.fraction]]")
+    try:
+        seconds = int(parts[0]) * 3600 + int(parts[1]) * 60 + (Decimal(parts[2]) if len(parts) == 3 else 0)
+    except ArithmeticError:
+        raise argparse.ArgumentTypeError(f"invalid time '{value}', expected HH:MM[:SS[.fraction]]")
+    return int(seconds * 1000000000)
+
+
+# Message layouts relative to the message type byte, one precompiled struct per ITCH message type.
+# Every layout covers all fields we need so a message is decoded with a single unpack_from call.
+# The 6 byte timestamps are read as a 2 byte high part and a 4 byte low part.
+MESSAGE_HEADER = struct.Struct("!HB")  # length prefix, message type
+MARKET_MAKER_LAYOUT = struct.Struct("!xH2xHI4s8xccc")
+STOCK_DIRECTORY_LAYOUT = struct.Struct("!xH8x8sccIcc2scccccIc")
+ORDER_ADD_LAYOUT = struct.Struct("!xH2xHIQcI8xI")
+ORDER_ADD_WITH_MPID_LAYOUT = struct.Struct("!xH2xHIQcI8xI4s")
+ORDER_EXECUTE_LAYOUT = struct.Struct("!xH2xHIQI")
+ORDER_EXECUTE_WITH_PRICE_LAYOUT = struct.Struct("!xH2xHIQI9xI")
+TRADE_LAYOUT = struct.Struct("!xH2xHI8xcI8xI")
+ORDER_CANCEL_LAYOUT = struct.Struct("!xH2xHIQI")
+ORDER_DELETE_LAYOUT = struct.Struct("!xH2xHIQ")
+ORDER_REPLACE_LAYOUT = struct.Struct("!xH2xHIQQII")
+
+SIDES = {b'B': "BUY", b'S': "SELL"}
+
+
 def sideToStr(side):
-    if side == b'B': return "BUY"
-    if side == b'S':
-        return "SELL"
-    else:
+    try:
+        return SIDES[side]
+    except KeyError:
         raise ValueError
 
 
-def handleMarketMakers(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (name,) = struct.unpack("!4s", pkg[11:15])
-    (isPrimary,) = struct.unpack("!c", pkg[23:24])
-    (mode,) = struct.unpack("!c", pkg[24:25])
-    (state,) = struct.unpack("!c", pkg[25:26])
+class OrderIndex:
+    """Stock, price and side of the open orders, so that executions, which usually only reference the order, can be
+    written with their price and side. A replaced order ('U') is swapped for the new order on the same side, and
+    orders are dropped once fully executed or cancelled, so only the live orders are kept. Each order is packed
+    into a single int: price << 49 | quantity << 17 | stockId << 1 | isSell."""
+
+    def __init__(self):
+        self.orders = {}
+
+    def add(self, orderId, stockId, side, price, quantity):
+        self.orders[orderId] = price << 49 | quantity << 17 | stockId << 1 | (side == b'S')
+
+    def replace(self, orderId, newOrderId, price, quantity):
+        """Replace an order, returns the old one or None if it isn't known"""
+        order = self.orders.pop(orderId, None)
+        if order is not None:
+            self.orders[newOrderId] = price << 49 | quantity << 17 | (order & 0x1FFFF)
+        return order
+
+    def reduce(self, orderId, quantity):
+        """Take shares off an order, returns the order before the reduction or None if it isn't known"""
+        order = self.orders.get(orderId)
+        if order is not None:
+            if quantity >= order >> 17 & 0xFFFFFFFF:
+                del self.orders[orderId]
+            else:
+                self.orders[orderId] = order - (quantity << 17)
+        return order
+
+    def remove(self, orderId):
+        return self.orders.pop(orderId, None)
+
+
+class ChunkOrderIndex(OrderIndex):
+    """OrderIndex of one chunk of a parallel run. Orders added in an earlier chunk aren't known here, so references
+    to unknown orders are recorded for the parent to resolve: replacements in file order, reductions and removals
+    in any order."""
+
+    def __init__(self):
+        super().__init__()
+        self.replaced = []  # (orderId, newOrderId, price, quantity)
+        self.reduced = []  # (orderId, quantity)
+        self.removed = []
+
+    def replace(self, orderId, newOrderId, price, quantity):
+        order = super().replace(orderId, newOrderId, price, quantity)
+        if order is None:
+            self.replaced.append((orderId, newOrderId, price, quantity))
+        return order
+
+    def reduce(self, orderId, quantity):
+        order = super().reduce(orderId, quantity)
+        if order is None:
+            self.reduced.append((orderId, quantity))
+        return order
+
+    def remove(self, orderId):
+        order = super().remove(orderId)
+        if order is None:
+            self.removed.append(orderId)
+        return order
+
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+# Side of a packed order in the OrderIndex
+ORDER_SIDES = ("BUY", "SELL")
+
+
+def handleMarketMakers(buffer, offset):
+    (stockId, timestampHigh, timestampLow, name, isPrimary, mode, state) = MARKET_MAKER_LAYOUT.unpack_from(buffer, offset)
+
+    timestamp = timestampHigh << 32 | timestampLow
     name = name.decode('ascii').strip()
-    isPrimary = True if isPrimary == 'Y' else False
+    isPrimary = isPrimary == b'Y'
     mode = mode.decode('ascii').strip()
     state = state.decode('ascii').strip()
 
     return MarketMaker(timestamp, stockId, name, isPrimary, mode, state)
 
 
-def handleStockDirectory(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (name,) = struct.unpack("!8s", pkg[11:19])
-    (marketCategory,) = struct.unpack("!c", pkg[19:20])
-    (financialStatusIndicator,) = struct.unpack("!c", pkg[20:21])
-    (roundLotSize,) = struct.unpack("!I", pkg[21:25])
-    (roundLotsOnly,) = struct.unpack("!c", pkg[25:26])
-    (issueClassification,) = struct.unpack("!c", pkg[26:27])
-    (issueSubType,) = struct.unpack("!2s", pkg[27:29])
-    (authenticity,) = struct.unpack("!c", pkg[29:30])
-    (shortSaleThresholdIndicator,) = struct.unpack("!c", pkg[30:31])
-    (IPOFlag,) = struct.unpack("!c", pkg[31:32])
-    (LULDReferencePriceTier,) = struct.unpack("!c", pkg[32:33])
-    (ETPFlag,) = struct.unpack("!c", pkg[33:34])
-    (ETPLeverageFactor,) = struct.unpack("!I", pkg[34:38])
-    (InverseIndicator,) = struct.unpack("!c", pkg[38:39])
+def handleStockDirectory(buffer, offset):
+    (stockId, name, marketCategory, financialStatusIndicator, roundLotSize, roundLotsOnly, issueClassification,
+     issueSubType, authenticity, shortSaleThresholdIndicator, IPOFlag, LULDReferencePriceTier, ETPFlag,
+     ETPLeverageFactor, InverseIndicator) = STOCK_DIRECTORY_LAYOUT.unpack_from(buffer, offset)
 
     name = name.decode('ascii').strip()
     marketCategory = marketCategory.decode('ascii').strip()
@@ -181,239 +306,1311 @@ def handleStockDirectory(pkg):
     LULDReferencePriceTier = LULDReferencePriceTier.decode('ascii').strip()
 
     issueSubType = issueSubType.decode('ascii').strip()
-    roundLotsOnly = True if roundLotsOnly == 'Y' else False
-    shortSaleThresholdIndicator = True if shortSaleThresholdIndicator == 'Y' else False
-    IPOFlag = True if IPOFlag == 'Y' else False
-    ETPFlag = True if ETPFlag == 'Y' else False
-    InverseIndicator = True if InverseIndicator == 'Y' else False
+    roundLotsOnly = roundLotsOnly == b'Y'
+    shortSaleThresholdIndicator = shortSaleThresholdIndicator == b'Y'
+    IPOFlag = IPOFlag == b'Y'
+    ETPFlag = ETPFlag == b'Y'
+    InverseIndicator = InverseIndicator == b'Y'
 
     return StockDirectoryEntry(stockId, name, marketCategory, financialStatusIndicator, roundLotSize, roundLotsOnly,
                                issueClassification, issueSubType, authenticity, shortSaleThresholdIndicator, IPOFlag,
                                LULDReferencePriceTier, ETPFlag, ETPLeverageFactor, InverseIndicator)
 
 
-def handleOrderAdd(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
-    (side,) = struct.unpack("!c", pkg[19:20])
-    (quantity,) = struct.unpack("!I", pkg[20:24])
-    (price,) = struct.unpack("!I", pkg[32:36])
+def handleOrderAdd(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, side, quantity, price) = ORDER_ADD_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.add(orderId, stockId, side, price, quantity)
     side = sideToStr(side)
 
-    return Order(stockId, timestamp, orderId, side, quantity, price / 10000, None, None)
+    return Order(stockId, timestamp, orderId, side, quantity, price, None, None)
 
 
-def handleOrderAddWithAttribution(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
-    (side,) = struct.unpack("!c", pkg[19:20])
-    (quantity,) = struct.unpack("!I", pkg[20:24])
-    (price,) = struct.unpack("!I", pkg[32:36])
-    (attribution,) = struct.unpack("!4s", pkg[36:40])
+def handleOrderAddWithAttribution(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, side, quantity, price,
+     attribution) = ORDER_ADD_WITH_MPID_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.add(orderId, stockId, side, price, quantity)
     side = sideToStr(side)
     attribution = attribution.decode('ascii').strip()
 
-    return Order(stockId, timestamp, orderId, side, quantity, price / 10000, attribution, None)
+    return Order(stockId, timestamp, orderId, side, quantity, price, attribution, None)
 
 
-def handleOrderExecute(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
-    (quantity,) = struct.unpack("!I", pkg[19:23])
+def handleOrderExecute(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, quantity) = ORDER_EXECUTE_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    # The execution price is the price of the order
+    order = orders.reduce(orderId, quantity)
+    if order is None:
+        return Execution(timestamp, orderId, stockId, quantity, None, None)
 
-    return Execution(timestamp, orderId, stockId, quantity, None)
+    return Execution(timestamp, orderId, stockId, quantity, order >> 49, ORDER_SIDES[order & 1])
 
 
-def handleOrderExecuteWithPrice(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
-    (quantity,) = struct.unpack("!I", pkg[19:23])
-    (price,) = struct.unpack("!I", pkg[32:36])
+def handleOrderExecuteWithPrice(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, quantity,
+     price) = ORDER_EXECUTE_WITH_PRICE_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    order = orders.reduce(orderId, quantity)
+    side = None if order is None else ORDER_SIDES[order & 1]
 
-    return Execution(timestamp, orderId, stockId, quantity, price / 10000)
+    return Execution(timestamp, orderId, stockId, quantity, price, side)
 
 
-def handleTrade(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (quantity,) = struct.unpack("!I", pkg[20:24])
-    (price,) = struct.unpack("!I", pkg[32:36])
+def handleTrade(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, side, quantity, price) = TRADE_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    side = sideToStr(side)
 
-    return Execution(timestamp, None, stockId, quantity, price / 10000)
+    return Execution(timestamp, None, stockId, quantity, price, side)
 
 
-def handleOrderCancel(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
-    (quantity,) = struct.unpack("!I", pkg[19:23])
+def handleOrderCancel(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, quantity) = ORDER_CANCEL_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.reduce(orderId, quantity)
 
     return Cancellation(timestamp, orderId, stockId, quantity)
 
 
-def handleOrderDelete(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
+def handleOrderDelete(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId) = ORDER_DELETE_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.remove(orderId)
 
     return Cancellation(timestamp, orderId, stockId, None)
 
 
-def handleOrderReplace(pkg):
-    (stockId,) = struct.unpack("!H", pkg[1:3])
-    (timestamp,) = struct.unpack("!6s", pkg[5:11])
-    (orderId,) = struct.unpack("!Q", pkg[11:19])
-    (newOrderId,) = struct.unpack("!Q", pkg[19:27])
-    (quantity,) = struct.unpack("!I", pkg[27:31])
-    (price,) = struct.unpack("!I", pkg[31:35])
+def handleOrderReplace(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, newOrderId, quantity,
+     price) = ORDER_REPLACE_LAYOUT.unpack_from(buffer, offset)
 
-    timestamp = int.from_bytes(timestamp, byteorder="big")
+    timestamp = timestampHigh << 32 | timestampLow
+    # The new order keeps the side of the replaced one
+    order = orders.replace(orderId, newOrderId, price, quantity)
+    side = None if order is None else ORDER_SIDES[order & 1]
 
-    return Order(stockId, timestamp, newOrderId, None, quantity, price / 10000, None, orderId)
+    return Order(stockId, timestamp, newOrderId, side, quantity, price, None, orderId)
+
+
+# Encoders for the fast CSV output: they render an order, execution or cancellation message straight into its CSV
+# line and return it with the timestamp, without creating a record first. Prices are integer ten-thousandths of a
+# dollar and are formatted as exact numeric(10,4) text.
+SIDE_NAMES = {b'B': b"BUY", b'S': b"SELL"}
+ENCODED_ORDER_SIDES = (b"BUY", b"SELL")
+
+
+def encodeOrderAdd(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, side, quantity, price) = ORDER_ADD_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.add(orderId, stockId, side, price, quantity)
+    return timestamp, b"%d;%d;%d;%s;%d;%d.%04d;;\r\n" % (
+        stockId, timestamp, orderId, SIDE_NAMES[side], quantity, price // 10000, price % 10000)
+
+
+def encodeOrderAddWithAttribution(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, side, quantity, price,
+     attribution) = ORDER_ADD_WITH_MPID_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.add(orderId, stockId, side, price, quantity)
+    return timestamp, b"%d;%d;%d;%s;%d;%d.%04d;%s;\r\n" % (
+        stockId, timestamp, orderId, SIDE_NAMES[side], quantity, price // 10000, price % 10000, attribution.strip())
+
+
+def encodeOrderReplace(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, newOrderId, quantity,
+     price) = ORDER_REPLACE_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    order = orders.replace(orderId, newOrderId, price, quantity)
+    side = b"" if order is None else ENCODED_ORDER_SIDES[order & 1]
+    return timestamp, b"%d;%d;%d;%s;%d;%d.%04d;;%d\r\n" % (
+        stockId, timestamp, newOrderId, side, quantity, price // 10000, price % 10000, orderId)
+
+
+def encodeOrderExecute(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, quantity) = ORDER_EXECUTE_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    order = orders.reduce(orderId, quantity)
+    if order is None:
+        return timestamp, b"%d;%d;%d;%d;;\r\n" % (timestamp, orderId, stockId, quantity)
+    price = order >> 49
+    return timestamp, b"%d;%d;%d;%d;%d.%04d;%s\r\n" % (
+        timestamp, orderId, stockId, quantity, price // 10000, price % 10000, ENCODED_ORDER_SIDES[order & 1])
+
+
+def encodeOrderExecuteWithPrice(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, quantity,
+     price) = ORDER_EXECUTE_WITH_PRICE_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    order = orders.reduce(orderId, quantity)
+    side = b"" if order is None else ENCODED_ORDER_SIDES[order & 1]
+    return timestamp, b"%d;%d;%d;%d;%d.%04d;%s\r\n" % (
+        timestamp, orderId, stockId, quantity, price // 10000, price % 10000, side)
+
+
+def encodeTrade(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, side, quantity, price) = TRADE_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    return timestamp, b"%d;;%d;%d;%d.%04d;%s\r\n" % (
+        timestamp, stockId, quantity, price // 10000, price % 10000, SIDE_NAMES[side])
+
+
+def encodeOrderCancel(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, quantity) = ORDER_CANCEL_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.reduce(orderId, quantity)
+    return timestamp, b"%d;%d;%d;%d\r\n" % (timestamp, orderId, stockId, quantity)
+
+
+def encodeOrderDelete(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId) = ORDER_DELETE_LAYOUT.unpack_from(buffer, offset)
+    timestamp = timestampHigh << 32 | timestampLow
+    orders.remove(orderId)
+    return timestamp, b"%d;%d;%d;\r\n" % (timestamp, orderId, stockId)
+
+
+def recordRow(handler):
+    """Adapt a handler to the encoder interface for outputs that take rows of values instead of CSV lines. Records
+    are named tuples in schema order, so a record is its row."""
+    def decode(buffer, offset, orders):
+        record = handler(buffer, offset, orders)
+        return record.timestamp, record
+    return decode
+
+
+# The kind of record each handler produces, used to route it to the right output
+STOCK, MARKET_MAKER, ORDER, EXECUTION, CANCELLATION = range(5)
+
+DECODERS = {
+    STOCK_DIRECTORY_ID: (handleStockDirectory, STOCK),
+    MARKET_MAKER_ID: (handleMarketMakers, MARKET_MAKER),
+    ORDER_ADD_ID: (handleOrderAdd, ORDER),
+    ORDER_ADD_WITH_MPID_ID: (handleOrderAddWithAttribution, ORDER),
+    ORDER_REPLACE_ID: (handleOrderReplace, ORDER),
+    ORDER_CANCEL_ID: (handleOrderCancel, CANCELLATION),
+    ORDER_DELETE_ID: (handleOrderDelete, CANCELLATION),
+    ORDER_EXECUTE_ID: (handleOrderExecute, EXECUTION),
+    ORDER_EXECUTE_WITH_PRICE_ID: (handleOrderExecuteWithPrice, EXECUTION),
+    TRADE_ID: (handleTrade, EXECUTION),
+}
+
+
+ENCODERS = {
+    ORDER_ADD_ID: encodeOrderAdd,
+    ORDER_ADD_WITH_MPID_ID: encodeOrderAddWithAttribution,
+    ORDER_REPLACE_ID: encodeOrderReplace,
+    ORDER_CANCEL_ID: encodeOrderCancel,
+    ORDER_DELETE_ID: encodeOrderDelete,
+    ORDER_EXECUTE_ID: encodeOrderExecute,
+    ORDER_EXECUTE_WITH_PRICE_ID: encodeOrderExecuteWithPrice,
+    TRADE_ID: encodeTrade,
+}
+
+
+def decoderTable(encodedKinds=()):
+    """Lookup table from the raw message type byte to (handler, kind), None for types we don't decode.
+    For orders, executions and cancellations, the handler takes the OrderIndex as third argument and returns
+    (timestamp, row): the encoded CSV line for the kinds in `encodedKinds`, the record's values otherwise."""
+    table = [None] * 256
+    for msgType, (handler, kind) in DECODERS.items():
+        if kind in WINDOWED_OUTPUTS:
+            handler = ENCODERS[msgType] if kind in encodedKinds else recordRow(handler)
+        table[msgType[0]] = (handler, kind)
+    return table
+
+
+# Output streams and their schemas, each written to <name>.csv in the output directory
+OUTPUTS = {
+    "orders": orderSchema,
+    "ordersPreMarket": orderSchema,
+    "executions": executionSchema,
+    "executionsPreMarket": executionSchema,
+    "cancellations": cancellationSchema,
+    "cancellationsPreMarket": cancellationSchema,
+    "stocks": stocksSchema,
+    "marketMakers": marketMakerSchema,
+}
+
+# Outputs of the order book reconstruction (--book): the orders resting at the end of the window and depth snapshots
+BOOK_OUTPUTS = {
+    "orderbook": orderbookSchema,
+    "orderbookDepth": orderbookDepthSchema,
+}
+
+# Outputs for the time-dependent record kinds: (in-window output, premarket output)
+WINDOWED_OUTPUTS = {
+    ORDER: ("orders", "ordersPreMarket"),
+    EXECUTION: ("executions", "executionsPreMarket"),
+    CANCELLATION: ("cancellations", "cancellationsPreMarket"),
+}
+
+
+# Bucket sizes of the OHLCV candles (--candles) in nanoseconds, each is written to the candles_<bucket> output
+CANDLE_BUCKETS = {
+    "1s": 1000000000,
+    "10s": 10000000000,
+    "1m": 60000000000,
+}
+
+
+# Tables in client/schema.sql with the PostgreSQL types of their columns, used by the direct load and columnar output
+TABLES = {
+    "orders": (orderSchema, ["int4", "int8", "int8", "text", "int4", "numeric", "text", "int8"]),
+    "executions": (executionSchema, ["int8", "int8", "int4", "int4", "numeric", "text"]),
+    "cancellations": (cancellationSchema, ["int8", "int8", "int4", "int4"]),
+    "stocks": (stocksSchema, ["int4", "text", "text", "text", "int4", "bool", "text", "text", "text", "bool", "bool",
+                              "text", "bool", "int4", "bool"]),
+    "marketmakers": (marketMakerSchema, ["int8", "int4", "text", "bool", "text", "text"]),
+    "orderbook": (orderbookSchema, ["int8", "int4", "text", "numeric", "int4"]),
+    "orderbookdepth": (orderbookDepthSchema, ["int8", "int4", "text", "int4", "numeric", "int8"]),
+    **{f"candles_{bucket}": (candleSchema, ["int4", "int8", "numeric", "numeric", "numeric", "numeric", "int8"])
+       for bucket in CANDLE_BUCKETS},
+}
+
+# Target table of each output stream, premarket and in-window events end up in the same table
+TARGET_TABLES = {
+    "orders": "orders",
+    "ordersPreMarket": "orders",
+    "executions": "executions",
+    "executionsPreMarket": "executions",
+    "cancellations": "cancellations",
+    "cancellationsPreMarket": "cancellations",
+    "stocks": "stocks",
+    "marketMakers": "marketmakers",
+    "orderbook": "orderbook",
+    "orderbookDepth": "orderbookdepth",
+    **{f"candles_{bucket}": f"candles_{bucket}" for bucket in CANDLE_BUCKETS},
+}
+
+
+# Bytes buffered per CSV output before they are written to the file
+CSV_BUFFER_SIZE = 1 << 20
+# Blocks of CSV_BUFFER_SIZE bytes queued per output before the decoder waits for its writer thread
+WRITE_QUEUED_BLOCKS = 4
+
+
+class BackgroundWriter:
+    """Writes blocks to a file on a dedicated thread, so decoding continues while the disk is busy. The queue is
+    bounded, so the decoder waits when the disk falls behind instead of buffering without limit. A write error is
+    raised on the next write or on close."""
+
+    def __init__(self, file):
+        self.file = file
+        self.blocks = queue.Queue(WRITE_QUEUED_BLOCKS)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name=f"write {os.path.basename(file.name)}", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while (block := self.blocks.get()) is not None:
+            # After an error, keep draining the queue so that the decoder doesn't block
+            if self.error is None:
+                try:
+                    self.file.write(block)
+                except Exception as e:
+                    self.error = e
+            self.blocks.task_done()
+
+    def write(self, block):
+        if self.error is not None:
+            raise self.error
+        self.blocks.put(block)
+
+    def sync(self):
+        """Wait until every queued block is written and synced to disk, returns the size of the file"""
+        self.blocks.join()
+        if self.error is not None:
+            raise self.error
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.blocks.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class CsvWriter:
+    """Semicolon separated output that is rendered into a buffer and handed to the file in aligned blocks.
+    Rows are either complete lines from the encoders (`write`), values in schema order (`writerow`) or NumPy columns
+    in schema order (`writecolumns`). None is written as an empty field and prices as exact numeric(10,4) text.
+    Fields are never quoted, ITCH text fields are alphanumeric."""
+
+    def __init__(self, file, types):
+        self.file = file
+        self.buffer = bytearray()
+        self.numericColumns = [i for i, columnType in enumerate(types) if columnType == "numeric"]
+
+    def write(self, lines):
+        self.buffer += lines
+        if len(self.buffer) >= CSV_BUFFER_SIZE:
+            # Hand over whole blocks and keep the rest, so the file is written in aligned CSV_BUFFER_SIZE blocks.
+            # The blocks are views of the old buffer, which is owned by the file from now on, so the buffer is
+            # replaced instead of cleared.
+            buffer = self.buffer
+            end = len(buffer) - len(buffer) % CSV_BUFFER_SIZE
+            self.buffer = buffer[end:]
+            blocks = memoryview(buffer)
+            for start in range(0, end, CSV_BUFFER_SIZE):
+                self.file.write(blocks[start:start + CSV_BUFFER_SIZE])
+
+    def writerow(self, row):
+        row = tuple(row)
+        fields = [("" if value is None else str(value)) for value in row]
+        for i in self.numericColumns:
+            if fields[i]:
+                fields[i] = f"{row[i] // 10000}.{row[i] % 10000:04d}"
+        self.write((";".join(fields) + "\r\n").encode())
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writecolumns(self, columns):
+        """Write the rows given as columns, see vectorized.renderColumns. They are rendered in bulk, without a
+        Python object per row."""
+        # NumPy is only needed for the vectorized engine
+        from vectorized import renderColumns
+        self.write(renderColumns(columns, self.numericColumns))
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+
+    def sync(self):
+        """Flush and wait until everything written so far is on disk, returns the size of the file"""
+        self.flush()
+        return self.file.sync()
+
+
+def openCsvOutputs(outputDir, stack, header=True, outputs=OUTPUTS, sizes=None):
+    """Create one CSV writer per output stream, each writing its file on a background thread. The files are flushed
+    and closed by the given ExitStack. To resume a run, `sizes` are the output sizes of its checkpoint: the existing
+    files are truncated to them and appended to."""
+    writers = {}
+    for name, schema in outputs.items():
+        path = os.path.join(outputDir, name + ".csv")
+        if sizes is None:
+            file = stack.enter_context(open(path, "wb"))
+        else:
+            file = stack.enter_context(open(path, "r+b"))
+            file.truncate(sizes[name])
+            file.seek(sizes[name])
+        background = BackgroundWriter(file)
+        stack.callback(background.close)
+        writer = CsvWriter(background, TABLES[TARGET_TABLES[name]][1])
+        stack.callback(writer.flush)
+        if header and sizes is None:
+            writer.write((";".join(schema) + "\r\n").encode())
+        writers[name] = writer
+    return writers
+
+
+def columnRows(columns):
+    """Rows of the columns given to writecolumns, for the writers that take rows of values. Masked and empty values
+    are None."""
+    count = next(len(column) for column in columns if column is not None)
+    values = []
+    for column in columns:
+        if column is None:
+            values.append(itertools.repeat(None, count))
+        elif column.dtype.kind == "S":
+            values.append([value.decode("ascii") if value else None for value in column.tolist()])
+        else:
+            # Masked values are None in the list
+            values.append(column.tolist())
+    return zip(*values)
+
+
+def toNumeric(price):
+    # Prices are integer ten-thousandths of a dollar
+    return None if price is None else Decimal(price).scaleb(-4)
+
+
+class CopyWriter:
+    """Streams rows into a table with a binary COPY FROM STDIN, converting the numeric columns on the way"""
+
+    def __init__(self, copy, types):
+        self.copy = copy
+        self.numericColumns = [i for i, columnType in enumerate(types) if columnType == "numeric"]
+
+    def writerow(self, row):
+        row = list(row)
+        for i in self.numericColumns:
+            row[i] = toNumeric(row[i])
+        self.copy.write_row(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writecolumns(self, columns):
+        self.writerows(columnRows(columns))
+
+
+# Rows per Parquet row group or Arrow record batch, large enough for efficient bulk loads
+ROW_GROUP_SIZE = 1 << 20
+
+
+class ColumnarWriter:
+    """Buffers rows column by column and writes them as zstd compressed Parquet row groups or Arrow IPC batches"""
+
+    def __init__(self, path, columns, types, fileFormat):
+        # pyarrow is only needed for the columnar output formats
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pc = pc
+        arrowTypes = {"int4": pa.int32(), "int8": pa.int64(), "text": pa.string(), "bool": pa.bool_(),
+                      "numeric": pa.decimal128(10, 4)}
+        self.schema = pa.schema([(column, arrowTypes[columnType]) for column, columnType in zip(columns, types)])
+        self.columns = [[] for _ in columns]
+        if fileFormat == "parquet":
+            # Store the numeric(10,4) prices as scaled 64 bit integers
+            self.writer = pq.ParquetWriter(path, self.schema, compression="zstd", store_decimal_as_integer=True)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    def writerow(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        if len(self.columns[0]) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writecolumns(self, columns):
+        self.writerows(columnRows(columns))
+
+    def flush(self):
+        if not self.columns[0]:
+            return
+        arrays = []
+        for column, field in zip(self.columns, self.schema):
+            if self.pa.types.is_decimal(field.type):
+                # Prices are integer ten-thousandths of a dollar. The float quotient is the closest double to the
+                # price, so the cast to four decimal places restores it exactly.
+                dollars = self.pc.divide(self.pa.array(column, self.pa.int64()).cast(self.pa.float64()), 10000)
+                arrays.append(dollars.cast(field.type))
+            else:
+                arrays.append(self.pa.array(column, field.type))
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+        self.columns = [[] for _ in self.columns]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def openColumnarOutputs(outputDir, fileFormat, stack, outputs=OUTPUTS):
+    """Create one Parquet or Arrow IPC file per output stream, typed like the target table in client/schema.sql"""
+    writers = {}
+    for name in outputs:
+        (columns, types) = TABLES[TARGET_TABLES[name]]
+        writer = ColumnarWriter(os.path.join(outputDir, f"{name}.{fileFormat}"), columns, types, fileFormat)
+        stack.callback(writer.close)
+        writers[name] = writer
+    return writers
+
+
+def openCopyOutputs(conninfo, stack, outputs=OUTPUTS):
+    """Open one connection per target table and start a COPY into it. The COPYs are finished and committed when
+    the given ExitStack is closed. The tables have to exist already, see client/schema.sql."""
+    # psycopg is only needed for the direct load
+    import psycopg
+    from psycopg.copy import QueuedLibpqWriter
+
+    copyWriters = {}
+    for table in dict.fromkeys(TARGET_TABLES[name] for name in outputs):
+        (columns, types) = TABLES[table]
+        conn = stack.enter_context(psycopg.connect(conninfo))
+        cursor = stack.enter_context(conn.cursor())
+        # The queued writer sends the buffered COPY data from a separate thread while we keep decoding
+        copy = stack.enter_context(cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN (FORMAT BINARY)",
+                                               writer=QueuedLibpqWriter(cursor)))
+        copy.set_types(types)
+        copyWriters[table] = CopyWriter(copy, types)
+    return {name: copyWriters[TARGET_TABLES[name]] for name in outputs}
+
+
+def mapDump(path):
+    """Map the dump instead of reading it into memory: pages are faulted in on demand and can be dropped again
+    once parsed, so resident memory stays bounded regardless of the dump size."""
+    with open(path, mode='rb') as file:
+        fileMap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        fileMap.madvise(mmap.MADV_SEQUENTIAL)
+    return memoryview(fileMap)
+
+
+GZIP_BLOCK_SIZE = 16 << 20
+GZIP_QUEUED_BLOCKS = 8
+
+
+def gzipBlocks(path):
+    """Decompress a gzipped dump in a background thread and yield the decompressed blocks as they become ready.
+    zlib releases the GIL, so decompression overlaps with decoding. At most GZIP_QUEUED_BLOCKS blocks are buffered."""
+    blocks = queue.Queue(GZIP_QUEUED_BLOCKS)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def decompress():
+        try:
+            with gzip.open(path, "rb") as file:
+                while not stop.is_set():
+                    block = file.read(GZIP_BLOCK_SIZE)
+                    put(block)
+                    if not block:
+                        return
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=decompress, name="gunzip", daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ParseState:
+    """Parser state that carries over from one block of the dump to the next"""
+
+    def __init__(self, window, inputSize=None, symbols=None):
+        self.window = window
+        # With a symbol filter, the stock locate codes of the selected symbols are flagged in selectedStocks
+        self.symbols = symbols
+        self.selectedStocks = None if symbols is None else bytearray(1 << 16)
+        self.seenStocks = set()
+        self.msgCount = 0
+        self.inputOffset = 0  # offset of the current block within the (decompressed) dump
+        self.inputSize = inputSize
+        self.windowEnded = False
+        self.book = None  # order book maintained from the windowed events, see orderbook.py
+        self.orders = OrderIndex()
+        self.stats = None  # profiling counters, see stats.py
+        self.checkpoints = None  # see checkpoint.py
+
+    def selectStock(self, directoryEntry):
+        """Resolve a stock directory entry against the symbol filter, returns whether the stock is selected"""
+        if self.selectedStocks is None:
+            return True
+        if directoryEntry.name in self.symbols:
+            self.selectedStocks[directoryEntry.stockId] = 1
+        return self.selectedStocks[directoryEntry.stockId] == 1
+
+    def progress(self, msgCount, offset):
+        """Called between two batches of messages: print the progress and take a checkpoint when due"""
+        self.printProgress(msgCount, offset)
+        self.checkpoint(msgCount, offset)
+
+    def hook(self, msgCount, offset):
+        """Called between two messages once msgCount reaches nextHook: print the progress every PROGRESS_INTERVAL
+        messages and take a checkpoint when due. Returns the message count of the next call."""
+        if msgCount % PROGRESS_INTERVAL == 0:
+            self.printProgress(msgCount, offset)
+        self.checkpoint(msgCount, offset)
+        return self.nextHook(msgCount)
+
+    def nextHook(self, msgCount):
+        nextHook = (msgCount // PROGRESS_INTERVAL + 1) * PROGRESS_INTERVAL
+        if self.checkpoints is not None:
+            nextHook = min(nextHook, max(self.checkpoints.nextCount(), msgCount + 1))
+        return nextHook
+
+    def checkpoint(self, msgCount, offset):
+        if self.checkpoints is not None and self.checkpoints.due(msgCount):
+            self.msgCount = msgCount
+            self.checkpoints.save(self, self.inputOffset + offset)
+
+    def printProgress(self, msgCount, offset):
+        position = self.inputOffset + offset
+        if self.stats is not None:
+            print(self.stats.progress(msgCount, position, self.inputSize), flush=True)
+        elif self.inputSize:
+            print(f"Parsed {msgCount} messages. At offset {position}/{self.inputSize} ({position / self.inputSize * 100:.2f}%)")
+        else:
+            print(f"Parsed {msgCount} messages. At offset {position}")
+
+
+# Messages between two progress lines of the per-message engine
+PROGRESS_INTERVAL = 1000000
+# Messages between two checkpoints of --resume without --checkpoint-every
+CHECKPOINT_INTERVAL = 20000000
+
+
+def parseBlocks(blocks, parse, writers, state):
+    """Run an engine over consecutive blocks of the dump. Messages may span block boundaries, so the incomplete
+    message at the end of a block is carried over to the next one."""
+    pending = b""
+    for block in blocks:
+        data = pending + block if pending else block
+        consumed = parse(data, writers, state)
+        if state.windowEnded:
+            return
+        state.inputOffset += consumed
+        pending = data[consumed:]
+    if pending:
+        raise ValueError(f"Dump ends with an incomplete message at offset {state.inputOffset}")
+
+
+def skipBytes(blocks, count):
+    """Drop the first count bytes of a stream of blocks"""
+    for block in blocks:
+        if count >= len(block):
+            count -= len(block)
+            continue
+        yield block[count:] if count else block
+        count = 0
+
+
+def parseMessages(fileContent, writers, state, start=0, end=None):
+    """Decode the complete messages in [start, end) one by one and write them to the per-stream writers.
+    Returns the offset after the last decoded message, state.windowEnded is set if parsing stopped because an event
+    past the end of the window was reached."""
+    end = len(fileContent) if end is None else end
+    msgCount = state.msgCount
+    seenStocks = state.seenStocks
+    # CSV outputs take the encoded lines directly, all other outputs get the values of the decoded records
+    encodedKinds = {kind for kind, names in WINDOWED_OUTPUTS.items()
+                    if all(isinstance(writers[name], CsvWriter) for name in names)}
+    decoders = decoderTable(encodedKinds)
+    windowedWriters = {}
+    for kind, (name, premarketName) in WINDOWED_OUTPUTS.items():
+        if kind in encodedKinds:
+            windowedWriters[kind] = (writers[name].write, writers[premarketName].write)
+        else:
+            windowedWriters[kind] = (writers[name].writerow, writers[premarketName].writerow)
+    stocksWriter = writers["stocks"]
+    marketMakerWriter = writers["marketMakers"]
+    windowStart = state.window.start
+    windowEnd = state.window.end
+    skipBefore = state.window.skipBefore
+    selected = state.selectedStocks
+    book = state.book
+    orders = state.orders
+    stats = state.stats
+    if stats is not None:
+        decoders = stats.timedDecoders(decoders)
+        windowedWriters = {kind: (stats.timedWrite(write, name), stats.timedWrite(premarketWrite, premarketName))
+                           for (kind, (write, premarketWrite)), (name, premarketName)
+                           in zip(windowedWriters.items(), WINDOWED_OUTPUTS.values())}
+        stocksWriter = stats.timedWriter(stocksWriter, "stocks")
+        marketMakerWriter = stats.timedWriter(marketMakerWriter, "marketMakers")
+
+    nextHook = state.nextHook(msgCount)
+
+    # Messages are decoded in place with unpack_from, so no bytes are copied per message
+    offset = start
+    while offset + MESSAGE_HEADER.size <= end:
+        (msgLen, msgType) = MESSAGE_HEADER.unpack_from(fileContent, offset)
+        if offset + msgLen + 2 > end:
+            break
+        decoder = decoders[msgType]
+
+        # With a symbol filter, messages of other stocks are skipped after only reading their 2 byte stock locate
+        if decoder is not None and (selected is None or decoder[1] == STOCK
+                                    or selected[fileContent[offset + 3] << 8 | fileContent[offset + 4]]):
+            (handler, kind) = decoder
+
+            if kind == STOCK:
+                record = handler(fileContent, offset + 2)
+                # Some aspects of a stock can be updated.
+                # To keep the complexity low, we don't model that and just ignore updates
+                if state.selectStock(record) and record.stockId not in seenStocks:
+                    stocksWriter.writerow(record)
+                    seenStocks.add(record.stockId)
+
+            elif kind == MARKET_MAKER:
+                marketMakerWriter.writerow(handler(fileContent, offset + 2))
+
+            else:
+                (timestamp, row) = handler(fileContent, offset + 2, orders)
+                (write, premarketWrite) = windowedWriters[kind]
+                if timestamp < windowStart:
+                    if timestamp >= skipBefore:
+                        premarketWrite(row)
+                elif timestamp > windowEnd:
+                    state.windowEnded = True
+                    break
+                else:
+                    write(row)
+                if book is not None:
+                    book.update(fileContent, offset + 2, timestamp)
+
+        elif stats is not None:
+            stats.skip(msgType, msgLen + 2)
+
+        offset += msgLen + 2
+        msgCount += 1
+        if msgCount == nextHook:
+            nextHook = state.hook(msgCount, offset)
+
+    state.msgCount = msgCount
+    return offset
+
+
+# Take every INDEX_INTERVAL-th message into the sparse timestamp index
+INDEX_INTERVAL = 100000
+INDEX_HEADER = struct.Struct("!8sQQQQ")  # magic, dump size, dump mtime, interval, directory end
+INDEX_MAGIC = b"ITCHIDX1"
+MESSAGE_TIMESTAMP = struct.Struct("!HI")  # at offset 7 of every message, after length, type, locate and tracking
+
+
+class SparseIndex:
+    """Offset and timestamp of every interval-th message of an unzipped dump, persisted next to it as <dump>.idx.
+    `directoryEnd` is the offset of the first order, execution or cancellation. The stock directory precedes it."""
+
+    def __init__(self, interval, directoryEnd, offsets, timestamps):
+        self.interval = interval
+        self.directoryEnd = directoryEnd
+        self.offsets = offsets
+        self.timestamps = timestamps
+
+    @staticmethod
+    def build(fileContent, interval):
+        offsets = array('Q')
+        timestamps = array('Q')
+        windowedTypes = {msgType[0] for msgType, (_, kind) in DECODERS.items() if kind in WINDOWED_OUTPUTS}
+        directoryEnd = None
+        msgCount = 0
+        offset = 0
+        while offset < len(fileContent):
+            if msgCount % interval == 0:
+                (timestampHigh, timestampLow) = MESSAGE_TIMESTAMP.unpack_from(fileContent, offset + 7)
+                offsets.append(offset)
+                timestamps.append(timestampHigh << 32 | timestampLow)
+            if directoryEnd is None and fileContent[offset + 2] in windowedTypes:
+                directoryEnd = offset
+            offset += (fileContent[offset] << 8 | fileContent[offset + 1]) + 2
+            msgCount += 1
+        return SparseIndex(interval, len(fileContent) if directoryEnd is None else directoryEnd, offsets, timestamps)
+
+    @staticmethod
+    def load(path):
+        """Load the index of the dump at path, None if there is none or it belongs to a different version of the dump"""
+        try:
+            with open(path + ".idx", "rb") as file:
+                (magic, size, mtime, interval, directoryEnd) = INDEX_HEADER.unpack(file.read(INDEX_HEADER.size))
+                entries = array('Q', file.read())
+        except (OSError, struct.error):
+            return None
+        stat = os.stat(path)
+        if magic != INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns:
+            return None
+        return SparseIndex(interval, directoryEnd, entries[0::2], entries[1::2])
+
+    def save(self, path):
+        stat = os.stat(path)
+        entries = array('Q', [0]) * (2 * len(self.offsets))
+        entries[0::2] = self.offsets
+        entries[1::2] = self.timestamps
+        with open(path + ".idx", "wb") as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, self.interval, self.directoryEnd))
+            entries.tofile(file)
+
+    def seek(self, timestamp):
+        """Offset of an indexed message at or before the first message with the given timestamp"""
+        i = bisect.bisect_left(self.timestamps, timestamp)
+        return self.offsets[max(i - 1, 0)] if self.offsets else 0
+
+
+# Order index updates for replayOrders: like the handlers, but they only update the OrderIndex and return the
+# timestamp. 'E', 'C' and 'X' share the layout up to the quantity, as do 'A' and 'F' up to the price.
+def indexOrderAdd(buffer, offset, orders):
+    (stockId, timestampHigh, timestampLow, orderId, side, quantity, price) = ORDER_ADD_LAYOUT.unpack_from(buffer, offset)
+    orders.add(orderId, stockId, side, price, quantity)
+    return timestampHigh << 32 | timestampLow
+
+
+def indexOrderReduce(buffer, offset, orders):
+    (_, timestampHigh, timestampLow, orderId, quantity) = ORDER_EXECUTE_LAYOUT.unpack_from(buffer, offset)
+    orders.reduce(orderId, quantity)
+    return timestampHigh << 32 | timestampLow
+
+
+def indexOrderDelete(buffer, offset, orders):
+    (_, timestampHigh, timestampLow, orderId) = ORDER_DELETE_LAYOUT.unpack_from(buffer, offset)
+    orders.remove(orderId)
+    return timestampHigh << 32 | timestampLow
+
+
+def indexOrderReplace(buffer, offset, orders):
+    (_, timestampHigh, timestampLow, orderId, newOrderId, quantity,
+     price) = ORDER_REPLACE_LAYOUT.unpack_from(buffer, offset)
+    orders.replace(orderId, newOrderId, price, quantity)
+    return timestampHigh << 32 | timestampLow
+
+
+INDEXERS = {
+    ORDER_ADD_ID: indexOrderAdd,
+    ORDER_ADD_WITH_MPID_ID: indexOrderAdd,
+    ORDER_REPLACE_ID: indexOrderReplace,
+    ORDER_CANCEL_ID: indexOrderReduce,
+    ORDER_DELETE_ID: indexOrderDelete,
+    ORDER_EXECUTE_ID: indexOrderReduce,
+    ORDER_EXECUTE_WITH_PRICE_ID: indexOrderReduce,
+}
+
+
+def replayOrders(fileContent, writers, state, start, end):
+    """Apply the order messages in [start, end) to the OrderIndex and the order book without writing their events,
+    so that after a seek, executions and replacements of earlier orders are resolved like without the seek. Stock
+    directory entries and market makers are written as usual. Returns end."""
+    indexers = [None] * 256
+    for msgType, indexer in INDEXERS.items():
+        indexers[msgType[0]] = indexer
+    stockType = STOCK_DIRECTORY_ID[0]
+    marketMakerType = MARKET_MAKER_ID[0]
+    msgCount = state.msgCount
+    selected = state.selectedStocks
+    book = state.book
+    orders = state.orders
+    nextHook = state.nextHook(msgCount)
+
+    offset = start
+    while offset < end:
+        msgType = fileContent[offset + 2]
+        indexer = indexers[msgType]
+        if indexer is not None:
+            if selected is None or selected[fileContent[offset + 3] << 8 | fileContent[offset + 4]]:
+                timestamp = indexer(fileContent, offset + 2, orders)
+                if book is not None:
+                    book.update(fileContent, offset + 2, timestamp)
+        elif msgType == stockType:
+            record = handleStockDirectory(fileContent, offset + 2)
+            if state.selectStock(record) and record.stockId not in state.seenStocks:
+                writers["stocks"].writerow(record)
+                state.seenStocks.add(record.stockId)
+        elif msgType == marketMakerType and (selected is None
+                                             or selected[fileContent[offset + 3] << 8 | fileContent[offset + 4]]):
+            writers["marketMakers"].writerow(handleMarketMakers(fileContent, offset + 2))
+
+        offset += (fileContent[offset] << 8 | fileContent[offset + 1]) + 2
+        msgCount += 1
+        if msgCount == nextHook:
+            nextHook = state.hook(msgCount, offset)
+
+    state.msgCount = msgCount
+    return offset
+
+
+def loadOrBuildIndex(sourceFile, fileContent):
+    index = SparseIndex.load(sourceFile)
+    if index is None:
+        print(f"Building sparse timestamp index {sourceFile}.idx ...")
+        index = SparseIndex.build(fileContent, INDEX_INTERVAL)
+        index.save(sourceFile)
+    return index
+
+
+def parseDump(sourceFile, parse, writers, window, symbols, book=None, stats=None, checkpoints=None):
+    """Parse a whole dump with the given engine, gzipped dumps are decompressed in a pipelined background stage.
+    For unzipped dumps, events before window.skipBefore are skipped by seeking with the sparse timestamp index, only
+    their effect on the open orders is replayed.
+    If an order book is given, it is maintained while parsing and its resting orders are written at the end.
+    With checkpoints, the run continues at their loaded checkpoint, if any, and takes new ones periodically.
+    Returns the final ParseState."""
+    gzipped = sourceFile.endswith(".gz")
+    fileContent = None if gzipped else mapDump(sourceFile)
+    state = ParseState(window, None if gzipped else len(fileContent), symbols)
+    state.book = book
+    state.stats = stats
+    state.checkpoints = checkpoints
+    resumeOffset = None if checkpoints is None else checkpoints.restore(state)
+    if gzipped:
+        blocks = gzipBlocks(sourceFile)
+        if symbols is not None:
+            # The stock directory is at the start of the first block
+            first = next(blocks, b"")
+            warnUnknownSymbols(symbols, first)
+            blocks = itertools.chain([first], blocks)
+        if resumeOffset is not None:
+            # Decompression can't seek, the data before the checkpoint is decompressed but not parsed
+            state.inputOffset = resumeOffset
+            blocks = skipBytes(blocks, resumeOffset)
+        parseBlocks(blocks, parse, writers, state)
+    else:
+        if symbols is not None:
+            warnUnknownSymbols(symbols, fileContent)
+        offset = 0
+        if resumeOffset is not None:
+            offset = resumeOffset
+        elif window.skipBefore > 0:
+            index = loadOrBuildIndex(sourceFile, fileContent)
+            # The stock directory and market makers at the start of the day are always needed
+            offset = parse(fileContent, writers, state, 0, index.directoryEnd)
+            # The events up to the seek point are dropped, but the orders they add, replace or remove are needed
+            # to resolve the later executions and replacements
+            seekOffset = index.seek(window.skipBefore)
+            if seekOffset > offset:
+                offset = replayOrders(fileContent, writers, state, offset, seekOffset)
+        if not state.windowEnded:
+            offset = parse(fileContent, writers, state, offset)
+        if not state.windowEnded and offset < len(fileContent):
+            raise ValueError(f"Dump ends with an incomplete message at offset {offset}")
+    if book is not None:
+        book.writeRestingOrders()
+    return state
+
+
+def engineFor(name):
+    if name == "numpy":
+        # NumPy is only needed for the vectorized engine
+        from vectorized import parseMessages as parse
+        return parse
+    return parseMessages
+
+
+def splitChunks(fileContent, chunkCount):
+    """Split the dump into message-aligned chunks of similar size with a cheap scan over the length prefixes"""
+    chunkSize = max(len(fileContent) // chunkCount, 1)
+    boundaries = [0]
+    nextBoundary = chunkSize
+    offset = 0
+    while offset < len(fileContent):
+        if offset >= nextBoundary:
+            boundaries.append(offset)
+            nextBoundary = offset + chunkSize
+        offset += (fileContent[offset] << 8 | fileContent[offset + 1]) + 2
+    boundaries.append(len(fileContent))
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def stockDirectory(buffer):
+    """Decode the stock directory at the start of the dump, up to the first order, execution or cancellation.
+    Returns the entries and whether the directory ends within the buffer."""
+    entries = []
+    offset = 0
+    while offset + MESSAGE_HEADER.size <= len(buffer):
+        (msgLen, msgType) = MESSAGE_HEADER.unpack_from(buffer, offset)
+        if offset + msgLen + 2 > len(buffer):
+            break
+        decoder = DECODERS.get(bytes((msgType,)))
+        if decoder is not None and decoder[1] in WINDOWED_OUTPUTS:
+            return entries, True
+        if decoder is not None and decoder[1] == STOCK:
+            entries.append(handleStockDirectory(buffer, offset + 2))
+        offset += msgLen + 2
+    return entries, False
+
+
+def warnUnknownSymbols(symbols, buffer):
+    """Warn about the requested symbols that aren't in the stock directory at the start of the buffer"""
+    (entries, complete) = stockDirectory(buffer)
+    if not complete:
+        return
+    for symbol in sorted(symbols - {entry.name for entry in entries}):
+        print(f"Warning: symbol {symbol} is not in the stock directory of the dump", file=sys.stderr)
+
+
+def resolveSymbols(fileContent, symbols):
+    """Look up the stock locate codes of the given symbols in the stock directory at the start of the dump"""
+    state = ParseState(Window(), len(fileContent), symbols)
+    for entry in stockDirectory(fileContent)[0]:
+        state.selectStock(entry)
+    return state.selectedStocks
+
+
+def parseChunk(task):
+    """Pool worker: parse one chunk of the dump into header-less CSV files in its own directory. Returns whether the
+    window ended, the orders live at the end of the chunk and the chunk's references to orders it doesn't know."""
+    (sourceFile, chunkDir, engine, window, symbols, selectedStocks, start, end) = task
+    os.makedirs(chunkDir, exist_ok=True)
+    fileContent = mapDump(sourceFile)
+    state = ParseState(window, len(fileContent), symbols)
+    # The stock directory is usually not part of this chunk, so the symbols were resolved up front
+    state.selectedStocks = selectedStocks
+    orders = state.orders = ChunkOrderIndex()
+    with ExitStack() as stack:
+        writers = openCsvOutputs(chunkDir, stack, header=False)
+        engineFor(engine)(fileContent, writers, state, start, end)
+    return state.windowEnded, orders.orders, orders.replaced, orders.reduced, orders.removed
+
+
+def patchExecution(line, orders):
+    """Fill in the price and side of an execution line whose order wasn't known to its chunk"""
+    fields = line.split(b";")
+    order = orders.get(int(fields[1]))
+    if order is None:
+        return line
+    if not fields[4]:
+        price = order >> 49
+        fields[4] = b"%d.%04d" % (price // 10000, price % 10000)
+    fields[5] = ENCODED_ORDER_SIDES[order & 1] + b"\r\n"
+    return b";".join(fields)
+
+
+def patchOrder(line, orders):
+    """Fill in the side of a replacing order whose replaced order wasn't known to its chunk"""
+    fields = line.split(b";", 4)
+    order = orders.get(int(fields[2]))
+    if order is None:
+        return line
+    fields[3] = ENCODED_ORDER_SIDES[order & 1]
+    return b";".join(fields)
+
+
+def isUnresolvedExecution(line):
+    # Trades have no order id but always a side
+    return line.endswith(b";\r\n")
+
+
+def isUnresolvedOrder(line):
+    return line.split(b";", 4)[3] == b""
+
+
+# Outputs of a chunk with lines that may reference orders of earlier chunks: (is unresolved, patch, record kind)
+PATCHED_OUTPUTS = {
+    "orders": (isUnresolvedOrder, patchOrder, ORDER),
+    "ordersPreMarket": (isUnresolvedOrder, patchOrder, ORDER),
+    "executions": (isUnresolvedExecution, patchExecution, EXECUTION),
+    "executionsPreMarket": (isUnresolvedExecution, patchExecution, EXECUTION),
+}
+
+
+def copyPatched(chunkFile, outFile, isUnresolved, patch, orders, remaining):
+    """Append a chunk file, patching its unresolved lines from the orders of earlier chunks. Lines are only scanned
+    until `remaining` unresolved lines were found, the rest is copied as is. Returns the new remaining count."""
+    for line in chunkFile:
+        if isUnresolved(line):
+            line = patch(line, orders)
+            remaining -= 1
+        outFile.write(line)
+        if remaining == 0:
+            break
+    shutil.copyfileobj(chunkFile, outFile, 1 << 20)
+    return remaining
+
+
+def parseParallel(sourceFile, outputDir, engine, window, symbols, workers):
+    """Parse message-aligned chunks of the dump in a process pool and concatenate the per-chunk outputs.
+    The dump is ordered by time, so appending the chunks in file order keeps every output in timestamp order.
+    Every chunk starts without the orders of the earlier chunks, so the parent carries the live orders from chunk to
+    chunk and resolves the price and side of the executions and replacements the chunk couldn't resolve itself."""
+    fileContent = mapDump(sourceFile)
+    chunks = splitChunks(fileContent, workers * 8)
+    selectedStocks = None
+    if symbols is not None:
+        warnUnknownSymbols(symbols, fileContent)
+        selectedStocks = resolveSymbols(fileContent, symbols)
+    tmpDir = os.path.join(outputDir, ".chunks")
+    tasks = [(sourceFile, os.path.join(tmpDir, str(i)), engine, window, symbols, selectedStocks, start, end)
+             for i, (start, end) in enumerate(chunks)]
+
+    # Write the headers, the chunks are appended below
+    with ExitStack() as stack:
+        openCsvOutputs(outputDir, stack)
+
+    seenStocks = set()
+    # Orders of the chunks appended so far that were still live at the end of the last one
+    carried = OrderIndex()
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for (_, chunkDir, *_), result in zip(tasks, pool.imap(parseChunk, tasks)):
+                (windowEnded, chunkOrders, replaced, reduced, removed) = result
+                # Like in the NumPy engine, all replacements are applied before the lookups and the old orders are
+                # only removed afterwards, order ids are never reused
+                for (orderId, newOrderId, price, quantity) in replaced:
+                    order = carried.orders.get(orderId)
+                    if order is not None:
+                        carried.orders[newOrderId] = price << 49 | quantity << 17 | (order & 0x1FFFF)
+                # Upper bounds of the unresolved lines per record kind, some may be before --premarket-from
+                remaining = {ORDER: len(replaced), EXECUTION: len(reduced)}
+                for name in OUTPUTS:
+                    with (open(os.path.join(chunkDir, name + ".csv"), "rb") as chunkFile,
+                          open(os.path.join(outputDir, name + ".csv"), "ab") as outFile):
+                        if name == "stocks":
+                            # Every chunk only dedupes its own stock directory entries
+                            for line in chunkFile:
+                                stockId = line.split(b";", 1)[0]
+                                if stockId not in seenStocks:
+                                    outFile.write(line)
+                                    seenStocks.add(stockId)
+                        elif name in PATCHED_OUTPUTS and remaining[PATCHED_OUTPUTS[name][2]] > 0:
+                            (isUnresolved, patch, kind) = PATCHED_OUTPUTS[name]
+                            remaining[kind] = copyPatched(chunkFile, outFile, isUnresolved, patch, carried.orders,
+                                                          remaining[kind])
+                        else:
+                            shutil.copyfileobj(chunkFile, outFile, 1 << 20)
+                shutil.rmtree(chunkDir)
+                # Like the sequential parser, everything after the first event past the window is dropped
+                if windowEnded:
+                    break
+                for (orderId, _, _, _) in replaced:
+                    carried.remove(orderId)
+                for (orderId, quantity) in reduced:
+                    carried.reduce(orderId, quantity)
+                for orderId in removed:
+                    carried.remove(orderId)
+                carried.orders.update(chunkOrders)
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process a source and output directory.")
 
     # Add arguments for source and output directories
-    parser.add_argument("dumpFile", type=str, help="Path to the unzipped NASDAQ dump file")
-    parser.add_argument("outputDir", type=str, help="Path to the output directory")
+    parser.add_argument("dumpFile", type=str,
+                        help="Path to the NASDAQ dump file, gzipped dumps (*.gz) are decompressed on the fly")
+    parser.add_argument("outputDir", type=str, nargs="?", help="Path to the output directory")
+    parser.add_argument("--db", type=str,
+                        help="Instead of writing CSV files, load the data directly into the tables of client/schema.sql "
+                             "in the database with this connection string, e.g. 'host=localhost user=postgres'")
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv",
+                        help="Write semicolon separated CSV, or compressed columnar Parquet or Arrow IPC files")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="Decode message by message in Python, or in vectorized batches with NumPy")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes parsing chunks of the dump in parallel")
+    parser.add_argument("--window-start", type=parseTime, default=Window.start, metavar="HH:MM[:SS]",
+                        help="Start of the replay window, earlier events go to the premarket outputs (default: 09:40)")
+    parser.add_argument("--window-end", type=parseTime, default=Window.end, metavar="HH:MM[:SS]",
+                        help="End of the replay window, parsing stops at the first event after it (default: 10:40)")
+    parser.add_argument("--premarket-from", type=parseTime, default=0, metavar="HH:MM[:SS]",
+                        help="Drop premarket events before this time. For unzipped dumps, the parser seeks there using "
+                             "a sparse timestamp index, which is built and stored as <dumpFile>.idx on first use")
+    parser.add_argument("--symbols", type=lambda value: set(value.split(",")), metavar="AAPL,MSFT,...",
+                        help="Only output the events of these stock symbols")
+    parser.add_argument("--book", action="store_true",
+                        help="Reconstruct the order book while parsing: write the orders resting at the end of the "
+                             "window to the orderbook output and periodic depth snapshots to orderbookDepth")
+    parser.add_argument("--book-interval", type=float, default=10, metavar="SECONDS",
+                        help="Interval of the depth snapshots within the replay window (default: 10)")
+    parser.add_argument("--book-depth", type=int, default=10, metavar="LEVELS",
+                        help="Number of price levels per side in the depth snapshots (default: 10)")
+    parser.add_argument("--stats", type=str, metavar="FILE",
+                        help="Count and time every message type and output, print the progress as JSON lines and "
+                             "write a JSON summary to this file")
+    parser.add_argument("--checkpoint-every", type=int, metavar="MESSAGES",
+                        help=f"Checkpoint the run to <outputDir>/checkpoint.pickle every MESSAGES messages "
+                             f"(default with --resume: {CHECKPOINT_INTERVAL}). The NumPy engine checkpoints between "
+                             f"its batches, i.e. every MESSAGES messages rounded up to whole batches")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from the checkpoint in the output directory, if there is "
+                             "one. The outputs are truncated to the checkpoint. Implies --checkpoint-every")
+    parser.add_argument("--candles", type=lambda value: value.split(","), default=[], metavar="1s,10s,1m",
+                        help="Aggregate the executions into OHLCV candles of these bucket sizes, written to the "
+                             "candles_<bucket> outputs")
 
     # Parse the command-line arguments
     args = parser.parse_args()
+    if args.db is None and args.outputDir is None:
+        parser.error("either an output directory or --db is required")
+    if args.workers > 1 and (args.db is not None or args.format != "csv"):
+        parser.error("--workers only supports the CSV output")
+    if args.workers > 1 and args.dumpFile.endswith(".gz"):
+        parser.error("--workers needs an unzipped dump")
+    if args.workers > 1 and args.book:
+        parser.error("--book needs all events in order and doesn't support --workers")
+    if args.workers > 1 and args.candles:
+        parser.error("--candles needs all events in order and doesn't support --workers")
+    if args.workers > 1 and args.stats:
+        parser.error("--stats doesn't support --workers")
+    checkpointing = args.resume or args.checkpoint_every is not None
+    if checkpointing and (args.workers > 1 or args.db is not None or args.format != "csv"):
+        parser.error("--checkpoint-every and --resume only support the sequential CSV output")
+    for bucket in args.candles:
+        if bucket not in CANDLE_BUCKETS:
+            parser.error(f"unknown candle bucket size {bucket}, choose from {', '.join(CANDLE_BUCKETS)}")
 
     # Access the arguments
     source_file = args.dumpFile
     output_dir = args.outputDir
+    window = Window(args.window_start, args.window_end, args.premarket_from)
+    outputs = {**OUTPUTS, **BOOK_OUTPUTS} if args.book else dict(OUTPUTS)
+    for bucket in args.candles:
+        outputs[f"candles_{bucket}"] = candleSchema
+
+    checkpoints = None
+    if checkpointing:
+        from checkpoint import Checkpoints
+        os.makedirs(output_dir, exist_ok=True)
+        checkpoints = Checkpoints(output_dir, args.checkpoint_every or CHECKPOINT_INTERVAL, source_file, vars(args))
+
+    def parse(writers):
+        if checkpoints is not None:
+            checkpoints.writers = dict(writers)
+        book = None
+        if args.book:
+            from orderbook import OrderBook
+            book = OrderBook(writers, window, int(args.book_interval * 1e9), args.book_depth)
+        aggregators = []
+        if args.candles:
+            from candles import CandleAggregator, CandleTee
+            aggregators = [CandleAggregator(writers[f"candles_{bucket}"], CANDLE_BUCKETS[bucket])
+                           for bucket in args.candles]
+            for name in WINDOWED_OUTPUTS[EXECUTION]:
+                writers[name] = CandleTee(writers[name], aggregators)
+            if checkpoints is not None:
+                checkpoints.aggregators = aggregators
+        stats = None
+        if args.stats:
+            from stats import ParseStats
+            stats = ParseStats()
+        state = parseDump(source_file, engineFor(args.engine), writers, window, args.symbols, book, stats,
+                          checkpoints)
+        for aggregator in aggregators:
+            aggregator.flush()
+        if stats is not None:
+            stats.writeSummary(args.stats, state)
+
+    if args.db is not None:
+        with ExitStack() as stack:
+            parse(openCopyOutputs(args.db, stack, outputs))
+        return
 
     # Ensure the output directory exists (create it if needed)
     os.makedirs(output_dir, exist_ok=True)
 
-
-    with (open(os.path.join(output_dir, "orders.csv"), "w") as orderFile,
-          open(os.path.join(output_dir, "ordersPreMarket.csv"), "w") as orderPremarketFile,
-          open(os.path.join(output_dir, "executions.csv"), "w") as executionFile,
-          open(os.path.join(output_dir, "executionsPreMarket.csv"), "w") as executionPremarketFile,
-          open(os.path.join(output_dir, "cancellations.csv"), "w") as cancellationFile,
-          open(os.path.join(output_dir, "cancellationsPreMarket.csv"), "w") as cancellationPremarketFile,
-          open(os.path.join(output_dir, "stocks.csv"), "w") as stocksFile,
-          open(os.path.join(output_dir, "marketMakers.csv"), "w") as marketMakerFile):
-
-        orderWriter = csv.writer(orderFile, delimiter=";")
-        orderWriter.writerow(orderSchema)
-        orderPremarketWriter = csv.writer(orderPremarketFile, delimiter=";")
-        orderPremarketWriter.writerow(orderSchema)
-
-        executionWriter = csv.writer(executionFile, delimiter=";")
-        executionWriter.writerow(executionSchema)
-        executionPremarketWriter = csv.writer(executionPremarketFile, delimiter=";")
-        executionPremarketWriter.writerow(executionSchema)
-
-        cancellationWriter = csv.writer(cancellationFile, delimiter=";")
-        cancellationWriter.writerow(cancellationSchema)
-        cancellationPremarketWriter = csv.writer(cancellationPremarketFile, delimiter=";")
-        cancellationPremarketWriter.writerow(cancellationSchema)
-
-        stocksWriter = csv.writer(stocksFile, delimiter=";")
-        stocksWriter.writerow(stocksSchema)
-
-        marketMakerWriter = csv.writer(marketMakerFile, delimiter=";")
-        marketMakerWriter.writerow(marketMakerSchema)
-
-        msgCount = 0
-        seenStocks = []
-
-        with open(source_file, mode='rb') as file:
-            fileContent = file.read()
-            offset = 0
-            while offset < len(fileContent):
-                (msgLen,) = struct.unpack('!H', fileContent[offset:offset + 2])
-                (msgType,) = struct.unpack('!c', fileContent[offset + 2:offset + 3])
-
-                pkg = fileContent[offset + 2:offset + msgLen + 2]
-                order = None
-                cancellation = None
-                execution = None
-
-                if msgType == STOCK_DIRECTORY_ID:
-                    directoryEntry = handleStockDirectory(pkg)
-                    # Some aspects of a stock can be updated.
-                    # To keep the complexity low, we don't model that and just ignore updates
-                    # Quadratic complexity is ok here since there are at most a few thousand stocks
-                    if directoryEntry.stockId not in seenStocks:
-                        stocksWriter.writerow(directoryEntry.__dict__.values())
-                        seenStocks.append(directoryEntry.stockId)
-
-
-                elif msgType == MARKET_MAKER_ID:
-                    marketMaker = handleMarketMakers(pkg)
-                    marketMakerWriter.writerow(marketMaker.__dict__.values())
-
-                elif msgType == ORDER_ADD_ID:
-                    order = handleOrderAdd(pkg)
-                elif msgType == ORDER_ADD_WITH_MPID_ID:
-                    order = handleOrderAddWithAttribution(pkg)
-                elif msgType == ORDER_REPLACE_ID:
-                    order = handleOrderReplace(pkg)
-
-                elif msgType == ORDER_CANCEL_ID:
-                    cancellation = handleOrderCancel(pkg)
-                elif msgType == ORDER_DELETE_ID:
-                    cancellation = handleOrderDelete(pkg)
-
-                elif msgType == ORDER_EXECUTE_ID:
-                    execution = handleOrderExecute(pkg)
-                elif msgType == ORDER_EXECUTE_WITH_PRICE_ID:
-                    execution = handleOrderExecuteWithPrice(pkg)
-                elif msgType == TRADE_ID:
-                    execution = handleTrade(pkg)
-
-                if order:
-                    if order.timestamp < MARKET_OPEN_TS + START_POINT:
-                        orderPremarketWriter.writerow(order.__dict__.values())
-                    elif order.timestamp > MARKET_OPEN_TS + END_POINT:
-                        break
-                    else:
-                        orderWriter.writerow(order.__dict__.values())
-
-                if execution:
-                    if execution.timestamp < MARKET_OPEN_TS + START_POINT:
-                        executionPremarketWriter.writerow(execution.__dict__.values())
-                    elif execution.timestamp > MARKET_OPEN_TS + END_POINT:
-                        break
-                    else:
-                        executionWriter.writerow(execution.__dict__.values())
-
-                if cancellation:
-                    if cancellation.timestamp < MARKET_OPEN_TS + START_POINT:
-                        cancellationPremarketWriter.writerow(cancellation.__dict__.values())
-                    elif cancellation.timestamp > MARKET_OPEN_TS + END_POINT:
-                        break
-                    else:
-                        cancellationWriter.writerow(cancellation.__dict__.values())
-
-                offset += msgLen + 2
-                msgCount += 1
-                if msgCount % 1000000 == 0:
-                    print(f"Parsed {msgCount} messages. At offset {offset}/{len(fileContent)} ({offset / len(fileContent) * 100:.2f}%)")
+    if args.workers > 1:
+        parseParallel(source_file, output_dir, args.engine, window, args.symbols, args.workers)
+        return
+
+    sizes = None
+    if args.resume:
+        try:
+            sizes = checkpoints.load()
+        except ValueError as e:
+            parser.error(str(e))
+
+    with ExitStack() as stack:
+        if args.format == "csv":
+            parse(openCsvOutputs(output_dir, stack, outputs=outputs, sizes=sizes))
+        else:
+            parse(openColumnarOutputs(output_dir, args.format, stack, outputs))
+    if checkpoints is not None:
+        checkpoints.remove()
 
 
 if __name__ == '__main__':
@@ -13,7 +13,8 @@ DOWNLOAD_URL="https://emi.nasdaq.com/ITCH/Nasdaq%20ITCH/01302020.NASDAQ_ITCH50.g
 
 
 if [[ -f "$UNZIPPED_FILE_PATH" && $(calculate_hash "$UNZIPPED_FILE_PATH") == "$UNZIPPED_EXPECTED_HASH" ]]; then
-    echo "Found extracted NASDAQ dump. Skipping download and extraction."
+    echo "Found extracted NASDAQ dump. Skipping download."
+    DUMP_FILE_PATH="$UNZIPPED_FILE_PATH"
 else
     if [[ -f "$GZ_FILE_PATH" && $(calculate_hash "$GZ_FILE_PATH") == "$GZ_EXPECTED_HASH" ]]; then
         echo "Found compressed NASDAQ dump. Skipping download ..."
@@ -22,9 +23,9 @@ else
         mkdir -p data 
         wget -P data "$DOWNLOAD_URL"
     fi
-    printf "Unzipping ...\n"
-    gunzip "$GZ_FILE_PATH"
+    # The parser decompresses the dump on the fly, so we don't need to unzip it first
+    DUMP_FILE_PATH="$GZ_FILE_PATH"
 fi
 
-printf "Unzipping complete, parsing messages...\n"
-python3 parser.py "$UNZIPPED_FILE_PATH" "data/"
+printf "Parsing messages...\n"
+python3 parser.py "$DUMP_FILE_PATH" "data/"
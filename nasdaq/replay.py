@@ -0,0 +1,301 @@
+"""Paced live replay of the parsed events into CedarDB, the Python counterpart of the C++ client (requires
+`pip install "psycopg[binary]"`).
+
+Like NasdaqClient::runExchange, the first replayed event is treated as the point in time the replay started. Every
+batch interval (default: 100 ms), all orders, executions and cancellations up to the current replay time are written
+in one transaction and the orderbook table is maintained along the way: new orders are added, replaced and deleted
+orders removed, executions and partial cancellations reduce the resting quantity. With a speed-up factor, the replay
+time runs that many times faster than the wall clock.
+
+The events come from the CSV files of parser.py or straight from a dump via messages.py. They are sent either as
+pipelined prepared INSERTs like the C++ client, or with one COPY per table and batch. The achieved events/s and the
+latency of every batch are reported.
+"""
+from contextlib import nullcontext
+
+import argparse
+import csv
+import heapq
+import json
+import os
+import statistics
+import sys
+import time
+
+from parser import Cancellation, Execution, MarketMaker, Order, StockDirectoryEntry, Window, parseTime, toNumeric
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "client", "schema.sql")
+
+# Event tables and the column of the timestamp in their CSV files
+EVENT_TABLES = {
+    "orders": 1,
+    "executions": 0,
+    "cancellations": 0,
+}
+STATIC_FILES = {
+    "stocks": "stocks",
+    "marketmakers": "marketMakers",
+}
+PREMARKET_FILES = {
+    "orders": "ordersPreMarket",
+    "executions": "executionsPreMarket",
+    "cancellations": "cancellationsPreMarket",
+}
+
+INSERTS = {
+    "orders": "INSERT INTO orders VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+    "executions": "INSERT INTO executions VALUES (%s, %s, %s, %s, %s, %s)",
+    "cancellations": "INSERT INTO cancellations VALUES (%s, %s, %s, %s)",
+}
+ADD_TO_BOOK = "INSERT INTO orderbook VALUES (%s, %s, %s, %s, %s)"
+DELETE_FROM_BOOK = "DELETE FROM orderbook WHERE orderId = %s"
+REDUCE_IN_BOOK = "UPDATE orderbook SET quantity = quantity - %s WHERE orderId = %s"
+
+RECORD_TABLES = {
+    Order: "orders",
+    Execution: "executions",
+    Cancellation: "cancellations",
+    StockDirectoryEntry: "stocks",
+    MarketMaker: "marketmakers",
+}
+
+
+def csvRows(path):
+    """Rows of a parser.py CSV file, empty fields are NULL and all other values are passed on as text"""
+    with open(path, newline="") as file:
+        reader = csv.reader(file, delimiter=";")
+        next(reader)
+        for row in reader:
+            yield [value if value else None for value in row]
+
+
+def csvTableEvents(dataDir, table):
+    column = EVENT_TABLES[table]
+    for row in csvRows(os.path.join(dataDir, table + ".csv")):
+        yield int(row[column]), table, row
+
+
+def csvEvents(dataDir):
+    """(timestamp, table, row) of the in-window CSV files, merged in timestamp order"""
+    return heapq.merge(*(csvTableEvents(dataDir, table) for table in EVENT_TABLES), key=lambda event: event[0])
+
+
+def dumpEvents(path, symbols):
+    """(timestamp, table, row) of all records of a dump in file order, static records have timestamp 0"""
+    from messages import iterMessages
+
+    for record in iterMessages(path, symbols=symbols):
+        table = RECORD_TABLES[type(record)]
+        if table in ("orders", "executions"):
+            yield record.timestamp, table, record._replace(price=toNumeric(record.price))
+        elif table == "cancellations":
+            yield record.timestamp, table, record
+        else:
+            yield 0, table, record
+
+
+class Batch:
+    """Event rows per table and the orderbook updates in event order, grouped into runs of the same statement"""
+
+    def __init__(self):
+        self.rows = {table: [] for table in EVENT_TABLES}
+        self.bookUpdates = []
+        self.events = 0
+
+    def update(self, statement, params):
+        if self.bookUpdates and self.bookUpdates[-1][0] is statement:
+            self.bookUpdates[-1][1].append(params)
+        else:
+            self.bookUpdates.append((statement, [params]))
+
+    def add(self, table, row):
+        self.rows[table].append(row)
+        self.events += 1
+        if table == "orders":
+            (stockId, _, orderId, side, quantity, price, _, prevOrder) = row
+            self.update(ADD_TO_BOOK, (orderId, stockId, side, price, quantity))
+            if prevOrder is not None:
+                self.update(DELETE_FROM_BOOK, (prevOrder,))
+        elif table == "executions":
+            (_, orderId, _, quantity, _, _) = row
+            # Only executions of visible orders change the order book
+            if orderId is not None:
+                self.update(REDUCE_IN_BOOK, (quantity, orderId))
+        else:
+            (_, orderId, _, quantity) = row
+            if quantity is None:
+                self.update(DELETE_FROM_BOOK, (orderId,))
+            else:
+                self.update(REDUCE_IN_BOOK, (quantity, orderId))
+
+
+def copyRows(cursor, table, rows):
+    with cursor.copy(f"COPY {table} FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+def send(connection, batch, method):
+    """Write a batch in one transaction"""
+    with connection.cursor() as cursor:
+        with connection.pipeline() if method == "pipeline" else nullcontext(), connection.transaction():
+            for table, rows in batch.rows.items():
+                if not rows:
+                    continue
+                if method == "pipeline":
+                    cursor.executemany(INSERTS[table], rows)
+                else:
+                    copyRows(cursor, table, rows)
+            for statement, params in batch.bookUpdates:
+                cursor.executemany(statement, params)
+
+
+def setUp(connection, source, fromDump, events, windowStart):
+    """Create the schema and bulk load the stocks, market makers and premarket events. For a dump, the events are
+    consumed up to the first one at or after windowStart, which is returned."""
+    with open(SCHEMA) as file:
+        connection.execute(file.read())
+    with connection.cursor() as cursor:
+        if not fromDump:
+            for table, name in {**STATIC_FILES, **PREMARKET_FILES}.items():
+                copyRows(cursor, table, csvRows(os.path.join(source, name + ".csv")))
+            connection.commit()
+            return None
+        rows = {table: [] for table in RECORD_TABLES.values()}
+        seenStocks = set()
+        for event in events:
+            (timestamp, table, row) = event
+            if table not in ("stocks", "marketmakers") and timestamp >= windowStart:
+                break
+            # Like parser.py, only the first directory entry of a stock is kept
+            if table == "stocks":
+                if row.stockId in seenStocks:
+                    continue
+                seenStocks.add(row.stockId)
+            rows[table].append(row)
+        else:
+            event = None
+        for table, tableRows in rows.items():
+            copyRows(cursor, table, tableRows)
+    connection.commit()
+    return event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the parsed NASDAQ events into the database in real time.")
+    parser.add_argument("source", type=str,
+                        help="Output directory of parser.py, or a dump (*.gz or *NASDAQ_ITCH50) to decode on the fly")
+    parser.add_argument("--db", type=str, default="host=localhost user=postgres password=postgres dbname=postgres",
+                        help="Connection string of the database")
+    parser.add_argument("--speed", type=float, default=1, help="Speed-up factor of the replay time (default: 1)")
+    parser.add_argument("--batch-interval", type=float, default=100, metavar="MS",
+                        help="Milliseconds between two batches (default: 100)")
+    parser.add_argument("--method", choices=["pipeline", "copy"], default="pipeline",
+                        help="Send the events as pipelined prepared INSERTs or with one COPY per table and batch")
+    parser.add_argument("--setup", action="store_true",
+                        help="Create the schema of client/schema.sql and load the stocks, market makers and premarket "
+                             "events first")
+    parser.add_argument("--window-start", type=parseTime, default=Window.start, metavar="HH:MM[:SS]",
+                        help="For a dump: events before it are premarket events, replayed from it (default: 09:40)")
+    parser.add_argument("--symbols", type=lambda value: set(value.split(",")), metavar="AAPL,MSFT,...",
+                        help="For a dump: only replay the events of these stock symbols")
+    parser.add_argument("--duration", type=float, metavar="SECONDS", help="Stop after this many seconds")
+    parser.add_argument("--json", type=str, help="Also write the statistics to this file")
+    args = parser.parse_args()
+
+    import psycopg
+
+    fromDump = not os.path.isdir(args.source)
+    if fromDump:
+        events = dumpEvents(args.source, args.symbols)
+    else:
+        events = csvEvents(args.source)
+    batchInterval = args.batch_interval / 1000
+
+    with psycopg.connect(args.db) as connection:
+        first = None
+        if args.setup:
+            print("Creating the schema and loading the premarket data ...")
+            first = setUp(connection, args.source, fromDump, events, args.window_start)
+        elif fromDump:
+            # Without --setup, everything before the window is skipped
+            first = next((event for event in events if event[1] in EVENT_TABLES and event[0] >= args.window_start),
+                         None)
+        if first is None:
+            first = next(events, None)
+        if first is None:
+            print("No events to replay")
+            return
+
+        pending = first
+        base = replayedUntil = first[0]
+        start = time.perf_counter()
+        latencies = []
+        batchEvents = []
+        lateBatches = 0
+        lastReport = start
+        while pending is not None:
+            batchStart = time.perf_counter()
+            if args.duration is not None and batchStart - start >= args.duration:
+                break
+            limit = base + (batchStart - start) * args.speed * 1e9
+            batch = Batch()
+            while pending is not None and pending[0] < limit:
+                (timestamp, table, row) = pending
+                if table in EVENT_TABLES:
+                    batch.add(table, row)
+                    replayedUntil = timestamp
+                pending = next(events, None)
+            send(connection, batch, args.method)
+            latency = time.perf_counter() - batchStart
+            latencies.append(latency)
+            batchEvents.append(batch.events)
+
+            if latency > batchInterval:
+                # The database doesn't keep up, the next batch catches up with the replay time
+                lateBatches += 1
+            else:
+                time.sleep(batchInterval - latency)
+            now = time.perf_counter()
+            if now - lastReport >= 10:
+                replayed = sum(batchEvents)
+                print(f"{replayed} events in {now - start:.0f}s ({replayed / (now - start):,.0f} events/s), "
+                      f"last batch {batch.events} events in {latency * 1000:.1f} ms")
+                lastReport = now
+
+    elapsed = time.perf_counter() - start
+    if not latencies:
+        # E.g. with --duration 0, there are no latencies to report
+        sys.exit("No batches sent")
+    latenciesMs = sorted(latency * 1000 for latency in latencies)
+    replayed = sum(batchEvents)
+    stats = {
+        "method": args.method,
+        "speed": args.speed,
+        "seconds": elapsed,
+        "events": replayed,
+        "eventsPerSecond": replayed / elapsed,
+        "replayedSeconds": (replayedUntil - base) / 1e9,
+        "batches": len(latencies),
+        "lateBatches": lateBatches,
+        "eventsPerBatch": {"mean": statistics.fmean(batchEvents), "max": max(batchEvents)},
+        "batchLatencyMs": {
+            "mean": statistics.fmean(latenciesMs),
+            "p50": latenciesMs[len(latenciesMs) // 2],
+            "p95": latenciesMs[int(len(latenciesMs) * 0.95)],
+            "p99": latenciesMs[int(len(latenciesMs) * 0.99)],
+            "max": latenciesMs[-1],
+        },
+    }
+    print(f"Replayed {replayed} events in {elapsed:.1f}s: {stats['eventsPerSecond']:,.0f} events/s, "
+          f"{stats['replayedSeconds']:.1f}s of market time at {args.speed}x")
+    print(f"Batch latency: mean {stats['batchLatencyMs']['mean']:.1f} ms, p50 {stats['batchLatencyMs']['p50']:.1f} ms, "
+          f"p99 {stats['batchLatencyMs']['p99']:.1f} ms, max {stats['batchLatencyMs']['max']:.1f} ms, "
+          f"{lateBatches} of {len(latencies)} batches took longer than {args.batch_interval:.0f} ms")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(stats, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
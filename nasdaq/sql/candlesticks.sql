@@ -10,14 +10,13 @@ with limits as (
 ),
 prices as (
   -- for any order of a given stock executed within the relevant time span, find the price
+  -- (the parser resolves the price of executions that only reference the order)
   select 
     e.timestamp as time, s.name as metric, 
-    -- if the execution itself has a price, it takes precedence
-    max(coalesce(e.price, o.price)) as value,
-    max(coalesce(e.price, o.price) * e.quantity) as volume
-  from executions e, stocks s, orders o, limits l
-  where e.orderid = o.orderid
-    and o.stockid = s.stockid 
+    max(e.price) as value,
+    max(e.price * e.quantity) as volume
+  from executions e, stocks s, limits l
+  where e.stockid = s.stockid 
     and s.name in ('AAPL', 'MSFT') -- stock ticker symbols we're interested in
     and e.timestamp >= l.start
     and e.timestamp < l.end
@@ -0,0 +1,12 @@
+-- Query the candlestick chart of candlesticks.sql from the 10 second candles of `parser.py --candles 10s`.
+-- Unlike there, the volume is the number of traded shares, not the traded dollar amount.
+select 
+    s.name as metric,
+    extract(epoch from current_date + (c.timestamp/(1000*1000) * interval '1 millisecond')) as time,
+    c.open, c.close, c.high, c.low, c.volume
+from candles_10s c, stocks s
+where c.stockId = s.stockId
+  and s.name in ('AAPL', 'MSFT') -- stock ticker symbols we're interested in
+  and c.timestamp >= 34200000000000 -- from 9:30 AM (in nanoseconds since midnight), i.e. the start of trading day
+  and c.timestamp < 34200000000000 + (30*60)::bigint * 1000 * 1000 * 1000 -- to 30 minutes after market start
+order by metric, time;
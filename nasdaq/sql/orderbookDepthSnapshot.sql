@@ -0,0 +1,23 @@
+-- Query the same depth chart as orderbookDepth.sql from the depth deltas of `parser.py --book`
+with latest as (
+    -- the latest row of each price of the book, a price is only written when its quantity changed
+    select d.side, d.price, max(d.timestamp) as timestamp
+    from orderbookdepth d, stocks s
+    where d.stockId = s.stockId
+    and s.name = 'AAPL' -- stock ticker symbol we're interested in
+    group by d.side, d.price
+),
+orderdepth as (
+    select d.price, d.side, d.quantity
+    from orderbookdepth d, stocks s, latest l
+    where d.stockId = s.stockId
+    and s.name = 'AAPL'
+    and d.side = l.side
+    and d.price = l.price
+    and d.timestamp = l.timestamp
+    and d.quantity > 0 -- quantity 0 marks a price that left the top of the book
+)
+-- transform both sides into a cumulative sum with a window query, starting at the best price
+select price, side, sum(quantity) over (partition by side order by case when side = 'BUY' then -price else price end) as sum
+from orderdepth
+order by price;
@@ -0,0 +1,163 @@
+"""Per message type profiling counters of a parse, used by `parser.py --stats`.
+
+Counted per message type byte: messages and bytes, messages skipped by the symbol filter or because the type isn't
+decoded, and the time spent decoding and writing them. Counted per output stream: rows and write time. The Python
+engine times every handler and writer call. The NumPy engine times the decoding of each type group of a batch and
+each bulk write, so its write time is only known per stream.
+"""
+import json
+import time
+
+from parser import DECODERS, WINDOWED_OUTPUTS
+
+DECODED_TYPES = {msgType[0] for msgType in DECODERS}
+
+
+class ParseStats:
+    def __init__(self):
+        self.counts = [0] * 256
+        self.bytes = [0] * 256
+        self.skipped = [0] * 256  # filtered by --symbols
+        self.decodeNs = [0] * 256
+        self.writeNs = [0] * 256
+        self.streams = {}  # output name -> [rows, write ns]
+        self.current = 0  # type of the message being written
+        self.started = time.perf_counter()
+        self.lastTime = self.started
+        self.lastCount = 0
+        self.lastPosition = 0
+
+    def skip(self, msgType, length):
+        """Count a message that isn't decoded, either an unknown type or filtered by --symbols"""
+        self.counts[msgType] += 1
+        self.bytes[msgType] += length
+        if msgType in DECODED_TYPES:
+            self.skipped[msgType] += 1
+
+    def countBatch(self, msgType, messages, size, skipped):
+        """Count a group of messages of one type, used by the NumPy engine"""
+        self.counts[msgType] += messages
+        self.bytes[msgType] += size
+        if msgType in DECODED_TYPES:
+            self.skipped[msgType] += skipped
+
+    def timedDecoders(self, decoders):
+        """Wrap the handlers of a decoderTable to count and time the messages they decode"""
+        counts = self.counts
+        sizes = self.bytes
+        decodeNs = self.decodeNs
+        clock = time.perf_counter_ns
+
+        def timed(handler, msgType):
+            def decode(buffer, offset, *orders):
+                start = clock()
+                record = handler(buffer, offset, *orders)
+                decodeNs[msgType] += clock() - start
+                counts[msgType] += 1
+                sizes[msgType] += (buffer[offset - 2] << 8 | buffer[offset - 1]) + 2
+                self.current = msgType
+                return record
+            return decode
+
+        return [None if decoder is None else (timed(decoder[0], msgType), decoder[1])
+                for msgType, decoder in enumerate(decoders)]
+
+    def timedWrite(self, write, name):
+        """Wrap a write or writerow method to count and time the rows of an output stream"""
+        stream = self.streams.setdefault(name, [0, 0])
+        writeNs = self.writeNs
+        clock = time.perf_counter_ns
+
+        def timed(row):
+            start = clock()
+            write(row)
+            elapsed = clock() - start
+            writeNs[self.current] += elapsed
+            stream[0] += 1
+            stream[1] += elapsed
+        return timed
+
+    def timedWriter(self, writer, name):
+        return TimedWriter(writer, self.streams.setdefault(name, [0, 0]))
+
+    def progress(self, msgCount, position, inputSize):
+        """Progress line with the rates since the last line and since the start"""
+        now = time.perf_counter()
+        interval = max(now - self.lastTime, 1e-9)
+        elapsed = max(now - self.started, 1e-9)
+        line = {
+            "messages": msgCount,
+            "offset": position,
+            "size": inputSize,
+            "seconds": round(elapsed, 3),
+            "messagesPerSecond": round((msgCount - self.lastCount) / interval),
+            "averageMessagesPerSecond": round(msgCount / elapsed),
+            "megabytesPerSecond": round((position - self.lastPosition) / interval / 1e6, 2),
+            "averageMegabytesPerSecond": round(position / elapsed / 1e6, 2),
+        }
+        self.lastTime = now
+        self.lastCount = msgCount
+        self.lastPosition = position
+        return json.dumps(line)
+
+    def summary(self, state):
+        elapsed = time.perf_counter() - self.started
+        size = sum(self.bytes)
+        types = {}
+        for msgType in range(256):
+            if self.counts[msgType]:
+                types[chr(msgType)] = {
+                    "messages": self.counts[msgType],
+                    "bytes": self.bytes[msgType],
+                    "skipped": self.skipped[msgType],
+                    "decodeSeconds": self.decodeNs[msgType] / 1e9,
+                    "writeSeconds": self.writeNs[msgType] / 1e9,
+                }
+        premarketNames = {premarketName for (_, premarketName) in WINDOWED_OUTPUTS.values()}
+        windowNames = {name for (name, _) in WINDOWED_OUTPUTS.values()}
+        return {
+            "messages": state.msgCount,
+            "bytes": size,
+            "seconds": elapsed,
+            "messagesPerSecond": state.msgCount / elapsed,
+            "megabytesPerSecond": size / elapsed / 1e6,
+            "windowEnded": state.windowEnded,
+            "unknownMessages": sum(self.counts[t] for t in range(256) if t not in DECODED_TYPES),
+            "skippedMessages": sum(self.skipped),
+            "premarketEvents": sum(rows for name, (rows, _) in self.streams.items() if name in premarketNames),
+            "windowEvents": sum(rows for name, (rows, _) in self.streams.items() if name in windowNames),
+            "types": types,
+            "outputs": {name: {"rows": rows, "writeSeconds": ns / 1e9} for name, (rows, ns) in self.streams.items()},
+        }
+
+    def writeSummary(self, path, state):
+        with open(path, "w") as file:
+            json.dump(self.summary(state), file, indent=2)
+
+
+class TimedWriter:
+    """Writer proxy that counts and times the rows written to an output stream"""
+
+    def __init__(self, writer, stream):
+        self.writer = writer
+        self.stream = stream
+
+    def writerow(self, row):
+        start = time.perf_counter_ns()
+        self.writer.writerow(row)
+        self.stream[0] += 1
+        self.stream[1] += time.perf_counter_ns() - start
+
+    def writerows(self, rows):
+        rows = list(rows)
+        start = time.perf_counter_ns()
+        self.writer.writerows(rows)
+        self.stream[0] += len(rows)
+        self.stream[1] += time.perf_counter_ns() - start
+
+    def writecolumns(self, columns):
+        start = time.perf_counter_ns()
+        self.writer.writecolumns(columns)
+        self.stream[0] += next(len(column) for column in columns if column is not None)
+        self.stream[1] += time.perf_counter_ns() - start
+
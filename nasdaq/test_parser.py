@@ -0,0 +1,85 @@
+"""Run with `python -m pytest` in this directory."""
+from contextlib import ExitStack
+
+import gzip
+import os
+
+import pytest
+
+import parser as itch
+from generate import DEFAULT_MIX, Generator, parseMix
+from orderbook import OrderBook
+
+
+def writeDump(path, messages=60000, seed=1):
+    with open(path, "wb") as file:
+        Generator(file, 50, seed).run(messages, parseMix(DEFAULT_MIX), itch.parseTime("04:00"), itch.parseTime("16:00"))
+    with open(path, "rb") as file, gzip.open(path + ".gz", "wb") as gzipped:
+        gzipped.write(file.read())
+
+
+def parseInto(sourceFile, outputDir, window, engine="python"):
+    os.makedirs(outputDir)
+    with ExitStack() as stack:
+        writers = itch.openCsvOutputs(outputDir, stack, outputs={**itch.OUTPUTS, **itch.BOOK_OUTPUTS})
+        book = OrderBook(writers, window, 10 * 1000000000, 10)
+        itch.parseDump(sourceFile, itch.engineFor(engine), writers, window, None, book)
+    outputs = {}
+    for name in sorted(os.listdir(outputDir)):
+        with open(os.path.join(outputDir, name), "rb") as file:
+            outputs[name] = file.read()
+    return outputs
+
+
+def testSeekMatchesFullScan(tmp_path, monkeypatch):
+    # A dense index, so that the small dump is seeked into instead of scanned from the start
+    monkeypatch.setattr(itch, "INDEX_INTERVAL", 1000)
+    dump = str(tmp_path / "dump")
+    writeDump(dump)
+    window = itch.Window(itch.parseTime("09:30"), itch.parseTime("09:45"), itch.parseTime("09:00"))
+
+    scanned = parseInto(dump + ".gz", tmp_path / "scanned", window)
+    seeked = parseInto(dump, tmp_path / "seeked", window)
+    assert itch.SparseIndex.load(dump).seek(window.skipBefore) > 0
+    assert seeked == scanned
+    # Executions of orders placed before the seek point are resolved as well
+    executions = scanned["executions.csv"].splitlines()[1:]
+    assert executions and all(not line.endswith(b";") for line in executions)
+
+
+def testNumpySeekMatchesFullScan(tmp_path, monkeypatch):
+    monkeypatch.setattr(itch, "INDEX_INTERVAL", 1000)
+    dump = str(tmp_path / "dump")
+    writeDump(dump, seed=2)
+    window = itch.Window(itch.parseTime("09:30"), itch.parseTime("09:45"), itch.parseTime("09:00"))
+
+    scanned = parseInto(dump + ".gz", tmp_path / "scanned", window)
+    assert parseInto(dump, tmp_path / "seeked", window, engine="numpy") == scanned
+
+
+def testIndexBatchFollowsLengthPrefixes(tmp_path):
+    np = pytest.importorskip("numpy")
+    vectorized = pytest.importorskip("vectorized")
+    dump = str(tmp_path / "dump")
+    writeDump(dump, messages=2000)
+    with open(dump, "rb") as file:
+        messages = file.read()
+    offsets = []
+    offset = 0
+    while offset < len(messages):
+        offsets.append(offset)
+        offset += 2 + (messages[offset] << 8 | messages[offset + 1])
+    # Messages of an unknown type and length after the 100th message and at the end, the last one incomplete
+    unknown = b"\x00\x05z1234"
+    fileContent = messages[:offsets[100]] + unknown + messages[offsets[100]:] + unknown + b"\x00\x30q123"
+    offsets = offsets[:101] + [offset + len(unknown) for offset in offsets[100:]] + [len(messages) + len(unknown)]
+    offset = len(messages) + 2 * len(unknown)
+
+    raw = np.frombuffer(fileContent, np.uint8)
+    (indexed, end) = ([], 0)
+    while True:
+        (batch, end) = vectorized.indexBatch(fileContent, raw, end, len(fileContent), 4096)
+        if len(batch) == 0:
+            break
+        indexed.extend(batch.tolist())
+    assert indexed == offsets and end == offset
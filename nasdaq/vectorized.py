@@ -0,0 +1,450 @@
+"""Vectorized ITCH decoder, used by `parser.py --engine numpy`.
+
+Instead of decoding message by message, the dump is processed in batches of BATCH_BYTES: the message boundaries of
+a batch are found with array operations over its bytes (see indexBatch), the offsets are grouped by message type, and
+each group is decoded at once by viewing the gathered message bytes as a big-endian NumPy structured dtype. The
+decoded columns are rendered into CSV lines in bulk as well. The output is identical to the per-message engine in
+parser.py.
+"""
+import time
+
+import numpy as np
+
+import parser as itch
+
+# Bytes of the dump indexed and decoded at once, about 250k messages
+BATCH_BYTES = 8 << 20
+
+# Message lengths of all ITCH 5.0 message types, without the length prefix. 256 never matches a length byte.
+MESSAGE_LENGTHS = np.full(256, 256, np.uint16)
+for (msgType, length) in {b'S': 12, b'R': 39, b'H': 25, b'Y': 20, b'L': 26, b'V': 35, b'W': 12, b'K': 28, b'J': 35,
+                          b'h': 21, b'A': 36, b'F': 40, b'E': 31, b'C': 36, b'X': 23, b'D': 19, b'U': 35, b'P': 44,
+                          b'Q': 40, b'B': 19, b'I': 50, b'N': 20, b'O': 48}.items():
+    MESSAGE_LENGTHS[msgType[0]] = length
+
+HEADER = [("type", "S1"), ("stockId", ">u2"), ("tracking", ">u2"), ("timestampHigh", ">u2"), ("timestampLow", ">u4")]
+
+# Structured dtypes matching the ITCH 5.0 message layouts, starting at the message type byte
+DTYPES = {
+    itch.ORDER_ADD_ID: np.dtype(HEADER + [
+        ("orderId", ">u8"), ("side", "S1"), ("quantity", ">u4"), ("stock", "S8"), ("price", ">u4")]),
+    itch.ORDER_ADD_WITH_MPID_ID: np.dtype(HEADER + [
+        ("orderId", ">u8"), ("side", "S1"), ("quantity", ">u4"), ("stock", "S8"), ("price", ">u4"),
+        ("attribution", "S4")]),
+    itch.ORDER_REPLACE_ID: np.dtype(HEADER + [
+        ("orderId", ">u8"), ("newOrderId", ">u8"), ("quantity", ">u4"), ("price", ">u4")]),
+    itch.ORDER_EXECUTE_ID: np.dtype(HEADER + [
+        ("orderId", ">u8"), ("quantity", ">u4"), ("matchNumber", ">u8")]),
+    itch.ORDER_EXECUTE_WITH_PRICE_ID: np.dtype(HEADER + [
+        ("orderId", ">u8"), ("quantity", ">u4"), ("matchNumber", ">u8"), ("printable", "S1"), ("price", ">u4")]),
+    itch.TRADE_ID: np.dtype(HEADER + [
+        ("orderId", ">u8"), ("side", "S1"), ("quantity", ">u4"), ("stock", "S8"), ("price", ">u4"),
+        ("matchNumber", ">u8")]),
+    itch.ORDER_CANCEL_ID: np.dtype(HEADER + [("orderId", ">u8"), ("quantity", ">u4")]),
+    itch.ORDER_DELETE_ID: np.dtype(HEADER + [("orderId", ">u8")]),
+}
+
+
+# Side names by the side bit of a packed order, unknown orders have no side
+SIDE_NAMES = np.array([b"BUY", b"SELL", b""])
+
+
+def sides(side):
+    if not np.isin(side, [b'B', b'S']).all():
+        raise ValueError
+    return SIDE_NAMES[(side == b'S').astype(np.intp)]
+
+
+def nulls(n):
+    return np.ma.masked_all(n, np.uint64)
+
+
+def orderColumns(msgType, rec, timestamps, resolved):
+    n = len(rec)
+    if msgType == itch.ORDER_REPLACE_ID:
+        return [rec["stockId"], timestamps, rec["newOrderId"], resolved[1], rec["quantity"], rec["price"],
+                np.zeros(n, "S1"), rec["orderId"]]
+    if msgType == itch.ORDER_ADD_WITH_MPID_ID:
+        attribution = np.char.strip(rec["attribution"])
+    else:
+        attribution = np.zeros(n, "S1")
+    return [rec["stockId"], timestamps, rec["orderId"], sides(rec["side"]), rec["quantity"], rec["price"],
+            attribution, nulls(n)]
+
+
+def executionColumns(msgType, rec, timestamps, resolved):
+    if msgType == itch.TRADE_ID:
+        return [timestamps, nulls(len(rec)), rec["stockId"], rec["quantity"], rec["price"], sides(rec["side"])]
+    price = resolved[0] if msgType == itch.ORDER_EXECUTE_ID else rec["price"]
+    return [timestamps, rec["orderId"], rec["stockId"], rec["quantity"], price, resolved[1]]
+
+
+def cancellationColumns(msgType, rec, timestamps, resolved):
+    quantity = nulls(len(rec)) if msgType == itch.ORDER_DELETE_ID else rec["quantity"]
+    return [timestamps, rec["orderId"], rec["stockId"], quantity]
+
+
+# Message types of the windowed records, the events
+EVENT_TYPES = np.frombuffer(b"".join(DTYPES), np.uint8)
+
+# Column of the timestamp in the output of each windowed record kind
+EVENT_TIMESTAMP = {itch.ORDER: 1, itch.EXECUTION: 0, itch.CANCELLATION: 0}
+
+# Per windowed record kind: the message types producing it and how to turn decoded columns into output columns
+STREAMS = {
+    itch.ORDER: ((itch.ORDER_ADD_ID, itch.ORDER_ADD_WITH_MPID_ID, itch.ORDER_REPLACE_ID), orderColumns),
+    itch.EXECUTION: ((itch.ORDER_EXECUTE_ID, itch.ORDER_EXECUTE_WITH_PRICE_ID, itch.TRADE_ID), executionColumns),
+    itch.CANCELLATION: ((itch.ORDER_CANCEL_ID, itch.ORDER_DELETE_ID), cancellationColumns),
+}
+
+
+def concatenate(parts):
+    if any(isinstance(part, np.ma.MaskedArray) for part in parts):
+        return np.ma.concatenate(parts)
+    return np.concatenate(parts)
+
+
+def packOrders(rec):
+    """Pack orders like OrderIndex does, the price doesn't fit into 64 bits with the rest"""
+    low = rec["quantity"].astype(np.uint64) << np.uint64(17) | rec["stockId"].astype(np.uint64) << np.uint64(1)
+    if "side" in rec.dtype.names:
+        low |= (rec["side"] == b'S').astype(np.uint64)
+    return [price << 49 | low for price, low in zip(rec["price"].tolist(), low.tolist())]
+
+
+def lookupOrders(index, orderIds):
+    """Price and side of the given orders in the OrderIndex, the price is masked and the side empty if the order
+    isn't known"""
+    found = np.array([index.get(orderId) for orderId in orderIds.tolist()], dtype=object)
+    unknown = np.equal(found, None)
+    found[unknown] = 0
+    prices = np.ma.masked_array((found >> 49).astype(np.uint64), mask=unknown)
+    return prices, SIDE_NAMES[np.where(unknown, 2, (found & 1).astype(np.intp))]
+
+
+def resolveOrders(orders, decoded):
+    """Apply the order messages of a batch to the OrderIndex and look up the price and side of the executed and
+    replaced orders. Every lookup has to see the index as of its message: order ids are never reused, so all new
+    orders can be added first and all removals applied last, only replace chains are followed in file order.
+    Returns (prices, sides) per message type."""
+    index = orders.orders
+    resolved = {}
+    for msgType in (itch.ORDER_ADD_ID, itch.ORDER_ADD_WITH_MPID_ID):
+        if msgType in decoded:
+            rec = decoded[msgType][1]
+            index.update(zip(rec["orderId"].tolist(), packOrders(rec)))
+
+    replaced = []
+    if itch.ORDER_REPLACE_ID in decoded:
+        rec = decoded[itch.ORDER_REPLACE_ID][1]
+        replaced = rec["orderId"].tolist()
+        replacedSides = []
+        for orderId, newOrderId, packed in zip(replaced, rec["newOrderId"].tolist(), packOrders(rec)):
+            order = index.get(orderId)
+            if order is None:
+                replacedSides.append(2)
+                # Doesn't change the index, but lets a ChunkOrderIndex record the unknown order
+                orders.replace(orderId, newOrderId, packed >> 49, packed >> 17 & 0xFFFFFFFF)
+            else:
+                index[newOrderId] = packed | order & 0x1FFFF
+                replacedSides.append(order & 1)
+        resolved[itch.ORDER_REPLACE_ID] = (None, SIDE_NAMES[replacedSides])
+
+    for msgType in (itch.ORDER_EXECUTE_ID, itch.ORDER_EXECUTE_WITH_PRICE_ID):
+        if msgType in decoded:
+            resolved[msgType] = lookupOrders(index, decoded[msgType][1]["orderId"])
+
+    for msgType in (itch.ORDER_EXECUTE_ID, itch.ORDER_EXECUTE_WITH_PRICE_ID, itch.ORDER_CANCEL_ID):
+        if msgType in decoded:
+            rec = decoded[msgType][1]
+            for orderId, quantity in zip(rec["orderId"].tolist(), rec["quantity"].tolist()):
+                orders.reduce(orderId, quantity)
+    for orderId in replaced:
+        index.pop(orderId, None)
+    if itch.ORDER_DELETE_ID in decoded:
+        for orderId in decoded[itch.ORDER_DELETE_ID][1]["orderId"].tolist():
+            orders.remove(orderId)
+    return resolved
+
+
+# Rows rendered at a time by renderColumns, so that the byte matrices of a block stay in the CPU cache
+RENDER_ROWS = 1 << 14
+POWERS_OF_TEN = 10 ** np.arange(20, dtype=np.uint64)
+
+
+def fieldSteps(column, numeric):
+    """Render steps of one CSV field, (width, text, digits, valid): `text` are the bytes of a constant or one byte
+    string per row, `digits` the values of a number with `width` digits instead. `valid` flags the rows in which the
+    field isn't NULL, None if it never is."""
+    if column is None:
+        return []
+    if column.dtype.kind == "S":
+        return [(column.dtype.itemsize, column.view(np.uint8).reshape(len(column), column.dtype.itemsize), None, None)]
+    valid = None
+    if isinstance(column, np.ma.MaskedArray):
+        valid = ~np.ma.getmaskarray(column)
+        column = column.filled(0)
+    # Numbers with up to 9 digits are rendered with the much faster 32 bit division
+    maxValue = int(column.max()) if len(column) else 0
+    column = column.astype(np.uint32 if maxValue < 1000000000 else np.uint64)
+    if not numeric:
+        return [(len(str(maxValue)), None, column, valid)]
+    # Prices are integer ten-thousandths of a dollar, rendered like "%d.%04d"
+    dollars = column // 10000
+    return [(len(str(maxValue // 10000)), None, dollars, valid), (1, np.frombuffer(b".", np.uint8), None, valid),
+            (-4, None, column - dollars * 10000, valid)]
+
+
+def renderColumns(columns, numericColumns):
+    """Render the rows given as columns in schema order into CSV lines, exactly like CsvWriter.writerow. A column is
+    an unsigned integer array, a masked integer array whose masked values are NULL, a byte string array whose empty
+    values are NULL, or None if all values are NULL. Numeric columns hold integer ten-thousandths.
+
+    Every field is rendered into a fixed width byte matrix, with one row per byte position, along with a mask of the
+    bytes that belong to the lines, e.g. not the leading zeros of a number. Transposed to one line per row, the
+    masked bytes are the CSV text."""
+    separator = np.frombuffer(b";", np.uint8)
+    steps = []
+    for i, column in enumerate(columns):
+        if i > 0:
+            steps.append((1, separator, None, None))
+        steps.extend(fieldSteps(column, i in numericColumns))
+    steps.append((2, np.frombuffer(b"\r\n", np.uint8), None, None))
+    count = next(len(column) for column in columns if column is not None)
+    lineWidth = sum(abs(step[0]) for step in steps)
+
+    text = np.empty((lineWidth, RENDER_ROWS), np.uint8)
+    keep = np.empty((lineWidth, RENDER_ROWS), bool)
+    lines = []
+    for start in range(0, count, RENDER_ROWS):
+        end = min(start + RENDER_ROWS, count)
+        rows = slice(0, end - start)
+        first = 0
+        for (width, constant, digits, valid) in steps:
+            # A negative width is a number with exactly that many digits, including leading zeros
+            fixed = width < 0
+            width = abs(width)
+            block = slice(first, first + width)
+            first += width
+            if constant is not None and constant.ndim == 2:
+                # Byte strings are padded with NUL bytes
+                constant = constant[start:end].T
+                text[block, rows] = constant
+                keep[block, rows] = constant != 0
+                continue
+            if constant is not None:
+                text[block, rows] = constant[:, None]
+            else:
+                remaining = digits[start:end]
+                for position in range(first - 1, first - width - 1, -1):
+                    quotient = remaining // 10
+                    text[position, rows] = remaining - quotient * 10 + 48
+                    remaining = quotient
+            if fixed or constant is not None or width == 1:
+                keep[block, rows] = True
+            else:
+                # Drop the leading zeros, the last digit is always written
+                keep[first - 1, rows] = True
+                keep[block.start:first - 1, rows] = (digits[None, start:end]
+                                                     >= POWERS_OF_TEN[width - 1:0:-1, None].astype(digits.dtype))
+            if valid is not None:
+                keep[block, rows] &= valid[None, start:end]
+        lines.append(np.ascontiguousarray(text[:, rows].T)[np.ascontiguousarray(keep[:, rows].T)].tobytes())
+    return b"".join(lines)
+
+
+def messageChain(raw, candidates):
+    """The offsets of the messages that follow each other from the first of the sorted `candidates`, as long as the
+    next message is one of them. The chain is found by pointer doubling: `jump` maps every candidate to its 2^k-th
+    successor in round k, so the number of candidates reached from the first one doubles every round."""
+    following = candidates + raw[candidates + 1] + 2
+    jump = np.searchsorted(candidates, following)
+    # Successors that aren't candidates jump to the sentinel after the last candidate, which jumps to itself
+    jump[candidates[np.minimum(jump, len(candidates) - 1)] != following] = len(candidates)
+    jump = np.append(jump, len(candidates))
+    reached = np.zeros(len(candidates) + 1, bool)
+    reached[0] = True
+    while jump[0] != len(candidates):
+        reached[jump[reached]] = True
+        jump = jump[jump]
+    return candidates[reached[:-1]]
+
+
+def indexBatch(fileContent, raw, offset, end, batchBytes):
+    """Collect the offsets of the complete messages in [offset, end) that start within batchBytes of offset, returns
+    them and the next offset.
+
+    A message start is a length prefix matching the length of the message type after it, most other positions
+    aren't. From these candidates, the actual messages are the chain of lengths from `offset`, see messageChain.
+    Messages of unknown types or lengths end the chain and are stepped over one by one."""
+    batchEnd = min(end, offset + batchBytes)
+    # The type byte of a candidate and all of its message have to be in [offset, end)
+    scanEnd = min(batchEnd, end - 2)
+    candidates = np.empty(0, np.int64)
+    if scanEnd > offset:
+        # ITCH messages are shorter than 256 bytes, so the first byte of the length prefix is 0
+        lengths = raw[offset + 1:scanEnd + 1]
+        types = raw[offset + 2:scanEnd + 2]
+        candidates = np.flatnonzero((raw[offset:scanEnd] == 0) & (lengths == MESSAGE_LENGTHS[types]))
+        candidates = candidates[candidates + lengths[candidates] + 2 <= end - offset] + offset
+    chains = []
+    while offset < batchEnd:
+        first = np.searchsorted(candidates, offset)
+        if first < len(candidates) and candidates[first] == offset:
+            chain = messageChain(raw, candidates[first:])
+            chains.append(chain)
+            offset = int(chain[-1]) + fileContent[chain[-1] + 1] + 2
+            continue
+        if offset + 2 > end:
+            break
+        following = offset + (fileContent[offset] << 8 | fileContent[offset + 1]) + 2
+        if following > end:
+            break
+        chains.append(np.array([offset]))
+        offset = following
+    return np.concatenate(chains) if chains else np.empty(0, np.int64), offset
+
+
+def timestampsAt(raw, bodies):
+    """The 6 byte timestamps of the messages at the given offsets (of their type byte)"""
+    timestamps = np.zeros(len(bodies), np.uint64)
+    for i in range(5, 11):
+        timestamps = timestamps << np.uint64(8) | raw[bodies + i]
+    return timestamps
+
+
+def gather(raw, offsets, dtype):
+    """Copy the messages at the given offsets into one contiguous array of the structured dtype"""
+    # Every row of the sliding window view is the dump from one offset on, so indexing it copies whole messages
+    messages = np.lib.stride_tricks.sliding_window_view(raw, dtype.itemsize)
+    return messages[offsets].view(dtype).reshape(-1)
+
+
+def countBatch(stats, raw, bodies, types, wanted):
+    """Add the messages of a batch to the per-type counters, directory messages are never skipped"""
+    lengths = (raw[bodies - 2].astype(np.int64) << 8 | raw[bodies - 1]) + 2
+    counts = np.bincount(types, minlength=256)
+    sizes = np.bincount(types, weights=lengths, minlength=256)
+    skipped = np.bincount(types[~wanted & (types != itch.STOCK_DIRECTORY_ID[0])], minlength=256)
+    for msgType in np.flatnonzero(counts).tolist():
+        stats.countBatch(msgType, int(counts[msgType]), int(sizes[msgType]), int(skipped[msgType]))
+
+
+def parseMessages(fileContent, writers, state, start=0, end=None):
+    """Decode the complete messages in [start, end) in vectorized batches and write them to the per-stream writers.
+    Returns the offset after the last decoded message, state.windowEnded is set if parsing stopped because an event
+    past the end of the window was reached."""
+    end = len(fileContent) if end is None else end
+    raw = np.frombuffer(fileContent, dtype=np.uint8)
+    windowStart = state.window.start
+    windowEnd = state.window.end
+    skipBefore = state.window.skipBefore
+    seenStocks = state.seenStocks
+    selected = None if state.selectedStocks is None else np.frombuffer(state.selectedStocks, dtype=np.uint8)
+    stats = state.stats
+    if stats is not None:
+        writers = {name: stats.timedWriter(writer, name) for name, writer in writers.items()}
+    offset = start
+
+    while offset < end:
+        (offsets, offset) = indexBatch(fileContent, raw, offset, end, BATCH_BYTES)
+        if len(offsets) == 0:
+            break
+        bodies = offsets + 2
+        types = raw[bodies]
+
+        # Stock directory and market maker messages are rare, decode them one by one. The directory entries are
+        # resolved against the symbol filter before the other messages of the batch are filtered.
+        directory = []
+        for position in np.flatnonzero((types == itch.STOCK_DIRECTORY_ID[0]) | (types == itch.MARKET_MAKER_ID[0])):
+            body = int(bodies[position])
+            if fileContent[body] == itch.STOCK_DIRECTORY_ID[0]:
+                directoryEntry = itch.handleStockDirectory(fileContent, body)
+                directory.append((position, state.selectStock(directoryEntry), directoryEntry))
+            else:
+                directory.append((position, False, itch.handleMarketMakers(fileContent, body)))
+
+        if selected is None:
+            wanted = np.ones(len(types), dtype=bool)
+        else:
+            # Only the 2 byte stock locate of every message is read to drop the messages of other stocks
+            wanted = selected[raw[bodies + 1].astype(np.uint16) << 8 | raw[bodies + 2]] == 1
+
+        # Like the per-message engine, stop at the first event past the end of the window. The rest of the batch
+        # isn't decoded at all.
+        events = np.flatnonzero(np.isin(types, EVENT_TYPES) & wanted)
+        late = events[timestampsAt(raw, bodies[events]) > windowEnd]
+        stop = int(late[0]) if len(late) > 0 else len(offsets)
+        (bodies, types, wanted) = (bodies[:stop], types[:stop], wanted[:stop])
+
+        # Decode every message type of the batch at once, keeping the positions to restore the file order
+        decoded = {}
+        for msgType, dtype in DTYPES.items():
+            positions = np.flatnonzero((types == msgType[0]) & wanted)
+            if len(positions) == 0:
+                continue
+            decodeStart = time.perf_counter_ns()
+            rec = gather(raw, bodies[positions], dtype)
+            timestamps = rec["timestampHigh"].astype(np.uint64) << np.uint64(32) | rec["timestampLow"]
+            if stats is not None:
+                stats.decodeNs[msgType[0]] += time.perf_counter_ns() - decodeStart
+            decoded[msgType] = (positions, rec, timestamps)
+
+        resolved = resolveOrders(state.orders, decoded)
+
+        for kind, (msgTypes, toColumns) in STREAMS.items():
+            positions = []
+            parts = []
+            for msgType in msgTypes:
+                if msgType not in decoded:
+                    continue
+                (typePositions, rec, typeTimestamps) = decoded[msgType]
+                positions.append(typePositions)
+                parts.append(toColumns(msgType, rec, typeTimestamps, resolved.get(msgType)))
+            if not positions:
+                continue
+
+            # Merge the message types back into file order
+            order = np.argsort(np.concatenate(positions), kind="stable")
+            columns = [concatenate(column)[order] for column in zip(*parts)]
+            timestamps = columns[EVENT_TIMESTAMP[kind]]
+            premarket = timestamps < windowStart
+            (name, premarketName) = itch.WINDOWED_OUTPUTS[kind]
+            for writer, rows in ((writers[premarketName], premarket & (timestamps >= skipBefore)),
+                                 (writers[name], ~premarket)):
+                if rows.any():
+                    writer.writecolumns([column[rows] for column in columns])
+
+        if state.book is not None:
+            # The book has to see the events one by one in file order
+            positions = []
+            timestamps = []
+            for (typePositions, _, typeTimestamps) in decoded.values():
+                positions.append(typePositions)
+                timestamps.append(typeTimestamps)
+            if positions:
+                positions = np.concatenate(positions)
+                order = np.argsort(positions, kind="stable")
+                update = state.book.update
+                for body, timestamp in zip(bodies[positions[order]].tolist(),
+                                           np.concatenate(timestamps)[order].tolist()):
+                    update(fileContent, body, timestamp)
+
+        for position, isSelected, record in directory:
+            if position >= stop:
+                break
+            if isinstance(record, itch.StockDirectoryEntry):
+                if isSelected and record.stockId not in seenStocks:
+                    writers["stocks"].writerow(record)
+                    seenStocks.add(record.stockId)
+            elif wanted[position]:
+                writers["marketMakers"].writerow(record)
+
+        if stats is not None:
+            countBatch(stats, raw, bodies, types, wanted)
+        state.msgCount += int(stop)
+        if stop < len(offsets):
+            state.windowEnded = True
+            return int(offsets[stop])
+        state.progress(state.msgCount, offset)
+    return offset
@@ -0,0 +1,234 @@
+#
+# In-process approximate nearest neighbour index over the text_embed embeddings (enable via 'export ANN_INDEX=ivf').
+#
+# An inverted file (IVF) index: the normalized vectors are clustered around the centroids of a spherical k-means, and a
+# search only scores the vectors of the nprobe lists whose centroids are most similar to the query. Every list keeps
+# its vectors in one contiguous float32 block, so scoring a list is a single matrix-vector product. The caller re-ranks
+# the returned candidates exactly in the database.
+#
+# Rows are identified by their (uri, chunk_num) key. Below min_train_rows, the index is a single list (exact search
+# over everything); it is trained once it reaches that size and trained again whenever it has grown 4x since. Training
+# runs on a background thread over a snapshot of the lists, searches and updates continue on the old lists meanwhile.
+#
+
+import threading
+import numpy as np
+
+min_train_rows = 4096
+max_lists = 4096
+kmeans_iterations = 10
+kmeans_sample_per_list = 64
+
+def normalize(x):
+  x = np.asarray(x, dtype=np.float32)
+  norms = np.linalg.norm(x, axis=-1, keepdims=True)
+  return x / np.maximum(norms, 1e-12)
+
+def nearest_centroid(centroids, vectors):
+  rv = np.empty(len(vectors), dtype=np.int32)
+  for i in range(0, len(vectors), 65536):
+    rv[i:i + 65536] = np.argmax(vectors[i:i + 65536] @ centroids.T, axis=1)
+  return rv
+
+# The vectors of one list and their row ids. Replaced and removed rows stay in the block until more than half of it
+# is dead, and are skipped by searches until then.
+class IvfList:
+
+  def __init__(self, dim, ids=None, vectors=None):
+    self.ids = np.empty(16, dtype=np.int64) if ids is None else ids
+    self.vectors = np.empty((16, dim), dtype=np.float32) if vectors is None else vectors
+    self.size = 0 if ids is None else len(ids)
+    self.dead = 0
+
+  def append(self, row, vector):
+    if self.size == len(self.ids):
+      capacity = max(16, 2 * self.size)
+      self.ids = np.resize(self.ids, capacity)
+      self.vectors = np.resize(self.vectors, (capacity, self.vectors.shape[1]))
+    self.ids[self.size] = row
+    self.vectors[self.size] = vector
+    self.size += 1
+
+  def compact(self, alive):
+    keep = alive[self.ids[:self.size]]
+    self.ids = self.ids[:self.size][keep]
+    self.vectors = self.vectors[:self.size][keep]
+    self.size = len(self.ids)
+    self.dead = 0
+
+class IvfIndex:
+
+  def __init__(self, dim, nprobe):
+    self.dim = dim
+    self.nprobe = nprobe
+    self.lock = threading.Lock()
+    self.keys = [] # row -> (uri, chunk_num), None once the row is dead
+    self.rows = {} # (uri, chunk_num) -> row of its current vector
+    self.alive = np.zeros(1024, dtype=bool)
+    self.list_of = np.zeros(1024, dtype=np.int32)
+    self.centroids = None # None while the index is a single list
+    self.lists = [IvfList(dim)]
+    self.trained_rows = 0
+    self.training = False
+    self.killed_while_training = [] # rows
+    self.added_while_training = [] # (row, vector)
+    self.rng = np.random.default_rng(42)
+    self.ready = False # set once the initial load is complete
+
+  def __len__(self):
+    return len(self.rows)
+
+  def assign(self, vectors):
+    if self.centroids is None:
+      return np.zeros(len(vectors), dtype=np.int32)
+    return nearest_centroid(self.centroids, vectors)
+
+  def kill(self, row):
+    self.alive[row] = False
+    self.keys[row] = None
+    if self.training:
+      self.killed_while_training.append(row)
+    ivf_list = self.lists[self.list_of[row]]
+    ivf_list.dead += 1
+    if 2 * ivf_list.dead > ivf_list.size:
+      ivf_list.compact(self.alive)
+
+  def put(self, keys, embeddings, replace):
+    vectors = normalize(embeddings)
+    lists = self.assign(vectors)
+    for key, vector, list_num in zip(keys, vectors, lists.tolist()):
+      old_row = self.rows.get(key)
+      if old_row is not None:
+        if not replace:
+          continue
+        self.kill(old_row)
+      row = len(self.keys)
+      if row == len(self.alive):
+        self.alive = np.concatenate([self.alive, np.zeros(row, dtype=bool)])
+        self.list_of = np.concatenate([self.list_of, np.zeros(row, dtype=np.int32)])
+      self.keys.append(key)
+      self.rows[key] = row
+      self.alive[row] = True
+      self.list_of[row] = list_num
+      self.lists[list_num].append(row, vector)
+      if self.training:
+        self.added_while_training.append((row, vector))
+    if not self.training and len(self.rows) >= max(min_train_rows, 4 * self.trained_rows):
+      self.training = True
+      threading.Thread(target=self.train, name="ann_train", daemon=True).start()
+
+  # Add or replace the vectors of keys, embeddings is an array or a list of arrays
+  def add(self, keys, embeddings):
+    if len(keys) == 0:
+      return
+    with self.lock:
+      self.put(keys, embeddings, True)
+
+  # Add the vectors of keys that aren't in the index yet: rows loaded from the database while the index paths already
+  # update the index must not overwrite newer versions
+  def load(self, keys, embeddings):
+    if len(keys) == 0:
+      return
+    with self.lock:
+      self.put(keys, embeddings, False)
+
+  def remove(self, keys):
+    with self.lock:
+      for key in keys:
+        row = self.rows.pop(key, None)
+        if row is not None:
+          self.kill(row)
+
+  # Spherical k-means over a sample of the vectors, then every vector is assigned to its nearest centroid. Runs on its
+  # own thread, only taking the snapshot and swapping in the new lists hold the lock: the blocks of the lists are never
+  # modified below their size, so the snapshot only references them. Rows keep their numbers, rows added while training
+  # are assigned when swapping and rows killed meanwhile are counted as dead in their new lists.
+  def train(self):
+    try:
+      self.retrain()
+    finally:
+      with self.lock:
+        self.training = False
+        self.killed_while_training = []
+        self.added_while_training = []
+
+  def retrain(self):
+    with self.lock:
+      n_rows = len(self.keys)
+      alive = self.alive[:n_rows].copy()
+      snapshot = [(ivf_list.ids[:ivf_list.size], ivf_list.vectors[:ivf_list.size]) for ivf_list in self.lists]
+      self.killed_while_training = []
+      self.added_while_training = []
+    ids = np.concatenate([ids for ids, vectors in snapshot])
+    vectors = np.concatenate([vectors for ids, vectors in snapshot])
+    live = alive[ids]
+    ids = ids[live]
+    vectors = vectors[live]
+    if len(ids) == 0:
+      return
+    n_lists = int(min(max_lists, max(1, np.sqrt(len(ids)))))
+    x = vectors[self.rng.choice(len(ids), min(len(ids), n_lists * kmeans_sample_per_list), replace=False)]
+    centroids = x[self.rng.choice(len(x), n_lists, replace=False)]
+    for _ in range(kmeans_iterations):
+      nearest = np.argmax(x @ centroids.T, axis=1)
+      sums = np.zeros_like(centroids)
+      np.add.at(sums, nearest, x)
+      counts = np.bincount(nearest, minlength=n_lists)
+      # Empty clusters keep their centroid
+      centroids = np.where(counts[:, None] > 0, normalize(sums), centroids)
+    assigned = nearest_centroid(centroids, vectors)
+    order = np.argsort(assigned, kind="stable")
+    bounds = np.searchsorted(assigned[order], np.arange(n_lists + 1))
+    lists = [IvfList(self.dim, ids[order[bounds[i]:bounds[i + 1]]], vectors[order[bounds[i]:bounds[i + 1]]])
+             for i in range(n_lists)]
+    list_of = np.zeros(n_rows, dtype=np.int32)
+    list_of[ids] = assigned
+
+    with self.lock:
+      grown = np.zeros(len(self.alive), dtype=np.int32)
+      grown[:n_rows] = list_of
+      list_of = grown
+      for row in self.killed_while_training:
+        if row < n_rows:
+          lists[list_of[row]].dead += 1
+      added = [(row, vector) for row, vector in self.added_while_training if self.alive[row]]
+      if added:
+        added_lists = nearest_centroid(centroids, np.stack([vector for row, vector in added]))
+        for (row, vector), list_num in zip(added, added_lists.tolist()):
+          list_of[row] = list_num
+          lists[list_num].append(row, vector)
+      for ivf_list in lists:
+        if 2 * ivf_list.dead > ivf_list.size:
+          ivf_list.compact(self.alive)
+      self.centroids = centroids
+      self.lists = lists
+      self.list_of = list_of
+      self.trained_rows = len(ids)
+
+  # Returns the keys of the (approximately) k nearest vectors by cosine similarity, most similar first
+  def search(self, query, k):
+    q = normalize(query)
+    with self.lock:
+      if self.centroids is None:
+        probe = [0]
+      else:
+        sims = self.centroids @ q
+        n_probe = min(self.nprobe, len(sims))
+        probe = np.argpartition(-sims, n_probe - 1)[:n_probe].tolist()
+      ids = []
+      scores = []
+      for list_num in probe:
+        ivf_list = self.lists[list_num]
+        ids.append(ivf_list.ids[:ivf_list.size])
+        scores.append(ivf_list.vectors[:ivf_list.size] @ q)
+      ids = np.concatenate(ids)
+      scores = np.concatenate(scores)
+      live = self.alive[ids]
+      ids = ids[live]
+      scores = scores[live]
+      if len(ids) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+      else:
+        top = np.arange(len(ids))
+      top = top[np.argsort(-scores[top])]
+      return [self.keys[row] for row in ids[top].tolist()]
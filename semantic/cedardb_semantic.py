@@ -12,8 +12,12 @@ from fastembed import TextEmbedding
 import resource, platform
 import nltk
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import random
+import struct
+import numpy as np
+import threading
 
 CHARSET = "utf-8"
 
@@ -40,6 +44,38 @@ print("min_sentence_len: {} (set via 'export MIN_SENTENCE_LEN=12')".format(min_s
 n_threads = int(os.environ.get("N_THREADS", "4"))
 print("n_threads: {} (set via 'export N_THREADS=10')".format(n_threads))
 
+# Sentences embedded per call of the model; the bulk index path batches sentences across documents
+embed_batch_size = int(os.environ.get("EMBED_BATCH_SIZE", "256"))
+print("embed_batch_size: {} (set via 'export EMBED_BATCH_SIZE=512')".format(embed_batch_size))
+
+# The bulk index path commits once this many rows have been written (documents are never split across transactions)
+bulk_txn_rows = int(os.environ.get("BULK_TXN_ROWS", "20000"))
+print("bulk_txn_rows: {} (set via 'export BULK_TXN_ROWS=20000')".format(bulk_txn_rows))
+
+# URLs fetched concurrently by the index paths; the fetches share a pool of keep-alive connections
+fetch_threads = int(os.environ.get("FETCH_THREADS", "16"))
+print("fetch_threads: {} (set via 'export FETCH_THREADS=32')".format(fetch_threads))
+
+fetch_timeout = float(os.environ.get("FETCH_TIMEOUT", "30"))
+print("fetch_timeout: {} s (set via 'export FETCH_TIMEOUT=10')".format(fetch_timeout))
+
+# Format of the COPY that streams the rows into the staging table: binary (the embeddings are sent as raw float4s) or
+# text, for servers without binary COPY support
+copy_format = os.environ.get("COPY_FORMAT", "binary").lower()
+print("copy_format: {} (set via 'export COPY_FORMAT=text')".format(copy_format))
+
+# Optional in-process ANN index used by searches without a URL constraint: 'none' (scan text_embed) or 'ivf'
+ann_index_type = os.environ.get("ANN_INDEX", "none").lower()
+print("ann_index_type: {} (set via 'export ANN_INDEX=ivf')".format(ann_index_type))
+
+# IVF lists scored per search; more lists find more of the true nearest neighbours, but take longer
+ann_nprobe = int(os.environ.get("ANN_NPROBE", "32"))
+print("ann_nprobe: {} (set via 'export ANN_NPROBE=64')".format(ann_nprobe))
+
+# Candidates per requested result that the ANN index returns to be re-ranked exactly in the database
+ann_rerank = int(os.environ.get("ANN_RERANK", "10"))
+print("ann_rerank: {} (set via 'export ANN_RERANK=20')".format(ann_rerank))
+
 # This applies to the LRU cache for the query string to embedding function
 cache_size = int(os.environ.get("CACHE_SIZE", "1024"))
 print("cache_size: {} (set via 'export CACHE_SIZE=1024')".format(cache_size))
@@ -93,11 +129,22 @@ CREATE TABLE text_embed
 );
 """.format(VECTOR_DIM)
 
+# ETag and Last-Modified of the indexed version of a URL, sent back in conditional GETs
+ddl_t3 = """
+CREATE TABLE text_embed_validators
+(
+  uri STRING NOT NULL REFERENCES text_embed_freshness (uri)
+  , etag STRING
+  , last_modified STRING
+  , PRIMARY KEY (uri)
+);
+"""
+
 sql_check_exists = """
 SELECT COUNT(*) n FROM information_schema.tables
 WHERE
   table_schema = 'public'
-  AND table_name = 'text_embed';
+  AND table_name = %s;
 """
 
 pool = ConnectionPool(db_url, open=True)
@@ -107,33 +154,81 @@ def run_ddl(ddl):
     conn.execute(ddl)
     conn.commit()
 
-def setup_db():
-  logging.info("Checking whether text_embed table exists")
+def table_exists(table_name):
   n_rows = 0
   with pool.connection() as conn:
-    rs = conn.execute(sql_check_exists)
+    rs = conn.execute(sql_check_exists, (table_name,))
     for row in rs:
       n_rows = row[0]
-  table_exists = (n_rows == 1)
-  if not table_exists:
+  return (n_rows == 1)
+
+def setup_db():
+  logging.info("Checking whether text_embed table exists")
+  if not table_exists("text_embed"):
     logging.info("Creating tables ...")
     run_ddl(ddl_t1)
     run_ddl(ddl_t2)
+    run_ddl(ddl_t3)
     logging.info("OK")
   else:
     logging.info("text_embed table already exists")
+    # Tables created before the validators were stored only lack that table
+    if not table_exists("text_embed_validators"):
+      logging.info("Creating text_embed_validators table ...")
+      run_ddl(ddl_t3)
+
+# New rows are streamed into a staging table with COPY and merged into text_embed with a single statement. Temporary
+# tables are private to a connection, so concurrent requests don't see each other's rows.
+ddl_stage = """
+CREATE TEMPORARY TABLE IF NOT EXISTS text_embed_stage
+(
+  uri STRING NOT NULL
+  , chunk_num INT NOT NULL
+  , chunk STRING NOT NULL
+  , embedding VECTOR ({})
+);
+""".format(VECTOR_DIM)
 
-sql_inserts = """
+sql_copy_stage = "COPY text_embed_stage (uri, chunk_num, chunk, embedding) FROM STDIN"
+
+sql_merge_stage = """
 INSERT INTO text_embed (uri, chunk_num, chunk, embedding)
-VALUES (%(uri)s, %(chunk_num)s, %(chunk)s, %(embedding)s)
+SELECT uri, chunk_num, chunk, embedding FROM text_embed_stage
 ON CONFLICT (uri, chunk_num) DO UPDATE
-SET embedding = EXCLUDED.embedding;
+SET chunk = EXCLUDED.chunk, embedding = EXCLUDED.embedding;
 """
 
-def index_text(conn, uri, text):
-  te_rows = []
-  ca_rows = []
-  n_chunk = 0
+sql_clear_stage = "DELETE FROM text_embed_stage;"
+
+# The binary input format of a VECTOR: dimension and an unused flag field (int16 each), then big-endian float4s
+vector_header = struct.pack(">hh", VECTOR_DIM, 0)
+def vector_binary(embedding):
+  return vector_header + embedding.astype(">f4").tobytes()
+
+# Text form of a VECTOR, with the 9 significant digits that represent any float4 exactly
+def vector_text(embedding):
+  return "[" + ",".join(["%.9g" % x for x in embedding.tolist()]) + "]"
+
+# Write (uri, chunk_num, chunk, embedding) rows, where embedding is a NumPy array, into text_embed
+def write_rows(cur, te_rows):
+  if len(te_rows) == 0:
+    return
+  cur.execute(ddl_stage)
+  if copy_format == "binary":
+    with cur.copy(sql_copy_stage + " (FORMAT BINARY)") as copy:
+      # bytea writes the encoded vector unchanged; the server decodes it with the column's type
+      copy.set_types(["text", "int4", "text", "bytea"])
+      for (uri, chunk_num, chunk, embedding) in te_rows:
+        copy.write_row((uri, chunk_num, chunk, vector_binary(embedding)))
+  else:
+    with cur.copy(sql_copy_stage) as copy:
+      for (uri, chunk_num, chunk, embedding) in te_rows:
+        copy.write_row((uri, chunk_num, chunk, vector_text(embedding)))
+  cur.execute(sql_merge_stage)
+  cur.execute(sql_clear_stage)
+
+# Split a text into the sentences that are embedded, at most max_chunks of them
+def split_sentences(text):
   s_list = []
   for s in nltk.sent_tokenize(text):
     s = s.strip()
@@ -141,27 +236,33 @@ def index_text(conn, uri, text):
       s_list.append(s)
     if max_chunks > 0 and len(s_list) == max_chunks:
       break
-  logging.info("n_chunks = {}".format(len(s_list)))
-  t0 = time.time()
-  embed_list = list(embed_model.embed(s_list)) # Memory leaks here
-  et = time.time() - t0
-  logging.info("Time to generate embeddings(): {:.2f} ms".format(et * 1000))
-  for i in range(0, len(s_list)):
-    row_map = {
-      "uri": uri
-      , "chunk_num": n_chunk
-      , "chunk": s_list[i]
-      , "embedding": embed_list[i].tolist()
-    }
-    te_rows.append(row_map)
-    n_chunk += 1
-  t0 = time.time()
-  with conn.cursor() as cur:
-    cur.executemany(sql_inserts, te_rows)
-  conn.commit()
-  et = time.time() - t0
-  logging.info("DB INSERT time: {:.2f} ms".format(et * 1000))
-  return n_chunk
+  return s_list
+
+# Assign chunk numbers to the sentences of a new version of a document, given the (chunk_num, chunk) rows of its
+# indexed version. Sentences that are already indexed keep their row and embedding, wherever they moved in the text,
+# so the rows are not renumbered; new sentences take over the numbers of removed ones first.
+# Returns ([(chunk_num, sentence)] to embed and write, [chunk_num] to delete)
+def plan_chunks(s_list, old_rows):
+  old = {}
+  for (chunk_num, chunk) in sorted(old_rows):
+    old.setdefault(hashlib.sha256(chunk.encode(CHARSET)).digest(), []).append(chunk_num)
+  new_sentences = []
+  for s in s_list:
+    nums = old.get(hashlib.sha256(s.encode(CHARSET)).digest())
+    if nums:
+      nums.pop(0)
+    else:
+      new_sentences.append(s)
+  freed = sorted(chunk_num for nums in old.values() for chunk_num in nums)
+  next_num = max((chunk_num for (chunk_num, chunk) in old_rows), default=-1) + 1
+  writes = []
+  for s in new_sentences:
+    if len(freed) > 0:
+      writes.append((freed.pop(0), s))
+    else:
+      writes.append((next_num, s))
+      next_num += 1
+  return writes, freed
 
 # Clean any special chars out of text
 def clean_text(text):
@@ -184,6 +285,23 @@ ORDER BY sim DESC
 LIMIT %s
 """
 
+# Exact similarity of the candidates of the ANN index
+sql_rerank_search = """
+WITH c AS
+(
+  SELECT * FROM unnest((%s)::TEXT[], (%s)::INT[]) c (uri, chunk_num)
+),
+s AS
+(
+  SELECT t.uri, 1 - (t.embedding <=> (%s)::VECTOR) sim, t.chunk, t.chunk_num
+  FROM text_embed t JOIN c ON t.uri = c.uri AND t.chunk_num = c.chunk_num
+)
+SELECT * FROM s
+WHERE sim >= %s
+ORDER BY sim DESC
+LIMIT %s
+"""
+
 sql_constrained_search = """
 WITH s AS
 (
@@ -205,13 +323,58 @@ ON CONFLICT (uri) DO UPDATE
 SET sha256 = EXCLUDED.sha256;
 """
 
-sql_uri_fresh = "SELECT sha256 FROM text_embed_freshness WHERE uri = %s;"
+sql_uri_fresh = """
+SELECT f.uri, f.sha256, v.etag, v.last_modified
+FROM text_embed_freshness f LEFT JOIN text_embed_validators v ON v.uri = f.uri
+WHERE f.uri = ANY(%s);
+"""
+
+sql_upsert_validators = """
+INSERT INTO text_embed_validators (uri, etag, last_modified)
+VALUES (%s, %s, %s)
+ON CONFLICT (uri) DO UPDATE
+SET etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified;
+"""
+
+sql_delete_validators = "DELETE FROM text_embed_validators WHERE uri = %s;"
 
-sql_delete_old = """
+sql_uri_chunks = "SELECT uri, chunk_num, chunk FROM text_embed WHERE uri = ANY(%s);"
+
+sql_delete_chunks = """
 DELETE FROM text_embed
-WHERE uri = %s AND chunk_num > %s;
+WHERE uri = %s AND chunk_num = ANY(%s);
 """
 
+ann = None
+if ann_index_type == "ivf":
+  from ann_index import IvfIndex
+  ann = IvfIndex(VECTOR_DIM, ann_nprobe)
+elif ann_index_type != "none":
+  print("ANN_INDEX must be 'none' or 'ivf'")
+  sys.exit(1)
+
+sql_all_embeddings = "SELECT uri, chunk_num, embedding FROM text_embed WHERE embedding IS NOT NULL;"
+
+# Load text_embed into the ANN index, in the background since this takes a while for a large table; searches scan
+# text_embed until it is done. Rows written by the index paths meanwhile are added by them.
+def build_ann():
+  t0 = time.time()
+  keys = []
+  embeddings = []
+  with pool.connection() as conn:
+    with conn.cursor() as cur:
+      for (uri, chunk_num, embedding) in cur.stream(sql_all_embeddings):
+        keys.append((uri, chunk_num))
+        # The embedding is returned in its text form, "[x,y,...]"
+        embeddings.append(np.fromstring(embedding[1:-1], dtype=np.float32, sep=","))
+        if len(keys) == 10000:
+          ann.load(keys, embeddings)
+          keys = []
+          embeddings = []
+  ann.load(keys, embeddings)
+  ann.ready = True
+  logging.warning("ANN index ready: {} rows, {:.2f} s".format(len(ann), time.time() - t0))
+
 @lru_cache(maxsize=cache_size)
 def get_embed_for_search(query_string):
   embed_list = list(embed_model.embed([query_string]))
@@ -226,8 +389,13 @@ def search(conn, terms, limit, url_constraint):
   logging.info("Query string: '{}', URL constraint: {}".format(q, url_constraint))
   t0 = time.time()
   rs = None
+  if url_constraint is None and ann is not None and ann.ready:
+    keys = ann.search(embed, limit * ann_rerank)
+    logging.info("ANN candidates: {}, time: {:.2f} ms".format(len(keys), (time.time() - t0) * 1000))
+    rs = conn.execute(sql_rerank_search, ([uri for (uri, chunk_num) in keys], [chunk_num for (uri, chunk_num) in keys],
+      embed.tolist(), min_similarity, limit))
   # FIXME: this actually slows things down considerably. Why?
-  if url_constraint is not None:
+  elif url_constraint is not None:
     rs = conn.execute(sql_constrained_search, (embed.tolist(), url_constraint, min_similarity, limit))
   else:
     rs = conn.execute(sql_search, (embed.tolist(), min_similarity, limit))
@@ -241,39 +409,82 @@ def search(conn, terms, limit, url_constraint):
   logging.info("SQL query time: {:.2f} ms".format(et * 1000))
   return rv
 
-# Given a URL, return the SHA256 hash of a combination of its headers, or None if there was an error
+# All fetches go through one session, which keeps the connections to each host alive for reuse
+session = requests.Session()
+adapter = requests.adapters.HTTPAdapter(pool_connections=fetch_threads, pool_maxsize=fetch_threads)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+fetch_executor = ThreadPoolExecutor(max_workers=fetch_threads, thread_name_prefix="fetch")
+
+# Given the headers of a response, return the SHA256 hash of a combination of them
 hdr_candidates = ["Last-Modified", "Content-Length", "Etag"]
 hdr_pat = re.compile('(' + '|'.join(hdr_candidates) + ')', re.IGNORECASE)
-def freshness_token(url):
-  rv = None
-  response = requests.head(url, allow_redirects=True)
-  if 200 == response.status_code:
-    hdrs = []
-    for k, v in response.headers.items():
-      if hdr_pat.match(k):
-        hdrs.append(v)
-    if len(hdrs) == 0:
-      hdrs.append(str(random.random())) # Will trigger unconditional refresh of this URL
-    rv = hashlib.sha256(",".join(hdrs).encode("utf-8")).hexdigest()
-  else:
-    logging.warning("HEAD of URL '{}' failed: {}".format(url, response.status_code))
+def freshness_token(headers):
+  hdrs = []
+  for k, v in headers.items():
+    if hdr_pat.match(k):
+      hdrs.append(v)
+  if len(hdrs) == 0:
+    hdrs.append(str(random.random())) # Will trigger unconditional refresh of this URL
+  return hashlib.sha256(",".join(hdrs).encode("utf-8")).hexdigest()
+
+# Return the text of an HTML page
+def html_text(html):
+  soup = BeautifulSoup(html, 'html.parser')
+  # Remove script and style elements
+  for element in soup(['script', 'style']):
+    element.decompose()
+  return soup.get_text(separator=' ', strip=True)
+
+# Look up the freshness token and validators of the indexed version of each URL
+# Returns {url: (sha256, etag, last_modified)} for the URLs that are indexed
+def known_versions(conn, urls):
+  rv = {}
+  if len(urls) > 0:
+    for (url, sha, etag, last_modified) in conn.execute(sql_uri_fresh, (list(urls),)):
+      rv[url] = (sha, etag, last_modified)
   return rv
 
-# Read a URL and return its text or None if there was an error
-def read_url(url):
-  rv = None
+# Fetch a URL with a single GET, conditional on the validators of its indexed version (if there is one), so an
+# unchanged page costs a 304 without a body.
+# Returns (status, sha256, text, validators), where status is one of "changed", "unchanged" or "failed", text is only
+# set for changed pages, and validators is the (etag, last_modified) pair of the response
+def fetch_url(url, known):
+  (db_sha, etag, last_modified) = known if known is not None else (None, None, None)
+  headers = {}
+  if etag is not None:
+    headers["If-None-Match"] = etag
+  if last_modified is not None:
+    headers["If-Modified-Since"] = last_modified
   try:
-    response = requests.get(url)
+    response = session.get(url, headers=headers, timeout=fetch_timeout)
+    if response.status_code == 304 and len(headers) > 0:
+      return ("unchanged", db_sha, None, (etag, last_modified))
     response.raise_for_status()
   except requests.RequestException as e:
-    logging.warning(f"Error fetching URL {url}: {e}\n")
-    return rv
-  soup = BeautifulSoup(response.text, 'html.parser')
-  # Remove script and style elements
-  for element in soup(['script', 'style']):
-    element.decompose()
-  rv = soup.get_text(separator=' ', strip=True)
-  return rv
+    logging.warning("Error fetching URL {}: {}".format(url, e))
+    return ("failed", None, None, None)
+  url_sha = freshness_token(response.headers)
+  validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+  # Servers without validators may still send the same token for an unchanged page
+  if url_sha == db_sha:
+    return ("unchanged", url_sha, None, validators)
+  return ("changed", url_sha, html_text(response.text), validators)
+
+# Fetch many URLs concurrently on the fetch threads, returns the results of fetch_url in the order of urls
+def fetch_urls(urls, known):
+  return list(fetch_executor.map(lambda url: fetch_url(url, known.get(url)), urls))
+
+# Store the validators of URLs that turned out to be unchanged, if the server sent new ones
+def update_validators(conn, urls, known, results):
+  rows = []
+  for url, (status, sha, text, validators) in zip(urls, results):
+    if status == "unchanged" and validators != known[url][1:]:
+      rows.append((url,) + validators)
+  if len(rows) > 0:
+    with conn.cursor() as cur:
+      cur.executemany(sql_upsert_validators, rows)
+    conn.commit()
 
 # Initialize Flask
 app = Flask(__name__)
@@ -306,32 +517,129 @@ def do_index_url(url_base_64):
   url = decode(url_base_64)
   if len(url) == 0: # Empty URL value
     return rv
-  url_sha = freshness_token(url)
-  db_sha = None
   with pool.connection() as conn:
-    rs = conn.execute(sql_uri_fresh, (url,))
-    row = rs.fetchone()
-    if row is not None:
-      db_sha = row[0]
-  # URI there, sha256 is identical
-  logging.debug("db_sha: {}, url_sha: {}".format(db_sha, url_sha))
-  if db_sha == url_sha:
-    return rv
-  # URI not there at all or sha256 doesn't match
-  # Fetch URL and update the DB
-  txt = read_url(url)
+    known = known_versions(conn, [url])
+  results = [fetch_url(url, known.get(url))]
+  (status, url_sha, txt, validators) = results[0]
+  logging.debug("known: {}, status: {}, url_sha: {}".format(known.get(url), status, url_sha))
+  if status == "failed":
+    return Response("FAILED", status=502, mimetype="text/plain")
   with pool.connection() as conn:
-    # UPSERT that (url, url_sha) row first since there is an FK constraint
+    if status == "unchanged":
+      update_validators(conn, [url], known, results)
+      return rv
+    # URI not there at all or sha256 doesn't match: update the DB
+    index_documents(conn, [(url, url_sha, txt, validators)])
+  return rv
+
+# Index many documents at once: the sentences of all documents are embedded together in batches of embed_batch_size,
+# and the rows are written in transactions of about bulk_txn_rows rows, each including the freshness rows of its
+# documents. Only sentences that aren't indexed for their URI yet are embedded and written (see plan_chunks).
+# docs is a list of (uri, sha256, text, validators); sha256 and validators are None for documents posted as text.
+# Returns (number of rows written, number of sentences kept, embedding time in s, DB time in s)
+def index_documents(conn, docs):
+  n_rows = 0
+  n_kept = 0
+  embed_time = 0.0
+  db_time = 0.0
+  group = []
+  group_sentences = []
+  group_kept = 0
+  # The indexed rows of all documents are read in one query
+  old_rows = {}
+  if len(docs) > 0:
+    for (uri, chunk_num, chunk) in conn.execute(sql_uri_chunks, ([uri for (uri, sha, text, validators) in docs],)):
+      old_rows.setdefault(uri, []).append((chunk_num, chunk))
+  for i, (uri, sha, text, validators) in enumerate(docs):
+    s_list = split_sentences(text)
+    (writes, deletes) = plan_chunks(s_list, old_rows.pop(uri, []))
+    group.append((uri, sha, writes, deletes, validators))
+    group_sentences.extend(s for (chunk_num, s) in writes)
+    group_kept += len(s_list) - len(writes)
+    if len(group_sentences) < bulk_txn_rows and i < len(docs) - 1:
+      continue
+    t0 = time.time()
+    embed_list = list(embed_model.embed(group_sentences, batch_size=embed_batch_size))
+    t1 = time.time()
+    te_rows = []
+    pos = 0
+    for (uri, sha, writes, deletes, validators) in group:
+      for (chunk_num, s) in writes:
+        te_rows.append((uri, chunk_num, s, embed_list[pos]))
+        pos += 1
     with conn.cursor() as cur:
-      cur.execute(sql_insert_fresh, (url, url_sha))
+      # The freshness rows go first since there is an FK constraint
+      cur.executemany(sql_insert_fresh, [(uri, sha) for (uri, sha, writes, deletes, validators) in group])
+      # The validators are stored with the rows, so a 304 never skips a version that wasn't indexed
+      cur.executemany(sql_upsert_validators,
+        [(uri,) + validators for (uri, sha, writes, deletes, validators) in group if validators is not None])
+      cur.executemany(sql_delete_validators,
+        [(uri,) for (uri, sha, writes, deletes, validators) in group if validators is None])
+      write_rows(cur, te_rows)
+      cur.executemany(sql_delete_chunks,
+        [(uri, deletes) for (uri, sha, writes, deletes, validators) in group if len(deletes) > 0])
     conn.commit()
-    last_chunk_num = index_text(conn, url, txt)
-    # Remove any rows where chunk_num > last_chunk_num
-    if db_sha is not None and db_sha != url_sha:
-      with conn.cursor() as cur:
-        cur.execute(sql_delete_old, (url, last_chunk_num))
-      conn.commit()
-  return rv
+    if ann is not None:
+      ann.add([(uri, chunk_num) for (uri, chunk_num, s, embedding) in te_rows],
+        [embedding for (uri, chunk_num, s, embedding) in te_rows])
+      ann.remove([(uri, chunk_num) for (uri, sha, writes, deletes, validators) in group for chunk_num in deletes])
+    t2 = time.time()
+    logging.info("Index: {} documents, {} rows written, {} sentences kept, embeddings: {:.2f} ms, DB: {:.2f} ms".format(
+      len(group), len(te_rows), group_kept, (t1 - t0) * 1000, (t2 - t1) * 1000))
+    n_rows += len(te_rows)
+    n_kept += group_kept
+    embed_time += t1 - t0
+    db_time += t2 - t1
+    group = []
+    group_sentences = []
+    group_kept = 0
+  return n_rows, n_kept, embed_time, db_time
+
+#
+# Add many documents to the index in one call, given their URLs and/or their texts:
+#
+#   curl -s -X POST -H "Content-Type: application/json" http://$FLASK_HOST:$FLASK_PORT/index_bulk \
+#     -d '{"urls": ["https://cedardb.com/docs/"], "documents": [{"uri": "notes.txt", "text": "..."}]}'
+#
+# The URLs are fetched concurrently with conditional GETs; URLs that are unchanged (a 304, or the same freshness token)
+# are skipped, posted documents are always indexed.
+# Returns a JSON summary with the indexed, unchanged and failed URIs.
+#
+@app.route("/index_bulk", methods=["POST"])
+def do_index_bulk():
+  data = request.get_json(force=True)
+  urls = list(dict.fromkeys(url.strip() for url in data.get("urls", []) if len(url.strip()) > 0))
+  docs = [(d["uri"], None, d["text"], None) for d in data.get("documents", [])]
+  unchanged = []
+  failed = []
+  # No connection is held while the URLs are fetched
+  with pool.connection() as conn:
+    known = known_versions(conn, urls)
+  t0 = time.time()
+  results = fetch_urls(urls, known)
+  logging.info("Bulk: fetched {} URLs: {:.2f} ms".format(len(urls), (time.time() - t0) * 1000))
+  with pool.connection() as conn:
+    update_validators(conn, urls, known, results)
+    for url, (status, url_sha, txt, validators) in zip(urls, results):
+      if status == "unchanged":
+        unchanged.append(url)
+      elif status == "failed":
+        failed.append(url)
+      else:
+        docs.append((url, url_sha, txt, validators))
+    # All documents are planned against the rows indexed before the request, so a URI may only be written once
+    docs = list({uri: (uri, sha, text, validators) for (uri, sha, text, validators) in docs}.values())
+    (n_rows, n_kept, embed_time, db_time) = index_documents(conn, docs)
+  rv = {
+    "indexed": [uri for (uri, sha, text, validators) in docs]
+    , "unchanged": unchanged
+    , "failed": failed
+    , "rows": n_rows
+    , "kept": n_kept
+    , "embed_ms": round(embed_time * 1000, 2)
+    , "db_ms": round(db_time * 1000, 2)
+  }
+  return Response(json.dumps(rv), status=200, mimetype="application/json")
 
 # TODO: remove as this is not currently used
 @app.route("/index", methods=["POST"])
@@ -339,7 +647,7 @@ def do_index():
   rv = Response("OK", status=200, mimetype="text/plain")
   data = request.get_json(force=True)
   with pool.connection() as conn:
-    rv = index_text(conn, data["uri"], data["text"])
+    index_documents(conn, [(data["uri"], None, data["text"], None)])
   return rv
 
 @app.route("/health", methods=["GET"])
@@ -348,6 +656,8 @@ def health():
 
 # main()
 setup_db()
+if ann is not None:
+  threading.Thread(target=build_ann, name="ann_build", daemon=True).start()
 port = int(os.getenv("FLASK_PORT", 1999))
 from waitress import serve
 serve(app, host="0.0.0.0", port=port, threads=n_threads)
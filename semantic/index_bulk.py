@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import requests
+import sys, os
+import time
+
+host = os.environ.get("FLASK_HOST", "localhost")
+port = os.environ.get("FLASK_PORT", "1999")
+url = "http://{}:{}/index_bulk".format(host, port)
+
+# URLs sent per request; the server embeds the sentences of all of them together
+batch_size = int(os.environ.get("BULK_BATCH_SIZE", "200"))
+
+if len(sys.argv) < 2:
+  print("Usage: {} URL_list_file [URL_list_file_2 ...]  (use '-' to read the URLs from stdin)\n".format(sys.argv[0]))
+  sys.exit(1)
+
+urls = []
+for in_file in sys.argv[1:]:
+  f = sys.stdin if in_file == "-" else open(in_file)
+  urls.extend(line.strip() for line in f if len(line.strip()) > 0)
+
+for i in range(0, len(urls), batch_size):
+  t0 = time.time()
+  req = requests.post(url, json = { "urls": urls[i:i + batch_size] })
+  et = time.time() - t0
+  if req.status_code != 200:
+    print("FAILED: {}".format(req.content.decode("utf-8")))
+    continue
+  rv = req.json()
+  print("URLs {}-{}: {} indexed, {} unchanged, {} failed, {} rows (t = {:.3f} ms)".format(
+    i + 1, min(i + batch_size, len(urls)), len(rv["indexed"]), len(rv["unchanged"]), len(rv["failed"]), rv["rows"],
+    et * 1000))
+  for failed_url in rv["failed"]:
+    print("FAILED to index: {}".format(failed_url))